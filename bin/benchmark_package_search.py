@@ -0,0 +1,76 @@
+'''Benchmarks the package_search action, reporting the number of SQL queries
+and the time taken for different numbers of rows, both with the default
+database check of the results and with ckan.search.trust_index enabled.
+
+Usage:
+    python benchmark_package_search.py CONFIG_FILE [REPEAT]
+
+The site needs to have an up to date search index, and at least as many
+datasets as the largest number of rows benchmarked to get meaningful
+results.
+'''
+import os
+import sys
+import time
+
+from loadconfig import load_config
+
+ROWS = [10, 50, 100, 500, 1000]
+
+
+def count_queries(engine):
+    import sqlalchemy.event
+
+    counter = {'queries': 0}
+
+    def before_cursor_execute(*args, **kwargs):
+        counter['queries'] += 1
+
+    sqlalchemy.event.listen(engine, 'before_cursor_execute',
+                            before_cursor_execute)
+    return counter
+
+
+def run(rows, repeat):
+    import ckan.model as model
+    import ckan.logic as logic
+
+    best = None
+    for i in range(repeat):
+        context = {'model': model, 'session': model.Session,
+                   'ignore_auth': True}
+        start = time.time()
+        result = logic.get_action('package_search')(
+            context, {'q': '*:*', 'rows': rows, 'facet': 'false'})
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+        model.Session.remove()
+    return len(result['results']), best
+
+
+def main():
+    if len(sys.argv) < 2:
+        print __doc__
+        sys.exit(1)
+    load_config(os.path.abspath(sys.argv[1]))
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    from pylons import config
+    import ckan.model as model
+
+    counter = count_queries(model.meta.engine)
+
+    print '%-12s %6s %8s %10s' % ('mode', 'rows', 'queries', 'time (ms)')
+    for trust_index in ('false', 'true'):
+        config['ckan.search.trust_index'] = trust_index
+        mode = 'trust index' if trust_index == 'true' else 'db check'
+        for rows in ROWS:
+            counter['queries'] = 0
+            returned, elapsed = run(rows, repeat)
+            print '%-12s %6i %8i %10.1f' % (mode, returned,
+                                            counter['queries'] / repeat,
+                                            elapsed * 1000)
+
+
+if __name__ == '__main__':
+    main()
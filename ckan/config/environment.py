@@ -171,7 +171,10 @@ def load_environment(global_conf, app_conf):
     import ckan.lib.search as search
     search.SolrSettings.init(config.get('solr_url'),
                              config.get('solr_user'),
-                             config.get('solr_password'))
+                             config.get('solr_password'),
+                             pool_size=config.get('solr_pool_size'),
+                             pool_max_idle=config.get('solr_pool_max_idle'),
+                             timeout=config.get('solr_timeout'))
     search.check_solr_schema_version()
 
     config['routes.map'] = routing.make_map()
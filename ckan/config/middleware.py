@@ -1,8 +1,8 @@
 """Pylons middleware initialization"""
 import urllib
-import urllib2
 import logging
 import json
+import atexit
 import hashlib
 
 import sqlalchemy as sa
@@ -25,6 +25,7 @@ from ckan.lib.i18n import get_locales_from_config
 
 from ckan.config.environment import load_environment
 import ckan.lib.app_globals as app_globals
+import ckan.lib.tracking as tracking
 
 
 def make_app(conf, full_stack=True, static_files=True, **app_conf):
@@ -316,7 +317,17 @@ class TrackingMiddleware(object):
 
     def __init__(self, app, config):
         self.app = app
-        self.engine = sa.create_engine(config.get('sqlalchemy.url'))
+        engine = sa.create_engine(config.get('sqlalchemy.url'))
+        self.writer = tracking.TrackingWriter(
+            engine,
+            batch_size=config.get('ckan.tracking_batch_size',
+                                  tracking.DEFAULT_BATCH_SIZE),
+            max_buffer=config.get('ckan.tracking_max_buffer',
+                                  tracking.DEFAULT_MAX_BUFFER),
+            flush_interval=config.get('ckan.tracking_flush_interval',
+                                      tracking.DEFAULT_FLUSH_INTERVAL))
+        # write the buffered events when the process exits
+        atexit.register(self.writer.stop)
 
     def __call__(self, environ, start_response):
         path = environ['PATH_INFO']
@@ -324,25 +335,20 @@ class TrackingMiddleware(object):
             # do the tracking
             # get the post data
             payload = environ['wsgi.input'].read()
-            parts = payload.split('&')
-            data = {}
-            for part in parts:
-                k, v = part.split('=')
-                data[k] = urllib2.unquote(v).decode("utf8")
+            data = tracking.parse_payload(payload)
             start_response('200 OK', [('Content-Type', 'text/html')])
             # we want a unique anonomized key for each user so that we do
             # not count multiple clicks from the same user.
             key = ''.join([
-                environ['HTTP_USER_AGENT'],
-                environ['REMOTE_ADDR'],
-                environ['HTTP_ACCEPT_LANGUAGE'],
-                environ['HTTP_ACCEPT_ENCODING'],
+                environ.get('HTTP_USER_AGENT', ''),
+                environ.get('REMOTE_ADDR', ''),
+                environ.get('HTTP_ACCEPT_LANGUAGE', ''),
+                environ.get('HTTP_ACCEPT_ENCODING', ''),
             ])
             key = hashlib.md5(key).hexdigest()
-            # store key/data here
-            sql = '''INSERT INTO tracking_raw
-                     (user_key, url, tracking_type)
-                     VALUES (%s, %s, %s)'''
-            self.engine.execute(sql, key, data.get('url'), data.get('type'))
+            # store key/data here, the writer stores them in the database
+            # in batches
+            if data.get('url') and data.get('type'):
+                self.writer.add(key, data['url'], data['type'])
             return []
         return self.app(environ, start_response)
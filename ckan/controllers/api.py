@@ -18,6 +18,7 @@ import ckan.lib.helpers as h
 import ckan.lib.search as search
 import ckan.lib.navl.dictization_functions
 import ckan.lib.jsonp as jsonp
+import ckan.lib.jsonstream as jsonstream
 import ckan.lib.munge as munge
 
 
@@ -82,7 +83,10 @@ class ApiController(base.BaseController):
         response_msg = ''
         if response_data is not None:
             response.headers['Content-Type'] = CONTENT_TYPES[content_type]
-            if content_type == 'json':
+            if content_type == 'json' and \
+                    jsonstream.is_streamed(response_data):
+                response_msg = jsonstream.iterencode(response_data)
+            elif content_type == 'json':
                 response_msg = h.json.dumps(response_data)
             else:
                 response_msg = response_data
@@ -131,8 +135,16 @@ class ApiController(base.BaseController):
         return self._finish(400, response_data, 'json')
 
     def _wrap_jsonp(self, callback, response_msg):
+        if not isinstance(response_msg, basestring):
+            return self._wrap_jsonp_stream(callback, response_msg)
         return '%s(%s);' % (callback, response_msg)
 
+    def _wrap_jsonp_stream(self, callback, chunks):
+        yield '%s(' % callback
+        for chunk in chunks:
+            yield chunk
+        yield ');'
+
     def _set_response_header(self, name, value):
         try:
             value = str(value)
@@ -163,6 +175,8 @@ class ApiController(base.BaseController):
 
         context = {'model': model, 'session': model.Session, 'user': c.user,
                    'api_version': ver}
+        if getattr(function, 'streams_results', False):
+            context['stream_results'] = True
         model.Session()._context = context
         return_dict = {'help': function.__doc__}
         try:
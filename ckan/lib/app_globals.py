@@ -62,6 +62,7 @@ config_details = {
     # int
     'ckan.datasets_per_page': {'default': '20', 'type': 'int'},
     'ckan.activity_list_limit': {'default': '30', 'type': 'int'},
+    'ckan.config_update_interval': {'default': '5', 'type': 'int'},
 }
 
 
@@ -91,6 +92,7 @@ def set_global(key, value):
 
 def delete_global(key):
     model.delete_system_info(key)
+    model.set_system_info('ckan.config_update', str(time.time()))
     log.info('config `%s` deleted' % (key))
 
 def get_globals_key(key):
@@ -105,11 +107,13 @@ def get_globals_key(key):
 
 def reset():
     ''' set updatable values from config '''
+    if model.meta.engine.has_table('system_info'):
+        system_info = model.get_system_info_dict()
+    else:
+        system_info = {}
+
     def get_config_value(key, default=''):
-        if model.meta.engine.has_table('system_info'):
-            value = model.get_system_info(key)
-        else:
-            value = None
+        value = system_info.get(key)
         config_value = config.get(key)
         # sort encodeings if needed
         if isinstance(config_value, str):
@@ -168,11 +172,20 @@ class _Globals(object):
         '''
         self._init()
         self._config_update = None
+        self._last_update_check = 0
         self._mutex = Lock()
 
     def _check_uptodate(self):
         ''' check the config is uptodate needed when several instances are
-        running '''
+        running
+
+        The database is only checked once every ckan.config_update_interval
+        seconds, so changes made by other instances can take that long to
+        show up in this one. '''
+        now = time.time()
+        if now - self._last_update_check < self.config_update_interval:
+            return
+        self._last_update_check = now
         value = model.get_system_info('ckan.config_update')
         if self._config_update != value:
             if self._mutex.acquire(False):
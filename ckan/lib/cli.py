@@ -314,7 +314,13 @@ class SearchIndexCommand(CkanCommand):
     Usage:
       search-index [-i] [-o] [-r] [-e] rebuild [dataset_name]  - reindex dataset_name if given, if not then rebuild
                                                                  full search index (all datasets)
+      search-index [-i] [-o] [-r] [-w N] [-b N] rebuild        - rebuild the full search index in batches of
+                                                                 datasets, using N worker processes
       search-index check                                       - checks for datasets not indexed
+      search-index queue-status                                - shows the datasets waiting in the
+                                                                 asynchronous indexing queue and its lag
+      search-index [-b N] process-queue                        - indexes all the datasets waiting in the queue
+      search-index [-b N] worker                               - keeps indexing the datasets added to the queue
       search-index show DATASET_NAME                           - shows index of a dataset
       search-index clear [dataset_name]                        - clears the search index for the provided dataset or
                                                                  for the whole ckan instance
@@ -345,6 +351,19 @@ immediately available on the search, but slows significantly the process.
 Default is false.'''
                     )
 
+        self.parser.add_option('-w', '--workers', dest='workers',
+            type='int', default=1, help=
+'''Number of worker processes used to index the datasets. If greater than 1,
+the datasets are indexed in batches. Default is 1.'''
+                    )
+
+        self.parser.add_option('-b', '--batch-size', dest='batch_size',
+            type='int', default=None, help=
+'''Number of datasets sent to the search index on each request. Setting it
+enables indexing in batches, with a single commit at the end. Default is 500
+when indexing in batches.'''
+                    )
+
     def command(self):
         self._load_config()
 
@@ -358,6 +377,12 @@ Default is false.'''
             self.rebuild()
         elif cmd == 'check':
             self.check()
+        elif cmd == 'queue-status':
+            self.queue_status()
+        elif cmd == 'process-queue':
+            self.process_queue()
+        elif cmd == 'worker':
+            self.worker()
         elif cmd == 'show':
             self.show()
         elif cmd == 'clear':
@@ -377,7 +402,9 @@ Default is false.'''
             rebuild(only_missing=self.options.only_missing,
                     force=self.options.force,
                     refresh=self.options.refresh,
-                    defer_commit=(not self.options.commit_each))
+                    defer_commit=(not self.options.commit_each),
+                    workers=self.options.workers,
+                    batch_size=self.options.batch_size)
 
         if not self.options.commit_each:
             commit()
@@ -387,6 +414,29 @@ Default is false.'''
 
         check()
 
+    def queue_status(self):
+        from ckan.lib.search import indexing_queue
+
+        status = indexing_queue.queue_status()
+        print 'Datasets waiting to be indexed: %i (%i queue entries)' % (
+            status['datasets'], status['entries'])
+        print 'Lag: %i seconds' % status['lag']
+        print 'Failed entries (not retried any more): %i' % status['failed']
+
+    def process_queue(self):
+        from ckan.lib.search import indexing_queue
+
+        batch_size = (self.options.batch_size or
+                      indexing_queue.DEFAULT_BATCH_SIZE)
+        while indexing_queue.process_queue(batch_size):
+            pass
+
+    def worker(self):
+        from ckan.lib.search import indexing_queue
+
+        indexing_queue.run_worker(batch_size=(
+            self.options.batch_size or indexing_queue.DEFAULT_BATCH_SIZE))
+
     def show(self):
         from ckan.lib.search import show
 
@@ -933,6 +983,44 @@ class Ratings(CkanCommand):
         model.repo.commit_and_remove()
 
 
+class DashboardCommand(CkanCommand):
+    '''Manage the users' dashboard activity feeds
+
+    Usage:
+      dashboard rebuild [USERNAME]  - rebuild the dashboard activity feed of
+                                      the given user (of all users by
+                                      default) from the activities and
+                                      what they follow
+    '''
+
+    summary = __doc__.split('\n')[0]
+    usage = __doc__
+    max_args = 2
+    min_args = 1
+
+    def command(self):
+        self._load_config()
+
+        cmd = self.args[0]
+        if cmd == 'rebuild':
+            self.rebuild(self.args[1] if len(self.args) > 1 else None)
+        else:
+            print 'Command %s not recognized' % cmd
+
+    def rebuild(self, username=None):
+        import ckan.model as model
+        user_id = None
+        if username:
+            user = model.User.get(unicode(username))
+            if not user:
+                print 'User "%s" not found' % username
+                sys.exit(1)
+            user_id = user.id
+        count = model.dashboard.rebuild_activity_feeds(user_id)
+        model.repo.commit_and_remove()
+        print 'Rebuilt dashboard activity feeds: %i activities' % count
+
+
 ## Used by the Tracking class
 _ViewCount = collections.namedtuple("ViewCount", "id name count")
 
@@ -943,6 +1031,11 @@ class Tracking(CkanCommand):
     Usage:
       tracking update [start_date]       - update tracking stats
       tracking export FILE [start_date]  - export tracking stats to a csv file
+      tracking prune                     - delete the raw tracking data which
+                                           has already been summarized
+
+    Without a start_date, the stats are only updated with the tracking data
+    received since the last update.
     '''
 
     summary = __doc__.split('\n')[0]
@@ -967,35 +1060,22 @@ class Tracking(CkanCommand):
             start_date = self.args[2] if len(self.args) > 2 else None
             self.update_all(engine, start_date)
             self.export_tracking(engine, output_file)
+        elif cmd == 'prune':
+            import ckan.lib.tracking as tracking
+            print 'deleted %i raw tracking events' % tracking.prune_raw()
         else:
             print self.__class__.__doc__
             sys.exit(1)
 
     def update_all(self, engine, start_date=None):
+        import ckan.lib.tracking as tracking
         if start_date:
             start_date = datetime.datetime.strptime(start_date, '%Y-%m-%d')
+        start_date = tracking.update_summary(start_date)
+        if start_date:
+            print 'tracking updated from %s' % start_date
         else:
-            # No date given. See when we last have data for and get data
-            # from 2 days before then in case new data is available.
-            # If no date here then use 2011-01-01 as the start date
-            sql = '''SELECT tracking_date from tracking_summary
-                     ORDER BY tracking_date DESC LIMIT 1;'''
-            result = engine.execute(sql).fetchall()
-            if result:
-                start_date = result[0]['tracking_date']
-                start_date += datetime.timedelta(-2)
-                # convert date to datetime
-                combine = datetime.datetime.combine
-                start_date = combine(start_date, datetime.time(0))
-            else:
-                start_date = datetime.datetime(2011, 1, 1)
-        end_date = datetime.datetime.now()
-
-        while start_date < end_date:
-            stop_date = start_date + datetime.timedelta(1)
-            self.update_tracking(engine, start_date)
-            print 'tracking updated for %s' % start_date
-            start_date = stop_date
+            print 'tracking up to date'
 
     def _total_views(self, engine):
         sql = '''
@@ -1047,75 +1127,6 @@ class Tracking(CkanCommand):
                               recent_views_for_id.get(r.id, 0))
                               for r in total_views])
 
-    def update_tracking(self, engine, summary_date):
-        PACKAGE_URL = '%/dataset/'
-        # clear out existing data before adding new
-        sql = '''DELETE FROM tracking_summary
-                 WHERE tracking_date='%s'; ''' % summary_date
-        engine.execute(sql)
-
-        sql = '''SELECT DISTINCT url, user_key,
-                     CAST(access_timestamp AS Date) AS tracking_date,
-                     tracking_type INTO tracking_tmp
-                 FROM tracking_raw
-                 WHERE CAST(access_timestamp as Date)='%s';
-
-                 INSERT INTO tracking_summary
-                   (url, count, tracking_date, tracking_type)
-                 SELECT url, count(user_key), tracking_date, tracking_type
-                 FROM tracking_tmp
-                 GROUP BY url, tracking_date, tracking_type;
-
-                 DROP TABLE tracking_tmp;
-                 COMMIT;''' % summary_date
-        engine.execute(sql)
-
-        # get ids for dataset urls
-        sql = '''UPDATE tracking_summary t
-                 SET package_id = COALESCE(
-                        (SELECT id FROM package p
-                        WHERE t.url LIKE  %s || p.name)
-                     ,'~~not~found~~')
-                 WHERE t.package_id IS NULL
-                 AND tracking_type = 'page';'''
-        engine.execute(sql, PACKAGE_URL)
-
-        # update summary totals for resources
-        sql = '''UPDATE tracking_summary t1
-                 SET running_total = (
-                    SELECT sum(count)
-                    FROM tracking_summary t2
-                    WHERE t1.url = t2.url
-                    AND t2.tracking_date <= t1.tracking_date
-                 )
-                 ,recent_views = (
-                    SELECT sum(count)
-                    FROM tracking_summary t2
-                    WHERE t1.url = t2.url
-                    AND t2.tracking_date <= t1.tracking_date AND t2.tracking_date >= t1.tracking_date - 14
-                 )
-                 WHERE t1.running_total = 0 AND tracking_type = 'resource';'''
-        engine.execute(sql)
-
-        # update summary totals for pages
-        sql = '''UPDATE tracking_summary t1
-                 SET running_total = (
-                    SELECT sum(count)
-                    FROM tracking_summary t2
-                    WHERE t1.package_id = t2.package_id
-                    AND t2.tracking_date <= t1.tracking_date
-                 )
-                 ,recent_views = (
-                    SELECT sum(count)
-                    FROM tracking_summary t2
-                    WHERE t1.package_id = t2.package_id
-                    AND t2.tracking_date <= t1.tracking_date AND t2.tracking_date >= t1.tracking_date - 14
-                 )
-                 WHERE t1.running_total = 0 AND tracking_type = 'page'
-                 AND t1.package_id IS NOT NULL
-                 AND t1.package_id != '~~not~found~~';'''
-        engine.execute(sql)
-
 class PluginInfo(CkanCommand):
     '''Provide info on installed plugins.
     '''
@@ -2,6 +2,7 @@ import datetime
 import urlparse
 
 from pylons import config
+import sqlalchemy
 from sqlalchemy.sql import select
 
 import ckan.logic as logic
@@ -10,22 +11,19 @@ import ckan.lib.helpers as h
 import ckan.lib.dictization as d
 import ckan.new_authz as new_authz
 import ckan.lib.search as search
+import ckan.lib.search.facets as search_facets
 
 ## package save
 
 def group_list_dictize(obj_list, context,
-                       sort_key=lambda x:x['display_name'], reverse=False):
+                       sort_key=lambda x:x['display_name'], reverse=False,
+                       with_package_counts=True):
 
     active = context.get('active', True)
     with_private = context.get('include_private_packages', False)
 
-    query = search.PackageSearchQuery()
-
-    q = {'q': '+capacity:public' if not with_private else '*:*',
-         'fl': 'groups', 'facet.field': ['groups', 'owner_org'],
-         'facet.limit': -1, 'rows': 1}
-
-    query.run(q)
+    if with_package_counts:
+        package_counts = search_facets.group_package_counts(with_private)
 
     result_list = []
 
@@ -41,10 +39,13 @@ def group_list_dictize(obj_list, context,
 
         group_dict['display_name'] = obj.display_name
 
-        if obj.is_organization:
-            group_dict['packages'] = query.facets['owner_org'].get(obj.id, 0)
-        else:
-            group_dict['packages'] = query.facets['groups'].get(obj.name, 0)
+        if with_package_counts:
+            if obj.is_organization:
+                group_dict['packages'] = \
+                    package_counts['owner_org'].get(obj.id, 0)
+            else:
+                group_dict['packages'] = \
+                    package_counts['groups'].get(obj.name, 0)
 
         if context.get('for_view'):
             if group_dict['is_organization']:
@@ -306,7 +307,7 @@ def package_dictize(pkg, context):
 
     return result_dict
 
-def _get_members(context, group, member_type):
+def _members_query(context, group, member_type):
 
     model = context['model']
     Entity = getattr(model, member_type[:-1].capitalize())
@@ -317,12 +318,52 @@ def _get_members(context, group, member_type):
                filter(model.Member.table_name == member_type[:-1])
     if member_type == 'packages':
         q = q.filter(Entity.private==False)
+    return q
+
+def _get_members(context, group, member_type):
+
+    q = _members_query(context, group, member_type)
+    if 'member_limit' in context:
+        # the first page of the members, the next ones are returned by the
+        # member_list action, which sorts them by id too
+        Entity = getattr(context['model'], member_type[:-1].capitalize())
+        return q.order_by(Entity.id).limit(context['member_limit']).all()
     if 'limits' in context and member_type in context['limits']:
-        return q[:context['limits'][member_type]]
+        limit = context['limits'][member_type]
+        if not limit:
+            return []
+        return q[:limit]
     return q.all()
 
+def _count_members(context, group):
+    '''Return the numbers of members of each type of the given group, by
+    member type (e.g. 'packages').'''
+    model = context['model']
+    q = model.Session.query(model.Member.table_name,
+                            sqlalchemy.func.count(model.Member.id)).\
+        outerjoin(model.Package, sqlalchemy.and_(
+            model.Member.table_name == 'package',
+            model.Package.id == model.Member.table_id)).\
+        filter(model.Member.group_id == group.id).\
+        filter(model.Member.state == 'active').\
+        filter(sqlalchemy.or_(model.Member.table_name != 'package',
+                              model.Package.private == False)).\
+        group_by(model.Member.table_name)
+    counts = dict((member_type, 0) for member_type
+                  in ('packages', 'tags', 'groups', 'users'))
+    for table_name, count in q:
+        counts[table_name + 's'] = count
+    return counts
+
 
 def group_dictize(group, context):
+    '''Return a dict of the given group and of its members.
+
+    If context['member_limit'] is given, only the first member_limit members
+    of each type are included, sorted by id, along with the numbers of
+    members of each type in 'member_counts'.
+
+    '''
     model = context['model']
     result_dict = d.table_dictize(group, context)
 
@@ -356,6 +397,9 @@ def group_dictize(group, context):
         _get_members(context, group, 'users'),
         context)
 
+    if 'member_limit' in context:
+        result_dict['member_counts'] = _count_members(context, group)
+
     context['with_capacity'] = False
 
     if context.get('for_view'):
@@ -446,8 +490,14 @@ def user_list_dictize(obj_list, context,
 def member_dictize(member, context):
     return d.table_dictize(member, context)
 
-def user_dictize(user, context):
+def user_dictize(user, context, number_of_edits=None,
+                 number_administered_packages=None):
+    '''Return a dict of the given user.
+
+    The numbers of edits and of administered datasets of the user are
+    counted, unless they are given (e.g. by the query of user_list).
 
+    '''
     if context.get('with_capacity'):
         user, capacity = user
         result_dict = d.table_dictize(user, context, capacity=capacity)
@@ -458,8 +508,12 @@ def user_dictize(user, context):
 
     result_dict['display_name'] = user.display_name
     result_dict['email_hash'] = user.email_hash
-    result_dict['number_of_edits'] = user.number_of_edits()
-    result_dict['number_administered_packages'] = user.number_administered_packages()
+    if number_of_edits is None:
+        number_of_edits = user.number_of_edits()
+    result_dict['number_of_edits'] = number_of_edits
+    if number_administered_packages is None:
+        number_administered_packages = user.number_administered_packages()
+    result_dict['number_administered_packages'] = number_administered_packages
 
     requester = context.get('user')
 
@@ -490,13 +544,24 @@ def task_status_dictize(task_status, context):
 def group_to_api(group, context):
     api_version = context.get('api_version')
     assert api_version, 'No api_version supplied in context'
-    dictized = group_dictize(group, context)
+    # only the names or ids of the datasets are needed, they are loaded with
+    # a single query instead of dictizing the datasets
+    limits = dict(context.get('limits', {}), packages=0)
+    dictized = group_dictize(group, dict(context, limits=limits))
     dictized["extras"] = dict((extra["key"], extra["value"])
                               for extra in dictized["extras"])
+    model = context['model']
     if api_version == 1:
-        dictized["packages"] = sorted([pkg["name"] for pkg in dictized["packages"]])
+        column = model.Package.name
     else:
-        dictized["packages"] = sorted([pkg["id"] for pkg in dictized["packages"]])
+        column = model.Package.id
+    q = model.Session.query(column).\
+        join(model.Member, model.Member.table_id == model.Package.id).\
+        filter(model.Member.group_id == group.id).\
+        filter(model.Member.state == 'active').\
+        filter(model.Member.table_name == 'package').\
+        filter(model.Package.private == False)
+    dictized["packages"] = sorted([row[0] for row in q])
     return dictized
 
 def tag_to_api(tag, context):
@@ -14,6 +14,9 @@ import ckan.model as model
 import ckan.logic as logic
 import ckan.lib.base as base
 
+# Number of users whose notifications are sent between the loads of the
+# user list
+USERS_PAGE_SIZE = 100
 
 def string_to_timedelta(s):
     '''Parse a string s and return a standard datetime.timedelta object.
@@ -221,6 +224,13 @@ def get_and_send_notifications_for_user(user):
 def get_and_send_notifications_for_all_users():
     context = {'model': model, 'session': model.Session, 'ignore_auth': True,
             'keep_sensitive_data': True}
-    users = logic.get_action('user_list')(context, {})
-    for user in users:
-        get_and_send_notifications_for_user(user)
+    # the users are loaded a page at a time
+    offset = 0
+    while True:
+        users = logic.get_action('user_list')(context,
+                {'limit': USERS_PAGE_SIZE, 'offset': offset})
+        for user in users:
+            get_and_send_notifications_for_user(user)
+        if len(users) < USERS_PAGE_SIZE:
+            break
+        offset += USERS_PAGE_SIZE
@@ -0,0 +1,107 @@
+'''
+Lazy JSON encoding of action results.
+
+Actions returning large results (e.g. ``datastore_search``) can put a
+:py:class:`JsonStream` in their result instead of a list, when the caller
+allows it by setting ``stream_results`` in the context. The API controller
+sets it for the actions decorated with :py:func:`ckan.logic.streams_results`,
+and sends their result with :py:func:`iterencode`, which encodes the items of
+the stream as they are produced, so the whole result is never held in
+memory.
+'''
+import json
+
+# Size of the chunks of JSON yielded by iterencode
+CHUNK_SIZE = 64 * 1024
+
+
+class JsonStream(object):
+    '''A list whose items are produced, already encoded as JSON, by an
+    iterable. The optional close function is called once it has been
+    consumed (or the response has been aborted).'''
+    def __init__(self, items, close=None):
+        self.items = items
+        self._close = close
+
+    def close(self):
+        if self._close:
+            self._close()
+            self._close = None
+
+
+class Deferred(object):
+    '''A value which is only known once the streams of the same dict have
+    been consumed, e.g. a link to the next page after the last record.'''
+    def __init__(self, get_value):
+        self.get_value = get_value
+
+
+def is_streamed(obj):
+    '''Return True if obj contains any JsonStream or Deferred values.'''
+    if isinstance(obj, (JsonStream, Deferred)):
+        return True
+    if isinstance(obj, dict):
+        return any(is_streamed(value) for value in obj.itervalues())
+    if isinstance(obj, (list, tuple)):
+        return any(is_streamed(value) for value in obj)
+    return False
+
+
+def _iterencode(obj):
+    if isinstance(obj, JsonStream):
+        yield '['
+        try:
+            first = True
+            for item in obj.items:
+                yield item if first else ', ' + item
+                first = False
+        finally:
+            obj.close()
+        yield ']'
+    elif isinstance(obj, Deferred):
+        for chunk in _iterencode(obj.get_value()):
+            yield chunk
+    elif isinstance(obj, dict) and is_streamed(obj):
+        # values that depend on the streams go last
+        items = sorted(obj.iteritems(),
+                       key=lambda item: isinstance(item[1], Deferred))
+        yield '{'
+        for num, (key, value) in enumerate(items):
+            yield (', ' if num else '') + json.dumps(key) + ': '
+            for chunk in _iterencode(value):
+                yield chunk
+        yield '}'
+    elif isinstance(obj, (list, tuple)) and is_streamed(obj):
+        yield '['
+        for num, value in enumerate(obj):
+            if num:
+                yield ', '
+            for chunk in _iterencode(value):
+                yield chunk
+        yield ']'
+    else:
+        yield json.dumps(obj)
+
+
+def _join(buffer):
+    # WSGI servers only accept byte strings
+    chunk = ''.join(buffer)
+    if isinstance(chunk, unicode):
+        chunk = chunk.encode('utf-8')
+    return chunk
+
+
+def iterencode(obj, chunk_size=CHUNK_SIZE):
+    '''Encode obj as JSON, yielding UTF-8 encoded chunks of about
+    chunk_size bytes.'''
+    buffer = []
+    size = 0
+    for chunk in _iterencode(obj):
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= chunk_size:
+            yield _join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield _join(buffer)
@@ -1,6 +1,8 @@
 import logging
 import sys
+import time
 import cgitb
+import multiprocessing
 import warnings
 import xml.dom.minidom
 import urllib2
@@ -13,10 +15,12 @@ import ckan.plugins as p
 import ckan.logic as logic
 
 from common import (SearchIndexError, SearchError, SearchQueryError,
-                    make_connection, is_available, SolrSettings)
+                    make_connection, solr_connection, is_available,
+                    SolrSettings, pool_stats, reset_pool)
 from index import PackageSearchIndex, NoopSearchIndex
 from query import (TagSearchQuery, ResourceSearchQuery, PackageSearchQuery,
                    QueryOptions, convert_legacy_parameters_to_solr)
+import indexing_queue
 
 log = logging.getLogger(__name__)
 
@@ -58,6 +62,10 @@ _QUERIES = {
 
 SOLR_SCHEMA_FILE_OFFSET = '/admin/file/?file=schema.xml'
 
+# Number of datasets sent to SOLR on each request when rebuilding the index
+# in batches
+DEFAULT_REBUILD_BATCH_SIZE = 500
+
 if SIMPLE_SEARCH:
     import sql as sql
     _INDICES['package'] = NoopSearchIndex
@@ -113,13 +121,19 @@ def dispatch_by_operation(entity_type, entity, operation):
 
 
 class SynchronousSearchPlugin(p.SingletonPlugin):
-    """Update the search index automatically."""
+    """Update the search index automatically.
+
+    If ckan.search.asynchronous_indexing is enabled, the changes are added
+    to the indexing queue instead, to be indexed by a separate worker.
+    """
     p.implements(p.IDomainObjectModification, inherit=True)
 
     def notify(self, entity, operation):
         if not isinstance(entity, model.Package):
             return
-        if operation != model.domain_object.DomainObjectOperation.deleted:
+        if indexing_queue.is_enabled() and not SIMPLE_SEARCH:
+            indexing_queue.enqueue(entity.id, operation)
+        elif operation != model.domain_object.DomainObjectOperation.deleted:
             dispatch_by_operation(
                 entity.__class__.__name__,
                 logic.get_action('package_show')(
@@ -134,7 +148,8 @@ class SynchronousSearchPlugin(p.SingletonPlugin):
             log.warn("Discarded Sync. indexing for: %s" % entity)
 
 
-def rebuild(package_id=None, only_missing=False, force=False, refresh=False, defer_commit=False):
+def rebuild(package_id=None, only_missing=False, force=False, refresh=False,
+            defer_commit=False, workers=1, batch_size=None):
     '''
         Rebuilds the search index.
 
@@ -143,6 +158,13 @@ def rebuild(package_id=None, only_missing=False, force=False, refresh=False, def
         datasets not already indexed will be processed. If force equals
         True, if an exception is found, the exception will be logged, but
         the process will carry on.
+
+        If workers is greater than one or a batch_size is provided, the
+        datasets are split in batches of batch_size datasets (Default is
+        DEFAULT_REBUILD_BATCH_SIZE), which are indexed by a pool of workers
+        processes, sending each batch to SOLR in a single request. In this
+        mode nothing is commited until all batches have been indexed, and
+        not even then if defer_commit is True.
     '''
     log.info("Rebuilding search index...")
 
@@ -175,6 +197,16 @@ def rebuild(package_id=None, only_missing=False, force=False, refresh=False, def
             if not refresh:
                 package_index.clear()
 
+        if workers > 1 or batch_size:
+            _rebuild_in_batches(list(package_ids), force=force,
+                                workers=workers,
+                                batch_size=batch_size or
+                                DEFAULT_REBUILD_BATCH_SIZE)
+            if not defer_commit:
+                package_index.commit()
+            log.info('Finished rebuilding search index.')
+            return
+
         for pkg_id in package_ids:
             try:
                 package_index.update_dict(
@@ -198,6 +230,115 @@ def rebuild(package_id=None, only_missing=False, force=False, refresh=False, def
     log.info('Finished rebuilding search index.')
 
 
+def _init_rebuild_worker():
+    # Make sure that the worker processes do not share the database and
+    # SOLR connections inherited from the parent process
+    reset_pool()
+    model.Session.remove()
+    model.meta.engine.dispose()
+
+
+def _index_batch(args):
+    '''
+        Indexes a batch of datasets, sending all of them to SOLR in a single
+        request.
+
+        Returns a tuple with the number of datasets indexed and the number
+        of datasets that could not be indexed.
+    '''
+    package_ids, force = args
+
+    package_index = index_for(model.Package)
+    context = {'model': model, 'ignore_auth': True, 'validate': False}
+
+    pkg_dicts = []
+    failed = 0
+    try:
+        for pkg_id in package_ids:
+            try:
+                pkg_dicts.append(logic.get_action('package_show')(
+                    context.copy(), {'id': pkg_id}))
+            except Exception, e:
+                log.error('Error while indexing dataset %s: %s' %
+                          (pkg_id, str(e)))
+                if not force:
+                    raise
+                log.error(text_traceback())
+                failed += 1
+
+        try:
+            package_index.index_packages(pkg_dicts)
+        except Exception:
+            if not force:
+                raise
+            # Index the datasets one by one to find out which ones are
+            # failing
+            for pkg_dict in pkg_dicts:
+                try:
+                    package_index.index_packages([pkg_dict])
+                except Exception, e:
+                    log.error('Error while indexing dataset %s: %s' %
+                              (pkg_dict.get('id'), str(e)))
+                    log.error(text_traceback())
+                    failed += 1
+    finally:
+        # Don't keep the dictized objects in the session across batches
+        model.Session.remove()
+
+    return len(package_ids) - failed, failed
+
+
+def _rebuild_in_batches(package_ids, force=False, workers=1,
+                        batch_size=DEFAULT_REBUILD_BATCH_SIZE):
+    '''
+        Indexes the provided datasets in batches of batch_size datasets,
+        using a pool of workers processes if workers is greater than one.
+
+        The progress and throughput are logged after each batch.
+    '''
+    total = len(package_ids)
+    batches = [(package_ids[i:i + batch_size], force)
+               for i in range(0, total, batch_size)]
+
+    log.info('Indexing %i datasets in %i batches of %i using %i worker(s)...'
+             % (total, len(batches), batch_size, workers))
+
+    pool = None
+    if workers > 1:
+        # The connections are not safe to be used across processes, so
+        # don't let the workers inherit the ones from this process
+        model.Session.remove()
+        model.meta.engine.dispose()
+        pool = multiprocessing.Pool(workers, _init_rebuild_worker)
+        results = pool.imap_unordered(_index_batch, batches)
+    else:
+        results = (_index_batch(batch) for batch in batches)
+
+    start = time.time()
+    indexed = failed = 0
+    try:
+        for batch_indexed, batch_failed in results:
+            indexed += batch_indexed
+            failed += batch_failed
+            elapsed = time.time() - start
+            log.info('Indexed %i/%i datasets (%i errors), %.1f datasets/s'
+                     % (indexed + failed, total, failed,
+                        indexed / elapsed if elapsed else 0))
+    except:
+        if pool:
+            pool.terminate()
+            pool = None
+        raise
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    elapsed = time.time() - start
+    log.info('Indexed %i datasets in %.1f seconds (%i errors)'
+             % (indexed, elapsed, failed))
+
+
 def commit():
     package_index = index_for(model.Package)
     package_index.commit()
@@ -271,23 +412,28 @@ def check_solr_schema_version(schema_file=None):
     if not schema_file:
         solr_url, solr_user, solr_password = SolrSettings.get()
 
-        http_auth = None
+        headers = {}
         if solr_user is not None and solr_password is not None:
             http_auth = solr_user + ':' + solr_password
-            http_auth = 'Basic ' + http_auth.encode('base64').strip()
+            headers['Authorization'] = \
+                'Basic ' + http_auth.encode('base64').strip()
 
         url = solr_url.strip('/') + SOLR_SCHEMA_FILE_OFFSET
 
-        req = urllib2.Request(url=url)
-        if http_auth:
-            req.add_header('Authorization', http_auth)
-
-        res = urllib2.urlopen(req)
+        # reuse the HTTP connection of a pooled SOLR connection
+        with solr_connection() as conn:
+            conn.conn.request('GET', conn.path.rstrip('/') +
+                              SOLR_SCHEMA_FILE_OFFSET, headers=headers)
+            res = conn.conn.getresponse()
+            schema = res.read()
+            if res.status != 200:
+                raise SearchError('Could not get the SOLR schema from %s: '
+                                  '%s %s' % (url, res.status, res.reason))
     else:
         url = 'file://%s' % schema_file
-        res = urllib2.urlopen(url)
+        schema = urllib2.urlopen(url).read()
 
-    tree = xml.dom.minidom.parseString(res.read())
+    tree = xml.dom.minidom.parseString(schema)
 
     version = tree.documentElement.getAttribute('version')
     if not len(version):
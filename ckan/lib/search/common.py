@@ -1,5 +1,10 @@
-from pylons import config
+import time
 import logging
+import threading
+import contextlib
+import collections
+
+from pylons import config
 log = logging.getLogger(__name__)
 
 
@@ -16,22 +21,40 @@ class SearchQueryError(SearchError):
 
 DEFAULT_SOLR_URL = 'http://127.0.0.1:8983/solr'
 
+# Maximum number of idle connections kept open by each process
+DEFAULT_POOL_SIZE = 10
+# Seconds an idle connection can be kept before it is discarded, as the
+# SOLR server will close keep-alive connections after a while
+DEFAULT_POOL_MAX_IDLE = 60
+
 
 class SolrSettings(object):
     _is_initialised = False
     _url = None
     _user = None
     _password = None
+    pool_size = DEFAULT_POOL_SIZE
+    pool_max_idle = DEFAULT_POOL_MAX_IDLE
+    timeout = None
 
     @classmethod
-    def init(cls, url, user=None, password=None):
+    def init(cls, url, user=None, password=None, pool_size=None,
+             pool_max_idle=None, timeout=None):
         if url is not None:
             cls._url = url
             cls._user = user
             cls._password = password
         else:
             cls._url = DEFAULT_SOLR_URL
+        if pool_size is not None:
+            cls.pool_size = int(pool_size)
+        if pool_max_idle is not None:
+            cls.pool_max_idle = int(pool_max_idle)
+        if timeout is not None:
+            cls.timeout = float(timeout)
         cls._is_initialised = True
+        # connections made with the old settings are no longer valid
+        _pool.clear()
 
     @classmethod
     def get(cls):
@@ -47,14 +70,11 @@ def is_available():
     Return true if we can successfully connect to Solr.
     """
     try:
-        conn = make_connection()
-        conn.query("*:*", rows=1)
+        with solr_connection() as conn:
+            conn.query("*:*", rows=1)
     except Exception, e:
         log.exception(e)
         return False
-    finally:
-        if 'conn' in dir():
-            conn.close()
 
     return True
 
@@ -65,6 +85,132 @@ def make_connection():
     assert solr_url is not None
     if solr_user is not None and solr_password is not None:
         return SolrConnection(solr_url, http_user=solr_user,
-                              http_pass=solr_password)
+                              http_pass=solr_password,
+                              timeout=SolrSettings.timeout)
     else:
-        return SolrConnection(solr_url)
+        return SolrConnection(solr_url, timeout=SolrSettings.timeout)
+
+
+class SolrConnectionPool(object):
+    """
+    Thread safe pool of persistent connections to the SOLR server.
+
+    Connections are returned to the pool after being used, and reused by
+    later requests, avoiding setting up a new HTTP connection every time.
+    Connections which have been idle for longer than
+    SolrSettings.pool_max_idle seconds, or which were in use when an error
+    happened, are closed instead of being reused.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = collections.deque()
+        self._in_use = 0
+        self._created = 0
+        self._reused = 0
+        self._discarded = 0
+
+    def get(self):
+        """Return an idle connection or a new one if there is none."""
+        now = time.time()
+        with self._lock:
+            while self._idle:
+                conn, last_used = self._idle.pop()
+                if now - last_used <= SolrSettings.pool_max_idle:
+                    self._in_use += 1
+                    self._reused += 1
+                    return conn
+                self._discard(conn)
+            self._in_use += 1
+            self._created += 1
+        try:
+            return make_connection()
+        except:
+            with self._lock:
+                self._in_use -= 1
+            raise
+
+    def put(self, conn, healthy=True):
+        """Return a connection to the pool once it is no longer used."""
+        with self._lock:
+            self._in_use -= 1
+            if healthy and len(self._idle) < SolrSettings.pool_size:
+                self._idle.append((conn, time.time()))
+                return
+            self._discard(conn)
+
+    def clear(self):
+        """Close all the idle connections."""
+        with self._lock:
+            while self._idle:
+                conn, last_used = self._idle.pop()
+                self._discard(conn)
+
+    def reset(self):
+        """Forget about all the connections, without closing them.
+
+        Used on forked processes, which must not use the connections
+        inherited from their parent."""
+        with self._lock:
+            self._idle.clear()
+            self._in_use = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': SolrSettings.pool_size,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'created': self._created,
+                'reused': self._reused,
+                'discarded': self._discarded,
+            }
+
+    def _discard(self, conn):
+        self._discarded += 1
+        try:
+            conn.close()
+        except Exception, e:
+            log.debug('Error closing SOLR connection: %r' % e)
+
+
+_pool = SolrConnectionPool()
+
+
+@contextlib.contextmanager
+def solr_connection():
+    """
+    Context manager that provides a connection from the pool, returning it
+    to the pool afterwards::
+
+        with solr_connection() as conn:
+            conn.query('*:*')
+
+    If an exception other than an error reported by SOLR is raised while
+    using it, the connection is discarded.
+    """
+    from solr import SolrException
+    conn = _pool.get()
+    healthy = True
+    try:
+        yield conn
+    except Exception, e:
+        # errors reported by SOLR leave the connection in a usable state
+        healthy = isinstance(e, SolrException)
+        raise
+    finally:
+        _pool.put(conn, healthy)
+
+
+def pool_stats():
+    """
+    Return a dict with statistics about the SOLR connection pool of this
+    process: its size, the number of idle and in use connections, and how
+    many connections have been created, reused and discarded so far.
+    """
+    return _pool.stats()
+
+
+def reset_pool():
+    """Discard the connections inherited by a forked process."""
+    _pool.reset()
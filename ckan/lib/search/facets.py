@@ -0,0 +1,115 @@
+'''
+Helpers to resolve the display names of search facet values in bulk, and to
+count the datasets of all the groups and organizations at once.
+'''
+import time
+import logging
+
+from pylons import config
+from sqlalchemy import or_
+
+import ckan.model as model
+import ckan.plugins as p
+
+log = logging.getLogger(__name__)
+
+# Maps group and organization names (and ids) to their display names. It is
+# cleared whenever a group is modified in this process, and expires after
+# ckan.search.facets.display_names_cache_expires seconds so changes made by
+# other processes get picked up as well.
+_group_display_names = {}
+_group_display_names_created = time.time()
+
+DEFAULT_CACHE_EXPIRES = 300
+
+# The numbers of datasets of the groups and organizations, by whether the
+# private datasets are counted. It is cleared whenever the search index is
+# modified in this process, and expires after
+# ckan.search.facets.package_counts_cache_expires seconds so changes made by
+# other processes get picked up as well.
+_group_package_counts = {}
+_group_package_counts_created = time.time()
+
+DEFAULT_COUNTS_CACHE_EXPIRES = 60
+
+
+def clear_group_display_names():
+    '''Empties the group and organization display names cache.'''
+    global _group_display_names, _group_display_names_created
+    _group_display_names = {}
+    _group_display_names_created = time.time()
+
+
+def group_display_names(names):
+    '''
+        Returns a dict mapping each of the given group or organization names
+        or ids to its display name.
+
+        The ones not found in the cache are looked up with a single query.
+        Names of groups that don't exist are mapped to themselves.
+    '''
+    expires = int(config.get('ckan.search.facets.display_names_cache_expires',
+                             DEFAULT_CACHE_EXPIRES))
+    if time.time() - _group_display_names_created > expires:
+        clear_group_display_names()
+
+    cache = _group_display_names
+    missing = [name for name in set(names) if name not in cache]
+    if missing:
+        found = {}
+        query = model.Session.query(model.Group.id, model.Group.name,
+                                    model.Group.title)\
+            .filter(or_(model.Group.name.in_(missing),
+                        model.Group.id.in_(missing)))
+        for id_, name, title in query:
+            display_name = title if title else name
+            found[id_] = display_name
+            found[name] = display_name
+        for name in missing:
+            cache[name] = found.get(name, name)
+
+    return dict((name, cache[name]) for name in names)
+
+
+def clear_group_package_counts():
+    '''Empties the group and organization dataset counts cache.'''
+    global _group_package_counts, _group_package_counts_created
+    _group_package_counts = {}
+    _group_package_counts_created = time.time()
+
+
+def group_package_counts(with_private=False):
+    '''
+        Returns the numbers of datasets of the groups and organizations as a
+        dict with the keys 'groups', which maps the group names to their
+        counts, and 'owner_org', which maps the organization ids to theirs.
+
+        All the counts are got with a single facet query, whose results are
+        cached.
+    '''
+    expires = int(config.get(
+        'ckan.search.facets.package_counts_cache_expires',
+        DEFAULT_COUNTS_CACHE_EXPIRES))
+    if time.time() - _group_package_counts_created > expires:
+        clear_group_package_counts()
+
+    cache = _group_package_counts
+    if with_private not in cache:
+        # imported here to avoid circular imports
+        from ckan.lib.search.query import PackageSearchQuery
+        query = PackageSearchQuery()
+        query.run({'q': '+capacity:public' if not with_private else '*:*',
+                   'fl': 'groups', 'facet.field': ['groups', 'owner_org'],
+                   'facet.limit': -1, 'rows': 1})
+        cache[with_private] = {'groups': query.facets['groups'],
+                               'owner_org': query.facets['owner_org']}
+    return cache[with_private]
+
+
+class FacetDisplayNamesPlugin(p.SingletonPlugin):
+    '''Clears the display names cache when a group or organization changes.'''
+    p.implements(p.IDomainObjectModification, inherit=True)
+
+    def notify(self, entity, operation):
+        if isinstance(entity, model.Group):
+            clear_group_display_names()
@@ -3,6 +3,7 @@ import string
 import logging
 import collections
 import json
+import copy
 from dateutil.parser import parse
 
 import re
@@ -10,7 +11,8 @@ import re
 from pylons import config
 from paste.deploy.converters import asbool
 
-from common import SearchIndexError, make_connection
+from common import SearchIndexError, solr_connection
+import facets
 from ckan.model import PackageRelationship
 import ckan.model as model
 from ckan.plugins import (PluginImplementations,
@@ -41,21 +43,20 @@ def escape_xml_illegal_chars(val, replacement=''):
 
 def clear_index():
     import solr.core
-    conn = make_connection()
+    facets.clear_group_package_counts()
     query = "+site_id:\"%s\"" % (config.get('ckan.site_id'))
-    try:
-        conn.delete_query(query)
-        conn.commit()
-    except socket.error, e:
-        err = 'Could not connect to SOLR %r: %r' % (conn.url, e)
-        log.error(err)
-        raise SearchIndexError(err)
-    except solr.core.SolrException, e:
-        err = 'SOLR %r exception: %r' % (conn.url, e)
-        log.error(err)
-        raise SearchIndexError(err)
-    finally:
-        conn.close()
+    with solr_connection() as conn:
+        try:
+            conn.delete_query(query)
+            conn.commit()
+        except socket.error, e:
+            err = 'Could not connect to SOLR %r: %r' % (conn.url, e)
+            log.error(err)
+            raise SearchIndexError(err)
+        except solr.core.SolrException, e:
+            err = 'SOLR %r exception: %r' % (conn.url, e)
+            log.error(err)
+            raise SearchIndexError(err)
 
 class SearchIndex(object):
     """
@@ -100,6 +101,66 @@ class PackageSearchIndex(SearchIndex):
     def index_package(self, pkg_dict, defer_commit=False):
         if pkg_dict is None:
             return
+
+        if (not pkg_dict.get('state')) or ('active' not in pkg_dict.get('state')):
+            return self.delete_package(pkg_dict)
+
+        pkg_dict = self.prepare_package_dict(pkg_dict)
+
+        # send to solr:
+        try:
+            commit = not defer_commit
+            if not asbool(config.get('ckan.search.solr_commit', 'true')):
+                commit = False
+            with solr_connection() as conn:
+                conn.add_many([pkg_dict], _commit=commit)
+        except Exception, e:
+            log.exception(e)
+            raise SearchIndexError(e)
+
+        facets.clear_group_package_counts()
+
+        commit_debug_msg = 'Not commited yet' if defer_commit else 'Commited'
+        log.debug('Updated index for %s [%s]' % (pkg_dict.get('name'), commit_debug_msg))
+
+    def index_packages(self, pkg_dicts):
+        '''
+            Index several datasets with a single request to SOLR.
+
+            Datasets that are not active are removed from the index instead.
+            The changes are never commited, so callers are expected to call
+            commit() once they have finished indexing.
+        '''
+        docs = []
+        for pkg_dict in pkg_dicts:
+            if pkg_dict is None:
+                continue
+            if (not pkg_dict.get('state')) or ('active' not in pkg_dict.get('state')):
+                self.delete_package(pkg_dict)
+                continue
+            docs.append(self.prepare_package_dict(pkg_dict))
+
+        if not docs:
+            return
+
+        try:
+            with solr_connection() as conn:
+                conn.add_many(docs, _commit=False)
+        except Exception, e:
+            log.exception(e)
+            raise SearchIndexError(e)
+
+        facets.clear_group_package_counts()
+
+        log.debug('Updated index for %i datasets [Not commited yet]' % len(docs))
+
+    def prepare_package_dict(self, pkg_dict):
+        '''
+            Turn a dataset dict as returned by package_show into the
+            document that gets sent to SOLR. The given dict is not modified,
+            so it can be indexed again if sending it fails.
+        '''
+        pkg_dict = copy.deepcopy(pkg_dict)
         pkg_dict['data_dict'] = json.dumps(pkg_dict)
 
         # add to string field for sorting
@@ -107,9 +168,6 @@ class PackageSearchIndex(SearchIndex):
         if title:
             pkg_dict['title_string'] = title
 
-        if (not pkg_dict.get('state')) or ('active' not in pkg_dict.get('state')):
-            return self.delete_package(pkg_dict)
-
         index_fields = RESERVED_FIELDS + pkg_dict.keys()
 
         # include the extras in the main namespace
@@ -243,44 +301,28 @@ class PackageSearchIndex(SearchIndex):
 
         assert pkg_dict, 'Plugin must return non empty package dict on index'
 
-        # send to solr:
-        try:
-            conn = make_connection()
-            commit = not defer_commit
-            if not asbool(config.get('ckan.search.solr_commit', 'true')):
-                commit = False
-            conn.add_many([pkg_dict], _commit=commit)
-        except Exception, e:
-            log.exception(e)
-            raise SearchIndexError(e)
-        finally:
-            conn.close()
-
-        commit_debug_msg = 'Not commited yet' if defer_commit else 'Commited'
-        log.debug('Updated index for %s [%s]' % (pkg_dict.get('name'), commit_debug_msg))
+        return pkg_dict
 
     def commit(self):
         try:
-            conn = make_connection()
-            conn.commit(wait_searcher=False)
+            with solr_connection() as conn:
+                conn.commit(wait_searcher=False)
         except Exception, e:
             log.exception(e)
             raise SearchIndexError(e)
-        finally:
-            conn.close()
+        facets.clear_group_package_counts()
 
 
     def delete_package(self, pkg_dict):
-        conn = make_connection()
         query = "+%s:%s (+id:\"%s\" OR +name:\"%s\") +site_id:\"%s\"" % (TYPE_FIELD, PACKAGE_TYPE,
                                                        pkg_dict.get('id'), pkg_dict.get('id'),
                                                        config.get('ckan.site_id'))
         try:
-            conn.delete_query(query)
-            if asbool(config.get('ckan.search.solr_commit', 'true')):
-                conn.commit()
+            with solr_connection() as conn:
+                conn.delete_query(query)
+                if asbool(config.get('ckan.search.solr_commit', 'true')):
+                    conn.commit()
         except Exception, e:
             log.exception(e)
             raise SearchIndexError(e)
-        finally:
-            conn.close()
+        facets.clear_group_package_counts()
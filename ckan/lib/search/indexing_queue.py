@@ -0,0 +1,203 @@
+'''
+Asynchronous indexing of datasets.
+
+When ``ckan.search.asynchronous_indexing`` is enabled, dataset changes are
+stored in the ``search_index_queue`` table, as part of the same transaction
+that modified the dataset, instead of being sent to SOLR straight away. The
+queue is processed by a separate worker (see ``paster search-index worker``),
+which coalesces repeated changes to the same dataset, sends the documents to
+SOLR in batches and retries the ones that fail.
+'''
+import time
+import datetime
+import logging
+
+from pylons import config
+from paste.deploy.converters import asbool
+import sqlalchemy as sa
+
+import ckan.model as model
+import ckan.logic as logic
+
+from common import SearchIndexError
+from index import PackageSearchIndex
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_MAX_ATTEMPTS = 5
+# Seconds to wait before retrying a failed dataset, multiplied by the number
+# of attempts so far
+RETRY_DELAY = 60
+
+
+def is_enabled():
+    return asbool(config.get('ckan.search.asynchronous_indexing', False))
+
+
+def enqueue(package_id, operation):
+    '''
+        Adds a dataset to the indexing queue.
+
+        The row is inserted using the current session, so it only becomes
+        visible to the worker once the change to the dataset is commited.
+    '''
+    table = model.search_index_queue_table
+    model.Session.execute(table.insert().values(
+        package_id=package_id,
+        operation=operation,
+        queued=datetime.datetime.now(),
+        attempts=0))
+
+
+def _max_attempts():
+    return int(config.get('ckan.search.asynchronous_indexing.max_attempts',
+                          DEFAULT_MAX_ATTEMPTS))
+
+
+def process_queue(batch_size=DEFAULT_BATCH_SIZE):
+    '''
+        Processes the next batch of datasets waiting in the queue.
+
+        All the pending entries of a dataset are handled at once, indexing
+        its current state. Returns the number of datasets processed, which
+        is 0 if there was nothing to do.
+    '''
+    table = model.search_index_queue_table
+    now = datetime.datetime.now()
+
+    rows = model.Session.execute(
+        sa.select([table.c.id, table.c.package_id, table.c.operation,
+                   table.c.attempts])
+        .where(table.c.attempts < _max_attempts())
+        .where(sa.or_(table.c.next_attempt == None,
+                      table.c.next_attempt <= now))
+        .order_by(table.c.id)
+        .limit(batch_size)).fetchall()
+    if not rows:
+        model.Session.commit()
+        return 0
+
+    # coalesce all the entries for the same dataset, keeping the latest
+    # operation and the number of attempts of the oldest entry
+    last_id = rows[-1].id
+    operations = {}
+    attempts = {}
+    for row in rows:
+        operations[row.package_id] = row.operation
+        attempts.setdefault(row.package_id, row.attempts)
+
+    package_index = PackageSearchIndex()
+    context = {'model': model, 'ignore_auth': True, 'validate': False}
+
+    done = set()
+    failed = {}
+    pkg_dicts = []
+    for package_id, operation in operations.iteritems():
+        try:
+            if operation == model.DomainObjectOperation.deleted:
+                package_index.delete_package({'id': package_id})
+                done.add(package_id)
+                continue
+            try:
+                pkg_dicts.append(logic.get_action('package_show')(
+                    context.copy(), {'id': package_id}))
+            except logic.NotFound:
+                # purged after being queued
+                package_index.delete_package({'id': package_id})
+                done.add(package_id)
+        except Exception, e:
+            log.exception(e)
+            failed[package_id] = unicode(e)
+
+    try:
+        try:
+            package_index.index_packages(pkg_dicts)
+            done.update(pkg_dict['id'] for pkg_dict in pkg_dicts)
+        except SearchIndexError:
+            # find out which datasets are failing
+            for pkg_dict in pkg_dicts:
+                try:
+                    package_index.index_packages([pkg_dict])
+                    done.add(pkg_dict['id'])
+                except SearchIndexError, e:
+                    failed[pkg_dict['id']] = unicode(e)
+        if done and asbool(config.get('ckan.search.solr_commit', 'true')):
+            package_index.commit()
+    except Exception, e:
+        # SOLR is not available, retry all the batch later
+        log.exception(e)
+        for package_id in operations:
+            failed[package_id] = unicode(e)
+        done = set()
+
+    # the package_show calls may have left objects in the session
+    model.Session.rollback()
+
+    if done:
+        model.Session.execute(table.delete()
+            .where(table.c.package_id.in_(list(done)))
+            .where(table.c.id <= last_id))
+    for package_id, error in failed.iteritems():
+        log.error('Error while indexing dataset %s: %s' % (package_id, error))
+        attempt = attempts[package_id] + 1
+        model.Session.execute(table.update()
+            .where(table.c.package_id == package_id)
+            .where(table.c.id <= last_id)
+            .values(attempts=attempt,
+                    error=error,
+                    next_attempt=now + datetime.timedelta(
+                        seconds=RETRY_DELAY * attempt)))
+    model.Session.commit()
+
+    log.info('Indexed %i datasets from the queue (%i errors)'
+             % (len(done), len(failed)))
+    return len(operations)
+
+
+def run_worker(batch_size=DEFAULT_BATCH_SIZE, interval=5):
+    '''
+        Processes the queue forever, waiting interval seconds between
+        checks when there is nothing left to index.
+    '''
+    log.info('Indexing worker started')
+    while True:
+        try:
+            processed = process_queue(batch_size)
+        except Exception, e:
+            log.exception(e)
+            model.Session.remove()
+            processed = 0
+        if not processed:
+            time.sleep(interval)
+
+
+def queue_status():
+    '''
+        Returns a dict with the number of entries and datasets pending, the
+        entries that have failed too many times to be retried, and the lag
+        (in seconds) of the oldest entry pending.
+    '''
+    table = model.search_index_queue_table
+    max_attempts = _max_attempts()
+
+    pending = model.Session.execute(
+        sa.select([sa.func.count(table.c.id),
+                   sa.func.count(sa.distinct(table.c.package_id)),
+                   sa.func.min(table.c.queued)])
+        .where(table.c.attempts < max_attempts)).fetchone()
+    failed = model.Session.execute(
+        sa.select([sa.func.count(table.c.id)])
+        .where(table.c.attempts >= max_attempts)).scalar()
+
+    entries, datasets, oldest = pending
+    lag = 0
+    if oldest:
+        delta = datetime.datetime.now() - oldest
+        lag = delta.days * 86400 + delta.seconds
+    return {
+        'entries': entries,
+        'datasets': datasets,
+        'failed': failed,
+        'lag': lag,
+    }
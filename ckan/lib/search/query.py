@@ -6,7 +6,7 @@ from paste.util.multidict import MultiDict
 from ckan import model
 from ckan.logic import get_action
 from ckan.lib.helpers import json
-from common import make_connection, SearchError, SearchQueryError
+from common import solr_connection, SearchError, SearchQueryError
 import logging
 log = logging.getLogger(__name__)
 
@@ -250,11 +250,8 @@ class PackageSearchQuery(SearchQuery):
         fq = "+site_id:\"%s\" " % config.get('ckan.site_id')
         fq += "+state:active "
 
-        conn = make_connection()
-        try:
+        with solr_connection() as conn:
             data = conn.query(query, fq=fq, rows=max_results, fields='id')
-        finally:
-            conn.close()
 
         return [r.get('id') for r in data.results]
 
@@ -265,10 +262,10 @@ class PackageSearchQuery(SearchQuery):
             'wt': 'json',
             'fq': 'site_id:"%s"' % config.get('ckan.site_id')}
 
-        conn = make_connection()
         log.debug('Package query: %r' % query)
         try:
-            solr_response = conn.raw_query(**query)
+            with solr_connection() as conn:
+                solr_response = conn.raw_query(**query)
         except SolrException, e:
             raise SearchError('SOLR returned an error running query: %r Error: %r' %
                               (query, e.reason))
@@ -282,8 +279,6 @@ class PackageSearchQuery(SearchQuery):
         except Exception, e:
             log.exception(e)
             raise SearchError(e)
-        finally:
-            conn.close()
 
 
     def run(self, query):
@@ -351,10 +346,10 @@ class PackageSearchQuery(SearchQuery):
             query['qf'] = query.get('qf', QUERY_FIELDS)
 
 
-        conn = make_connection()
         log.debug('Package query: %r' % query)
         try:
-            solr_response = conn.raw_query(**query)
+            with solr_connection() as conn:
+                solr_response = conn.raw_query(**query)
         except SolrException, e:
             raise SearchError('SOLR returned an error running query: %r Error: %r' %
                               (query, e.reason))
@@ -388,7 +383,5 @@ class PackageSearchQuery(SearchQuery):
         except Exception, e:
             log.exception(e)
             raise SearchError(e)
-        finally:
-            conn.close()
 
         return {'results': self.results, 'count': self.count}
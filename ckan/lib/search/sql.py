@@ -1,20 +1,274 @@
+'''
+Database backed search, used when ``ckan.simple_search`` is enabled.
+
+On PostgreSQL the datasets are matched against the ``package_search_index``
+table, which holds a full text search vector of the name, title, notes, tags
+and extras of each dataset, kept up to date by database triggers (see
+migration 069). Results are ranked, and facets are computed with aggregate
+queries over the matching datasets.
+
+On other databases it falls back to a crude ``ILIKE`` match on the name,
+title and notes of the datasets, without facets.
+'''
+import re
+import json
+import logging
+
+from pylons import config
 from sqlalchemy import or_
+from paste.util.multidict import MultiDict
+
+from ckan.lib.search.common import SearchQueryError
 from ckan.lib.search.query import SearchQuery
 import ckan.model as model
 
+log = logging.getLogger(__name__)
+
+# Text search configuration used to build the search vectors
+TEXT_SEARCH_CONFIG = 'english'
+
+# Fielded terms in the q and fq parameters, e.g. tags:"economy" or
+# -res_format:CSV
+_field_term_re = re.compile(r'([+-]?)(\w+):\s*("[^"]*"|[^\s"]+)')
+
+# Conditions used to filter the datasets by the value of a field. The dataset
+# table is aliased as ``p`` and the value is passed as the ``{param}``
+# parameter.
+_FILTERS = {
+    'tags': '''EXISTS (SELECT 1 FROM package_tag pt
+                       JOIN tag t ON t.id = pt.tag_id
+                       WHERE pt.package_id = p.id AND pt.state = 'active'
+                       AND t.name = :{param})''',
+    'groups': '''EXISTS (SELECT 1 FROM member m
+                         JOIN "group" g ON g.id = m.group_id
+                         WHERE m.table_id = p.id AND m.table_name = 'package'
+                         AND m.state = 'active' AND g.name = :{param})''',
+    'organization': '''EXISTS (SELECT 1 FROM "group" g
+                               WHERE g.id = p.owner_org
+                               AND g.name = :{param})''',
+    'res_format': '''EXISTS (SELECT 1 FROM resource_group rg
+                             JOIN resource r ON r.resource_group_id = rg.id
+                             WHERE rg.package_id = p.id
+                             AND r.state = 'active'
+                             AND r.format = :{param})''',
+    'license_id': 'p.license_id = :{param}',
+    'license': 'p.license_id = :{param}',
+    'dataset_type': 'p.type = :{param}',
+    'name': 'p.name = :{param}',
+    'id': 'p.id = :{param}',
+    'owner_org': 'p.owner_org = :{param}',
+}
+
+# Fields that are always implied by the query, so they can be ignored
+_IGNORED_FIELDS = set(['site_id', 'state', 'entity_type'])
+
+# Aggregate queries returning the values of each facet and their counts for
+# the datasets matched by the ``{matched}`` subquery
+_FACETS = {
+    'tags': '''SELECT t.name, count(DISTINCT pt.package_id)
+               FROM package_tag pt JOIN tag t ON t.id = pt.tag_id
+               WHERE pt.state = 'active' AND t.vocabulary_id IS NULL
+               AND pt.package_id IN ({matched})
+               GROUP BY t.name''',
+    'groups': '''SELECT g.name, count(DISTINCT m.table_id)
+                 FROM member m JOIN "group" g ON g.id = m.group_id
+                 WHERE m.table_name = 'package' AND m.state = 'active'
+                 AND g.state = 'active' AND NOT g.is_organization
+                 AND m.table_id IN ({matched})
+                 GROUP BY g.name''',
+    'organization': '''SELECT g.name, count(*)
+                       FROM package fp JOIN "group" g ON g.id = fp.owner_org
+                       WHERE fp.id IN ({matched})
+                       GROUP BY g.name''',
+    'res_format': '''SELECT r.format, count(DISTINCT rg.package_id)
+                     FROM resource_group rg
+                     JOIN resource r ON r.resource_group_id = rg.id
+                     WHERE r.state = 'active' AND r.format <> ''
+                     AND rg.package_id IN ({matched})
+                     GROUP BY r.format''',
+    'license_id': '''SELECT fp.license_id, count(*)
+                     FROM package fp
+                     WHERE fp.license_id IS NOT NULL
+                     AND fp.id IN ({matched})
+                     GROUP BY fp.license_id''',
+}
+
+# Columns the results can be sorted by
+_SORT_FIELDS = {
+    'metadata_modified': 's.metadata_modified',
+    'metadata_created': 's.metadata_created',
+    'name': 'p.name',
+    'title_string': 'p.title',
+    'title': 'p.title',
+}
+
+
+def _parse_terms(value):
+    '''Splits a query string into a list of (operator, field, value) fielded
+    terms and the remaining free text.'''
+    terms = [(op, field, term.strip('"'))
+             for op, field, term in _field_term_re.findall(value)]
+    text = _field_term_re.sub(' ', value)
+    return terms, ' '.join(text.split())
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, basestring):
+        # facet.field may be given as a JSON list
+        try:
+            decoded = json.loads(value)
+        except ValueError:
+            return [value]
+        return decoded if isinstance(decoded, list) else [value]
+    return list(value)
+
+
 class PackageSearchQuery(SearchQuery):
     def get_all_entity_ids(self, max_results=100):
         """
         Return a list of the IDs of all indexed packages.
         """
-        # could make this a pure sql query which would be much more efficient!
-        q = model.Session.query(model.Package).filter_by(state='active').limit(max_results)
+        q = model.Session.query(model.Package.id).filter_by(state='active')\
+            .limit(max_results)
 
-        return [r.id for r in q]
+        return [r[0] for r in q]
 
     def run(self, query):
-        assert isinstance(query, dict)
-        # no support for faceting atm
+        '''
+        Performs a dataset search using the given query.
+
+        @param query - dictionary with keys like: q, fq, sort, start, rows,
+                       facet, facet.field, facet.limit, facet.mincount
+        @return - dictionary with keys results and count
+
+        May raise SearchQueryError.
+        '''
+        assert isinstance(query, (dict, MultiDict))
+        if not model.engine_is_pg():
+            return self._run_like(query)
+
+        rows = min(1000, int(query.get('rows', 10)))
+        start = int(query.get('start', 0))
+
+        params = {}
+        conditions = ["p.state = 'active'"]
+
+        q = query.get('q') or ''
+        if q in ('""', "''", '*:*'):
+            q = ''
+        terms, text = _parse_terms(q)
+        for fq in _as_list(query.get('fq')) + _as_list(query.get('fq_list')):
+            terms.extend(_parse_terms(fq)[0])
+
+        for op, field, value in terms:
+            condition = self._filter(field, value, params)
+            if condition:
+                if op == '-':
+                    condition = 'NOT (%s)' % condition
+                conditions.append(condition)
+
+        rank = None
+        if text:
+            params['text'] = text
+            conditions.append(
+                "s.search_vector @@ plainto_tsquery('%s', :text)"
+                % TEXT_SEARCH_CONFIG)
+            rank = ("ts_rank_cd(s.search_vector, "
+                    "plainto_tsquery('%s', :text))" % TEXT_SEARCH_CONFIG)
+
+        from_where = ('FROM package p '
+                      'LEFT OUTER JOIN package_search_index s '
+                      'ON s.package_id = p.id '
+                      'WHERE ' + ' AND '.join(conditions))
+
+        order_by = self._order_by(query.get('sort'), rank)
+        params['rows'] = rows
+        params['start'] = start
+        sql = ('SELECT p.id, p.name, count(*) OVER () AS total_count '
+               + from_where + ' ORDER BY ' + order_by +
+               ' LIMIT :rows OFFSET :start')
+        results = model.Session.execute(sql, params).fetchall()
+
+        if results:
+            self.count = results[0].total_count
+        elif start > 0:
+            self.count = model.Session.execute(
+                'SELECT count(*) ' + from_where, params).scalar()
+        else:
+            self.count = 0
+
+        fl = query.get('fl')
+        if fl in ('id', 'name'):
+            self.results = [r[fl] for r in results]
+        else:
+            self.results = [{'id': r.id} for r in results]
+
+        self.facets = {}
+        if query.get('facet', 'true') != 'false':
+            self.facets = self._facets(query, 'SELECT p.id ' + from_where,
+                                       params)
+
+        return {'results': self.results, 'count': self.count}
+
+    def _filter(self, field, value, params):
+        if field == 'capacity':
+            return 'p.private' if value == 'private' else 'NOT p.private'
+        if field in _IGNORED_FIELDS:
+            return None
+        if field not in _FILTERS:
+            log.debug('Ignoring unsupported search field: %s' % field)
+            return None
+        param = 'f%i' % len(params)
+        params[param] = value
+        return _FILTERS[field].format(param=param)
+
+    def _order_by(self, sort, rank):
+        order_by = []
+        for clause in (sort or '').split(','):
+            clause = clause.split()
+            if not clause:
+                continue
+            field = clause[0]
+            direction = clause[1].lower() if len(clause) > 1 else 'asc'
+            if direction not in ('asc', 'desc'):
+                raise SearchQueryError('Invalid sort direction: %s' %
+                                       direction)
+            if field in ('score', 'rank'):
+                if rank:
+                    order_by.append('%s %s' % (rank, direction))
+            elif field in _SORT_FIELDS:
+                order_by.append('%s %s' % (_SORT_FIELDS[field], direction))
+            else:
+                log.debug('Ignoring unsupported sort field: %s' % field)
+        # make the order of the results stable
+        order_by.append('p.name')
+        return ', '.join(order_by)
+
+    def _facets(self, query, matched, params):
+        limit = int(query.get('facet.limit',
+                              config.get('search.facets.limit', '50')))
+        mincount = int(query.get('facet.mincount', 1))
+
+        facets = {}
+        for field in _as_list(query.get('facet.field')):
+            facets[field] = {}
+            if field not in _FACETS:
+                continue
+            sql = _FACETS[field].format(matched=matched)
+            sql = 'SELECT * FROM (%s) f' % sql
+            facet_params = dict(params, mincount=mincount)
+            sql += ' WHERE f.count >= :mincount ORDER BY f.count DESC, 1'
+            if limit >= 0:
+                sql += ' LIMIT :facet_limit'
+                facet_params['facet_limit'] = limit
+            for value, count in model.Session.execute(sql, facet_params):
+                facets[field][value] = count
+        return facets
+
+    def _run_like(self, query):
+        # no support for faceting
         self.facets = {}
         limit = min(1000, int(query.get('rows', 10)))
 
@@ -26,7 +280,6 @@ class PackageSearchQuery(SearchQuery):
             return _attr.ilike('%' + term + '%')
         if q and q not in ('""', "''", '*:*'):
             terms = q.split()
-            # TODO: tags ...?
             fields = ['name', 'title', 'notes']
             for term in terms:
                 args = [makelike(field) for field in fields]
@@ -37,4 +290,3 @@ class PackageSearchQuery(SearchQuery):
         self.results = [{'id': r[0]} for r in ourq.all()]
 
         return {'results': self.results, 'count': self.count}
-
@@ -0,0 +1,127 @@
+'''
+Process level cache of the term translations.
+
+The translations of the terms of the datasets, groups and tags are looked up
+each time they are displayed or indexed (see ckanext.multilingual), so they
+are kept in memory by term and language code, including the terms which have
+no translation.
+
+The term_translation_update actions clear the cache of the process they run
+in and record the time of the change in system_info, which the other
+processes check at most every ``ckan.config_update_interval`` seconds.
+'''
+import time
+import threading
+
+from pylons import config
+
+# system_info key of the time of the last change to the translations
+UPDATE_KEY = 'ckan.term_translation_update'
+# Maximum number of (term, language code) pairs kept in memory, the cache is
+# emptied when it is full
+MAX_SIZE = 100000
+
+
+class TermTranslationCache(object):
+    '''Thread safe cache of the translations of terms by language code.'''
+
+    def __init__(self, max_size=MAX_SIZE):
+        self.max_size = max_size
+        self._translations = {}
+        # bumped whenever the cache is emptied, so that the translations
+        # looked up before aren't cached
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._update = None
+        self._last_update_check = 0
+
+    def get(self, terms, lang_codes):
+        '''Return a dict of the translations of the given terms into the
+        given languages, by (term, lang_code).
+
+        The pairs that aren't cached are all looked up with a single query.
+        '''
+        self._check_uptodate()
+        terms = set(terms)
+        found = {}
+        missing = set()
+        with self._lock:
+            generation = self._generation
+            for term in terms:
+                for lang_code in lang_codes:
+                    key = (term, lang_code)
+                    if key not in self._translations:
+                        missing.add(term)
+                    elif self._translations[key] is not None:
+                        found[key] = self._translations[key]
+        if not missing:
+            return found
+
+        fetched = dict(((term, lang_code), None) for term in missing
+                       for lang_code in lang_codes)
+        fetched.update(_lookup(missing, lang_codes))
+        with self._lock:
+            # unless the translations changed during the lookup
+            if generation == self._generation:
+                if len(self._translations) + len(fetched) > self.max_size:
+                    self._translations = {}
+                self._translations.update(fetched)
+        found.update((key, translation) for key, translation
+                     in fetched.iteritems() if translation is not None)
+        return found
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def invalidate(self):
+        '''Clear the cache of this process and of the other ones.'''
+        import ckan.model as model
+        update = str(time.time())
+        model.set_system_info(UPDATE_KEY, update)
+        with self._lock:
+            self._clear()
+            self._update = update
+
+    def _check_uptodate(self):
+        interval = int(config.get('ckan.config_update_interval', 5))
+        now = time.time()
+        if now - self._last_update_check < interval:
+            return
+        self._last_update_check = now
+        import ckan.model as model
+        update = model.get_system_info(UPDATE_KEY)
+        with self._lock:
+            if update != self._update:
+                self._clear()
+                self._update = update
+
+    def _clear(self):
+        # called with the lock held
+        self._translations = {}
+        self._generation += 1
+
+
+def _lookup(terms, lang_codes):
+    import ckan.model as model
+    table = model.term_translation_table
+    query = model.Session.query(table.c.term, table.c.lang_code,
+                                table.c.term_translation)
+    query = query.filter(table.c.term.in_(terms))
+    query = query.filter(table.c.lang_code.in_(lang_codes))
+    return dict(((term, lang_code), translation)
+                for term, lang_code, translation in query)
+
+
+_cache = TermTranslationCache()
+
+
+def get_translations(terms, lang_codes):
+    '''Return the translations of the given terms into the given languages,
+    as a dict by (term, lang_code).'''
+    return _cache.get(terms, lang_codes)
+
+
+def invalidate():
+    '''Forget the cached translations, after they have been changed.'''
+    _cache.invalidate()
@@ -0,0 +1,328 @@
+'''
+Buffered writing of page view tracking events.
+
+The ``/_tracking`` beacons sent by the browsers are handled by
+:py:class:`ckan.config.middleware.TrackingMiddleware`, which adds them to a
+:py:class:`TrackingWriter` instead of writing each one to the database. The
+writer keeps them in memory and a background thread writes them to the
+``tracking_raw`` table with multi-row inserts, when enough of them have been
+buffered or after a few seconds.
+
+The raw events are summarized by day in the ``tracking_summary`` table by
+:py:func:`update_summary`, run by the ``paster tracking update`` command.
+'''
+import os
+import time
+import logging
+import datetime
+import threading
+import urlparse
+
+import sqlalchemy as sa
+
+log = logging.getLogger(__name__)
+
+# Number of buffered events which are written at once
+DEFAULT_BATCH_SIZE = 500
+# Maximum number of events kept in memory, the events received when the
+# buffer is full (e.g. because the database is down) are dropped
+DEFAULT_MAX_BUFFER = 10000
+# Maximum number of seconds an event is kept in memory before being written
+DEFAULT_FLUSH_INTERVAL = 5
+
+_INSERT_SQL = '''INSERT INTO tracking_raw
+    (user_key, url, tracking_type, access_timestamp) VALUES '''
+# Maximum number of events written by each insert: each event is 4
+# parameters, and SQLite doesn't accept more than 999 per statement
+_MAX_INSERT_ROWS = 999 // 4
+
+# system_info key of the time of the last tracking event summarized
+LAST_SUMMARIZED_KEY = 'ckan.tracking_last_summarized'
+LAST_SUMMARIZED_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+# system_info key of the first day whose tracking events haven't been pruned
+PRUNED_BEFORE_KEY = 'ckan.tracking_pruned_before'
+PRUNED_BEFORE_FORMAT = '%Y-%m-%d'
+# Events are written to the database in batches, so they can arrive a bit
+# later than events that happened after them
+LATE_EVENTS_MARGIN = datetime.timedelta(hours=1)
+# package_id of the page views whose URL is not a dataset's
+PACKAGE_NOT_FOUND = '~~not~found~~'
+# Number of days counted in the recent views
+RECENT_VIEWS_DAYS = 14
+
+
+def parse_payload(payload):
+    '''Return the fields of a URL encoded tracking beacon as a dict of
+    unicode strings.'''
+    return dict((key, value.decode('utf8')) for key, value
+                in urlparse.parse_qsl(payload, keep_blank_values=True))
+
+
+class TrackingWriter(object):
+    '''
+    Thread safe buffer of tracking events, written to the database by a
+    background thread.
+
+    The thread is started with the first event, and again in each process
+    forked after that. stop() writes the events which are still buffered,
+    it should be called when the process exits.
+    '''
+
+    def __init__(self, engine, batch_size=DEFAULT_BATCH_SIZE,
+                 max_buffer=DEFAULT_MAX_BUFFER,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.engine = engine
+        self.batch_size = int(batch_size)
+        self.max_buffer = int(max_buffer)
+        self.flush_interval = float(flush_interval)
+        self._lock = threading.Lock()
+        self._wake_up = threading.Condition(self._lock)
+        self._events = []
+        self._thread = None
+        self._pid = None
+        self._stopped = False
+        self._flushed = 0
+        self._dropped = 0
+
+    def add(self, user_key, url, tracking_type):
+        '''Buffer a tracking event, it is dropped if the buffer is full.'''
+        event = (user_key, url, tracking_type, datetime.datetime.now())
+        with self._lock:
+            if self._pid != os.getpid():
+                self._start()
+            if len(self._events) >= self.max_buffer:
+                self._dropped += 1
+                return
+            self._events.append(event)
+            # the thread sleeps until the first event, and then until the
+            # batch is full or the flush interval has elapsed
+            if len(self._events) in (1, self.batch_size):
+                self._wake_up.notify()
+
+    def flush(self):
+        '''Write all the buffered events to the database.'''
+        with self._lock:
+            events, self._events = self._events, []
+        rows = min(self.batch_size, _MAX_INSERT_ROWS)
+        for start in range(0, len(events), rows):
+            self._write(events[start:start + rows])
+
+    def stop(self, timeout=None):
+        '''Stop the background thread once it has written the buffered
+        events.'''
+        with self._lock:
+            self._stopped = True
+            self._wake_up.notify()
+            thread = self._thread if self._pid == os.getpid() else None
+        if thread:
+            thread.join(timeout)
+        # events added while the thread was stopping
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'buffered': len(self._events),
+                'flushed': self._flushed,
+                'dropped': self._dropped,
+            }
+
+    def _start(self):
+        # called with the lock held, by the first event of each process:
+        # the events, thread and connections of the parent process are not
+        # usable in a forked one
+        if self._pid is not None:
+            self._events = []
+            self.engine.dispose()
+        self._pid = os.getpid()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run,
+                                        name='TrackingWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                # without a timeout, so that the thread isn't woken up
+                # periodically while there is nothing to write
+                while not self._stopped and not self._events:
+                    self._wake_up.wait()
+                deadline = time.time() + self.flush_interval
+                while (not self._stopped
+                       and len(self._events) < self.batch_size
+                       and time.time() < deadline):
+                    self._wake_up.wait(deadline - time.time())
+                stopped = self._stopped
+            self.flush()
+            if stopped:
+                return
+
+    def _write(self, events):
+        values = []
+        params = {}
+        for num, event in enumerate(events):
+            values.append('(:k{0}, :u{0}, :t{0}, :a{0})'.format(num))
+            for name, value in zip('kuta', event):
+                params['{0}{1}'.format(name, num)] = value
+        try:
+            self.engine.execute(sa.text(_INSERT_SQL + ', '.join(values)),
+                                **params)
+        except Exception, e:
+            log.error('Error writing %i tracking events: %r'
+                      % (len(events), e))
+            with self._lock:
+                self._dropped += len(events)
+        else:
+            with self._lock:
+                self._flushed += len(events)
+
+
+def _last_summarized():
+    '''Return the time of the last event summarized, or None if the events
+    have never been summarized.'''
+    import ckan.model as model
+    last = model.get_system_info(LAST_SUMMARIZED_KEY)
+    if not last:
+        return None
+    return datetime.datetime.strptime(last, LAST_SUMMARIZED_FORMAT)
+
+
+def _summarized_from(last):
+    '''Return the first day of the summaries that need to be recomputed to
+    add the events received after the given time.'''
+    return (last - LATE_EVENTS_MARGIN).date()
+
+
+def _pruned_before():
+    '''Return the first day whose tracking events haven't been pruned, or
+    None if they never have been.'''
+    import ckan.model as model
+    pruned_before = model.get_system_info(PRUNED_BEFORE_KEY)
+    if not pruned_before:
+        return None
+    return datetime.datetime.strptime(pruned_before,
+                                      PRUNED_BEFORE_FORMAT).date()
+
+
+def update_summary(start_date=None):
+    '''Summarize the tracking events by URL and day in tracking_summary.
+
+    Only the days from start_date on are (re)computed. By default, these are
+    the days of the events received since the last update, so the work done
+    doesn't grow with the tracking history: the running totals are carried
+    forward from the summaries of the previous days. The summaries of the
+    days whose events have been pruned are kept, even if start_date is
+    before them.
+
+    Returns the first day summarized, or None if there was nothing to do.
+    '''
+    import ckan.model as model
+    session = model.Session
+    until = session.execute(
+        'SELECT max(access_timestamp) FROM tracking_raw').scalar()
+    if until is None:
+        return None
+    if start_date is None:
+        last = _last_summarized()
+        if last:
+            if until <= last:
+                return None
+            start_date = _summarized_from(last)
+        else:
+            # summaries of the previous tracking update command, which
+            # didn't record what it summarized
+            last_date = session.execute(
+                'SELECT max(tracking_date) FROM tracking_summary').scalar()
+            if last_date:
+                start_date = last_date - datetime.timedelta(days=2)
+            else:
+                start_date = session.execute(
+                    'SELECT min(access_timestamp) FROM tracking_raw').scalar()
+    if isinstance(start_date, datetime.datetime):
+        start_date = start_date.date()
+    pruned_before = _pruned_before()
+    if pruned_before and start_date < pruned_before:
+        log.warning('The tracking events before %s have been pruned, '
+                    'their summaries are kept' % pruned_before)
+        start_date = pruned_before
+    params = {'start': start_date, 'until': until,
+              'not_found': PACKAGE_NOT_FOUND, 'days': RECENT_VIEWS_DAYS}
+
+    session.execute('''DELETE FROM tracking_summary
+        WHERE tracking_date >= :start''', params)
+
+    # count each user once per URL and day
+    session.execute('''INSERT INTO tracking_summary
+            (url, count, tracking_date, tracking_type)
+        SELECT url, count(DISTINCT user_key),
+            CAST(access_timestamp AS Date), tracking_type
+        FROM tracking_raw
+        WHERE access_timestamp >= :start AND access_timestamp <= :until
+        GROUP BY url, CAST(access_timestamp AS Date), tracking_type''',
+        params)
+
+    # get the ids of the datasets of the page URLs, using the index on the
+    # dataset names
+    session.execute('''UPDATE tracking_summary t SET package_id = p.id
+        FROM package p
+        WHERE t.tracking_date >= :start AND t.tracking_type = 'page'
+        AND p.name = substring(t.url from '/dataset/([^/]+)$')''', params)
+    session.execute('''UPDATE tracking_summary SET package_id = :not_found
+        WHERE tracking_date >= :start AND tracking_type = 'page'
+        AND package_id IS NULL''', params)
+
+    # the totals of the resources are by URL, those of the pages by dataset
+    for tracking_type, key in (('resource', 'url'), ('page', 'package_id')):
+        params['type'] = tracking_type
+        session.execute('''UPDATE tracking_summary t
+            SET running_total = s.running_total
+            FROM (
+                SELECT DISTINCT n.{key}, n.tracking_date,
+                    SUM(n.count) OVER (PARTITION BY n.{key}
+                                       ORDER BY n.tracking_date)
+                    + COALESCE((SELECT max(b.running_total)
+                                FROM tracking_summary b
+                                WHERE b.{key} = n.{key}
+                                AND b.tracking_type = :type
+                                AND b.tracking_date < :start), 0)
+                    AS running_total
+                FROM tracking_summary n
+                WHERE n.tracking_type = :type AND n.tracking_date >= :start
+                AND n.{key} <> :not_found
+            ) s
+            WHERE t.{key} = s.{key} AND t.tracking_date = s.tracking_date
+            AND t.tracking_type = :type'''.format(key=key), params)
+        session.execute('''UPDATE tracking_summary t
+            SET recent_views = (
+                SELECT sum(r.count) FROM tracking_summary r
+                WHERE r.{key} = t.{key} AND r.tracking_type = :type
+                AND r.tracking_date <= t.tracking_date
+                AND r.tracking_date >= t.tracking_date - :days)
+            WHERE t.tracking_type = :type AND t.tracking_date >= :start
+            AND t.{key} <> :not_found'''.format(key=key), params)
+
+    model.set_system_info(LAST_SUMMARIZED_KEY,
+                          until.strftime(LAST_SUMMARIZED_FORMAT))
+    # set_system_info doesn't commit when the value is unchanged
+    session.commit()
+    return start_date
+
+
+def prune_raw():
+    '''Delete the tracking events which have been summarized, apart from
+    those of the days which the next update will recompute.
+
+    Returns the number of events deleted.'''
+    import ckan.model as model
+    last = _last_summarized()
+    if last is None:
+        return 0
+    before = _summarized_from(last)
+    result = model.Session.execute(
+        'DELETE FROM tracking_raw WHERE access_timestamp < :before',
+        {'before': before})
+    model.set_system_info(PRUNED_BEFORE_KEY,
+                          before.strftime(PRUNED_BEFORE_FORMAT))
+    model.Session.commit()
+    return result.rowcount
@@ -330,6 +330,9 @@ def get_action(action):
         # we need to retain the side effect free behaviour
         if getattr(_action, 'side_effect_free', False):
             fn.side_effect_free = True
+        # and the ability to stream the results
+        if getattr(_action, 'streams_results', False):
+            fn.streams_results = True
         _actions[action_name] = fn
 
     return _actions.get(action)
@@ -383,6 +386,24 @@ def side_effect_free(action):
     return wrapper
 
 
+def streams_results(action):
+    '''A decorator that marks the given action as able to stream its result.
+
+    When the action is called through the action API, and only then, its
+    context has ``stream_results`` set, so it can return
+    :py:class:`ckan.lib.jsonstream.JsonStream` values which are encoded
+    while the response is sent. Other actions called with the same context
+    don't get the flag.
+    '''
+
+    @functools.wraps(action)
+    def wrapper(context, data_dict):
+        return action(context, data_dict)
+    wrapper.streams_results = True
+
+    return wrapper
+
+
 class UnknownValidator(Exception):
     pass
 
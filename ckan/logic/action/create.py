@@ -1023,6 +1023,8 @@ def follow_user(context, data_dict):
 
     follower = model_save.follower_dict_save(validated_data_dict, context,
             model.UserFollowingUser)
+    model.dashboard.followee_added(follower.follower_id, follower.object_id,
+                                   'user')
 
     if not context.get('defer_commit'):
         model.repo.commit()
@@ -1080,6 +1082,8 @@ def follow_dataset(context, data_dict):
 
     follower = model_save.follower_dict_save(validated_data_dict, context,
             model.UserFollowingDataset)
+    model.dashboard.followee_added(follower.follower_id, follower.object_id,
+                                   'dataset')
 
     if not context.get('defer_commit'):
         model.repo.commit()
@@ -1174,6 +1178,8 @@ def follow_group(context, data_dict):
 
     follower = model_save.follower_dict_save(validated_data_dict, context,
             model.UserFollowingGroup)
+    model.dashboard.followee_added(follower.follower_id, follower.object_id,
+                                   'group')
 
     if not context.get('defer_commit'):
         model.repo.commit()
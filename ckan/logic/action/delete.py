@@ -352,7 +352,7 @@ def package_relationship_delete_rest(context, data_dict):
 
     package_relationship_delete(context, data_dict)
 
-def _unfollow(context, data_dict, schema, FollowerClass):
+def _unfollow(context, data_dict, schema, FollowerClass, object_type):
     model = context['model']
 
     if not context.has_key('user'):
@@ -375,6 +375,9 @@ def _unfollow(context, data_dict, schema, FollowerClass):
                 _('You are not following {0}.').format(data_dict.get('id')))
 
     follower_obj.delete()
+    # the removal is a plain SQL statement, which doesn't flush the session
+    model.Session.flush()
+    model.dashboard.followee_removed(follower_id, object_id, object_type)
     model.repo.commit()
 
 def unfollow_user(context, data_dict):
@@ -386,7 +389,8 @@ def unfollow_user(context, data_dict):
     '''
     schema = context.get('schema') or (
             ckan.logic.schema.default_follow_user_schema())
-    _unfollow(context, data_dict, schema, context['model'].UserFollowingUser)
+    _unfollow(context, data_dict, schema, context['model'].UserFollowingUser,
+              'user')
 
 def unfollow_dataset(context, data_dict):
     '''Stop following a dataset.
@@ -398,7 +402,7 @@ def unfollow_dataset(context, data_dict):
     schema = context.get('schema') or (
             ckan.logic.schema.default_follow_dataset_schema())
     _unfollow(context, data_dict, schema,
-            context['model'].UserFollowingDataset)
+            context['model'].UserFollowingDataset, 'dataset')
 
 
 def _group_or_org_member_delete(context, data_dict=None):
@@ -439,4 +443,4 @@ def unfollow_group(context, data_dict):
     schema = context.get('schema',
             ckan.logic.schema.default_follow_group_schema())
     _unfollow(context, data_dict, schema,
-            context['model'].UserFollowingGroup)
+            context['model'].UserFollowingGroup, 'group')
@@ -6,6 +6,7 @@ import datetime
 from pylons import config
 from pylons.i18n import _
 from pylons import c
+from paste.deploy.converters import asbool
 import sqlalchemy
 
 import ckan.lib.dictization
@@ -17,6 +18,7 @@ import ckan.lib.navl.dictization_functions
 import ckan.model.misc as misc
 import ckan.plugins as plugins
 import ckan.lib.search as search
+import ckan.lib.search.facets as search_facets
 import ckan.lib.plugins as lib_plugins
 import ckan.lib.activity_streams as activity_streams
 import ckan.new_authz as new_authz
@@ -249,14 +251,23 @@ def member_list(context, data_dict=None):
     :param id: the id or name of the group
     :type id: string
     :param object_type: restrict the members returned to those of a given type,
-      e.g. ``'user'`` or ``'package'`` (optional, default: ``None``)
+      e.g. ``'user'`` or ``'package'`` (optional, default: ``None``). Like
+      in ``group_show``, the private datasets aren't returned as members of
+      type ``'package'``.
     :type object_type: string
     :param capacity: restrict the members returned to those with a given
       capacity, e.g. ``'member'``, ``'editor'``, ``'admin'``, ``'public'``,
       ``'private'`` (optional, default: ``None``)
     :type capacity: string
+    :param limit: the maximum number of members to return (optional,
+      default: all of them)
+    :type limit: int
+    :param after: only return the members whose ids sort after this one, to
+      page through the members of large groups pass the id of the last
+      member of the previous page (optional)
+    :type after: string
 
-    :rtype: list of (id, type, capacity) tuples
+    :rtype: list of (id, type, capacity) tuples, sorted by id
 
     '''
     model = context['model']
@@ -267,29 +278,45 @@ def member_list(context, data_dict=None):
 
     obj_type = data_dict.get('object_type', None)
     capacity = data_dict.get('capacity', None)
+    after = data_dict.get('after', None)
+    limit = data_dict.get('limit', None)
+    if limit is not None:
+        try:
+            limit = max(int(limit), 0)
+        except (ValueError, TypeError):
+            raise logic.ParameterError("'limit' should be an int")
 
     # User must be able to update the group to remove a member from it
     _check_access('group_show', context, data_dict)
 
-    q = model.Session.query(model.Member).\
+    q = model.Session.query(model.Member.table_id, model.Member.table_name,
+                            model.Member.capacity).\
         filter(model.Member.group_id == group.id).\
         filter(model.Member.state == "active")
 
     if obj_type:
         q = q.filter(model.Member.table_name == obj_type)
+    if obj_type == 'package':
+        q = q.join(model.Package, model.Package.id == model.Member.table_id).\
+            filter(model.Package.private == False)
     if capacity:
         q = q.filter(model.Member.capacity == capacity)
+    if after:
+        q = q.filter(model.Member.table_id > after)
+    q = q.order_by(model.Member.table_id)
+    if limit is not None:
+        q = q.limit(limit)
 
     trans = new_authz.roles_trans()
 
-    def translated_capacity(capacity):
+    def translated_capacity(member_capacity):
         try:
-            return trans[capacity]
+            return trans[member_capacity]
         except KeyError:
-            return capacity
+            return member_capacity
 
-    return [(m.table_id, m.table_name, translated_capacity(m.capacity))
-            for m in q.all()]
+    return [(table_id, table_name, translated_capacity(member_capacity))
+            for table_id, table_name, member_capacity in q]
 
 def _group_or_org_list(context, data_dict, is_org=False):
 
@@ -327,9 +354,12 @@ def _group_or_org_list(context, data_dict, is_org=False):
     query = query.filter(model.GroupRevision.is_organization==is_org)
 
     groups = query.all()
+    # the dataset counts are only needed to return them or to sort by them
+    with_package_counts = bool(all_fields) or sort_info[0][0] == 'packages'
     group_list = model_dictize.group_list_dictize(groups, context,
                                                   lambda x:x[sort_info[0][0]],
-                                                  sort_info[0][1] == 'desc')
+                                                  sort_info[0][1] == 'desc',
+                                                  with_package_counts)
 
     if not all_fields:
         group_list = [group[ref_group_by] for group in group_list]
@@ -585,6 +615,12 @@ def user_list(context, data_dict):
     :param order_by: which field to sort the list by (optional, default:
       ``'name'``)
     :type order_by: string
+    :param limit: the maximum number of users to return (optional, default:
+      all of them)
+    :type limit: int
+    :param offset: the number of users to skip, when paging through the list
+      with ``limit`` (optional, default: ``0``)
+    :type offset: int
 
     :rtype: list of dictionaries
 
@@ -595,6 +631,19 @@ def user_list(context, data_dict):
 
     q = data_dict.get('q','')
     order_by = data_dict.get('order_by','name')
+    try:
+        limit = data_dict.get('limit')
+        if limit is not None:
+            limit = max(int(limit), 0)
+        offset = max(int(data_dict.get('offset', 0)), 0)
+    except (ValueError, TypeError):
+        raise logic.ParameterError("'limit' and 'offset' should be ints")
+
+    number_of_edits = _select([_func.count(model.Revision.id)], _or_(
+            model.Revision.author==model.User.name,
+            model.Revision.author==model.User.openid
+            )
+    ).label('number_of_edits')
 
     query = model.Session.query(
         model.User,
@@ -603,11 +652,7 @@ def user_list(context, data_dict):
         model.User.about.label('about'),
         model.User.about.label('email'),
         model.User.created.label('created'),
-        _select([_func.count(model.Revision.id)], _or_(
-                model.Revision.author==model.User.name,
-                model.Revision.author==model.User.openid
-                )
-        ).label('number_of_edits'),
+        number_of_edits,
         _select([_func.count(model.UserObjectRole.id)], _and_(
             model.UserObjectRole.user_id==model.User.id,
             model.UserObjectRole.context=='Package',
@@ -620,27 +665,33 @@ def user_list(context, data_dict):
         query = model.User.search(q, query)
 
     if order_by == 'edits':
-        query = query.order_by(_desc(
-            _select([_func.count(model.Revision.id)], _or_(
-                model.Revision.author==model.User.name,
-                model.Revision.author==model.User.openid
-                ))
-        ))
+        query = query.order_by(_desc(number_of_edits))
     else:
         query = query.order_by(
             _case([(_or_(model.User.fullname == None, model.User.fullname == ''),
                    model.User.name)],
                  else_=model.User.fullname)
         )
+    # the user names are unique, so the pages don't overlap
+    query = query.order_by(model.User.name)
 
     ## hack for pagination
     if context.get('return_query'):
         return query
 
+    if offset:
+        query = query.offset(offset)
+    if limit is not None:
+        query = query.limit(limit)
+
     users_list = []
 
-    for user in query.all():
-        result_dict = model_dictize.user_dictize(user[0], context)
+    # the numbers of edits and of administered datasets have been counted
+    # by the query
+    for row in query.all():
+        result_dict = model_dictize.user_dictize(row[0], context,
+            number_of_edits=row.number_of_edits,
+            number_administered_packages=row.number_administered_packages)
         users_list.append(result_dict)
 
     return users_list
@@ -821,6 +872,11 @@ def _group_or_org_show(context, data_dict, is_org=False):
     else:
         _check_access('group_show',context, data_dict)
 
+    if data_dict.get('member_limit') is not None:
+        try:
+            context['member_limit'] = max(int(data_dict['member_limit']), 0)
+        except (ValueError, TypeError):
+            raise logic.ParameterError("'member_limit' should be an int")
 
     group_dict = model_dictize.group_dictize(group, context)
 
@@ -855,6 +911,11 @@ def group_show(context, data_dict):
 
     :param id: the id or name of the group
     :type id: string
+    :param member_limit: if given, only return the first ``member_limit``
+      datasets, tags, groups and users of the group, sorted by id, and
+      their numbers in ``member_counts``, the others can be listed with
+      ``member_list()`` (optional)
+    :type member_limit: int
 
     :rtype: dictionary
 
@@ -866,6 +927,11 @@ def organization_show(context, data_dict):
 
     :param id: the id or name of the organization
     :type id: string
+    :param member_limit: if given, only return the first ``member_limit``
+      datasets, tags, groups and users of the organization, sorted by id, and
+      their numbers in ``member_counts``, the others can be listed with
+      ``member_list()`` (optional)
+    :type member_limit: int
 
     :rtype: dictionary
 
@@ -1131,6 +1197,20 @@ def user_autocomplete(context, data_dict):
 
     return user_list
 
+def _active_package_ids(model, session, package_ids):
+    '''Return the subset of the given package ids that belong to active
+    packages, using a single query.'''
+    if not package_ids:
+        return set()
+    query = session.query(model.PackageRevision.id)\
+        .filter(model.PackageRevision.id.in_(package_ids))\
+        .filter(_and_(
+            model.PackageRevision.state == u'active',
+            model.PackageRevision.current == True
+        ))
+    return set(row[0] for row in query)
+
+
 def package_search(context, data_dict):
     '''
     Searches for packages satisfying a given search criteria.
@@ -1278,32 +1358,36 @@ def package_search(context, data_dict):
         # Add them back so extensions can use them on after_search
         data_dict['extras'] = extras
 
+        # check that the packages found are still active in the database
+        # with a single query, unless the site is configured to trust the
+        # search index
+        if asbool(config.get('ckan.search.trust_index', False)):
+            active_ids = None
+        else:
+            active_ids = _active_package_ids(
+                model, session, [package['id'] for package in query.results])
+
         for package in query.results:
-            # get the package object
             package, package_dict = package['id'], package.get('data_dict')
-            pkg_query = session.query(model.PackageRevision)\
-                .filter(model.PackageRevision.id == package)\
-                .filter(_and_(
-                    model.PackageRevision.state == u'active',
-                    model.PackageRevision.current == True
-                ))
-            pkg = pkg_query.first()
 
             ## if the index has got a package that is not in ckan then
             ## ignore it.
-            if not pkg:
+            if active_ids is not None and package not in active_ids:
                 log.warning('package %s in index but not in database' % package)
                 continue
             ## use data in search index if there
             if package_dict:
                 ## the package_dict still needs translating when being viewed
-                package_dict = json.loads(package_dict)
-                if context.get('for_view'):
-                    for item in plugins.PluginImplementations( plugins.IPackageController):
-                        package_dict = item.before_view(package_dict)
-                results.append(package_dict)
+                results.append(json.loads(package_dict))
             else:
-                results.append(model_dictize.package_dictize(pkg,context))
+                pkg = model.Package.get(package)
+                if not pkg or pkg.state != model.State.ACTIVE:
+                    log.warning('package %s in index but not in database' % package)
+                    continue
+                # before_view is called on all the results below
+                dictize_context = dict(context, for_view=False)
+                results.append(
+                    model_dictize.package_dictize(pkg, dictize_context))
 
         count = query.count
         facets = query.facets
@@ -1321,6 +1405,12 @@ def package_search(context, data_dict):
 
     # Transform facets into a more useful data structure.
     restructured_facets = {}
+    # resolve the display names of all groups and organizations at once
+    group_names = set()
+    for key in ('groups', 'organization'):
+        group_names.update(facets.get(key, {}).keys())
+    group_display_names = search_facets.group_display_names(group_names)
+    license_register = model.Package.get_license_register()
     for key, value in facets.items():
         restructured_facets[key] = {
                 'title': key,
@@ -1330,13 +1420,9 @@ def package_search(context, data_dict):
             new_facet_dict = {}
             new_facet_dict['name'] = key_
             if key in ('groups', 'organization'):
-                group = model.Group.get(key_)
-                if group:
-                    new_facet_dict['display_name'] = group.display_name
-                else:
-                    new_facet_dict['display_name'] = key_
+                new_facet_dict['display_name'] = group_display_names[key_]
             elif key == 'license_id':
-                license = model.Package.get_license_register().get(key_)
+                license = license_register.get(key_)
                 if license:
                     new_facet_dict['display_name'] = license.title
                 else:
@@ -1351,6 +1437,18 @@ def package_search(context, data_dict):
     for item in plugins.PluginImplementations(plugins.IPackageController):
         search_results = item.after_search(search_results,data_dict)
 
+    # The results are prepared for viewing once after_search has been
+    # called on all of them, so that extensions can do the work needed by
+    # the whole page at once there (e.g. look up translations).
+    if context.get('for_view'):
+        viewed = []
+        for package_dict in search_results['results']:
+            for item in plugins.PluginImplementations(
+                    plugins.IPackageController):
+                package_dict = item.before_view(package_dict)
+            viewed.append(package_dict)
+        search_results['results'] = viewed
+
     # After extensions have had a chance to modify the facets, sort them by
     # display name.
     for facet in search_results['search_facets']:
@@ -2608,6 +2706,11 @@ def dashboard_activity_list(context, data_dict):
     :param limit: the maximum number of activities to return
         (optional, default: 31, the default value is configurable via the
         ``ckan.activity_list_limit`` setting)
+    :param before: the id of an activity, to get the activities that come
+        after it in the stream (i.e. older ones), e.g. the last activity of
+        the previous page. Paging this way is faster than with an offset
+        (optional)
+    :type before: string
 
     :rtype: list of activity dictionaries
 
@@ -2623,7 +2726,7 @@ def dashboard_activity_list(context, data_dict):
     # FIXME: Filter out activities whose subject or object the user is not
     # authorized to read.
     activity_objects = model.activity.dashboard_activity_list(user_id,
-            limit=limit, offset=offset)
+            limit=limit, offset=offset, before=data_dict.get('before'))
 
     activity_dicts = model_dictize.activity_list_dictize(
             activity_objects, context)
@@ -2682,13 +2785,25 @@ def dashboard_new_activities_count(context, data_dict):
     though they appear in the dashboard (users don't want to be notified about
     things they did themselves).
 
+    The count is kept up to date as activities are emitted, and reset when
+    the user views their dashboard, so this doesn't need to query the
+    activity stream. Like the dashboard activity stream, it doesn't go over
+    ``limit``.
+
+    :param limit: the maximum number of new activities to count
+        (optional, default: 31, the default value is configurable via the
+        ``ckan.activity_list_limit`` setting)
+    :type limit: int
+
     :rtype: int
 
     '''
     _check_access('dashboard_new_activities_count', context, data_dict)
-    activities = logic.get_action('dashboard_activity_list')(
-            context, data_dict)
-    return len([activity for activity in activities if activity['is_new']])
+    model = context['model']
+    user_id = model.User.get(context['user']).id
+    limit = int(
+        data_dict.get('limit', config.get('ckan.activity_list_limit', 31)))
+    return min(model.Dashboard.new_activities_count(user_id), limit)
 
 
 def _unpick_search(sort, allowed_fields=None, total=None):
@@ -17,6 +17,7 @@ import ckan.lib.navl.dictization_functions
 import ckan.lib.navl.validators as validators
 import ckan.lib.plugins as lib_plugins
 import ckan.lib.email_notifications
+import ckan.lib.term_translation as term_translation
 
 log = logging.getLogger(__name__)
 
@@ -716,6 +717,7 @@ def term_translation_update(context, data_dict):
 
     if not context.get('defer_commit'):
         model.Session.commit()
+        term_translation.invalidate()
 
     return data
 
@@ -747,6 +749,7 @@ def term_translation_update_many(context, data_dict):
         term_translation_update(context, row)
 
     model.Session.commit()
+    term_translation.invalidate()
 
     return {'success': '%s rows updated' % (num + 1)}
 
@@ -976,8 +979,9 @@ def dashboard_mark_activities_old(context, data_dict):
             data_dict)
     model = context['model']
     user_id = model.User.get(context['user']).id
-    model.Dashboard.get(user_id).activity_stream_last_viewed = (
-            datetime.datetime.now())
+    dashboard = model.Dashboard.get(user_id)
+    dashboard.activity_stream_last_viewed = datetime.datetime.now()
+    dashboard.new_activities_count = 0
     if not context.get('defer_commit'):
         model.repo.commit()
 
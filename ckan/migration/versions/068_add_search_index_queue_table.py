@@ -0,0 +1,20 @@
+from sqlalchemy import *
+from migrate import *
+
+def upgrade(migrate_engine):
+    metadata = MetaData()
+    metadata.bind = migrate_engine
+    migrate_engine.execute('''
+CREATE TABLE search_index_queue (
+    id serial NOT NULL,
+    package_id text NOT NULL,
+    operation character varying(10) NOT NULL,
+    queued timestamp without time zone NOT NULL DEFAULT LOCALTIMESTAMP,
+    attempts integer NOT NULL DEFAULT 0,
+    next_attempt timestamp without time zone,
+    error text
+);
+ALTER TABLE search_index_queue
+    ADD CONSTRAINT search_index_queue_pkey PRIMARY KEY (id);
+CREATE INDEX idx_search_index_queue_package_id ON search_index_queue (package_id);
+    ''')
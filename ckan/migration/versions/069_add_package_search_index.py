@@ -0,0 +1,95 @@
+from sqlalchemy import *
+from migrate import *
+
+def upgrade(migrate_engine):
+    metadata = MetaData()
+    metadata.bind = migrate_engine
+    migrate_engine.execute('''
+CREATE TABLE package_search_index (
+    package_id text NOT NULL,
+    search_vector tsvector,
+    metadata_created timestamp without time zone NOT NULL DEFAULT LOCALTIMESTAMP,
+    metadata_modified timestamp without time zone NOT NULL DEFAULT LOCALTIMESTAMP
+);
+ALTER TABLE package_search_index
+    ADD CONSTRAINT package_search_index_pkey PRIMARY KEY (package_id);
+ALTER TABLE package_search_index
+    ADD CONSTRAINT package_search_index_package_id_fkey FOREIGN KEY (package_id) REFERENCES package(id) ON UPDATE CASCADE ON DELETE CASCADE;
+CREATE INDEX idx_package_search_index_vector ON package_search_index USING gin(search_vector);
+
+CREATE OR REPLACE FUNCTION package_search_refresh(pkg_id text) RETURNS void AS $$
+DECLARE
+    vector tsvector;
+BEGIN
+    SELECT setweight(to_tsvector('english', coalesce(p.name, '')), 'A') ||
+           setweight(to_tsvector('english', coalesce(p.title, '')), 'A') ||
+           setweight(to_tsvector('english', array_to_string(array(
+               SELECT t.name FROM package_tag pt JOIN tag t ON t.id = pt.tag_id
+               WHERE pt.package_id = p.id AND pt.state = 'active'), ' ')), 'B') ||
+           setweight(to_tsvector('english', coalesce(p.notes, '')), 'C') ||
+           setweight(to_tsvector('english', array_to_string(array(
+               SELECT e.value FROM package_extra e
+               WHERE e.package_id = p.id AND e.state = 'active'), ' ')), 'D')
+      INTO vector
+      FROM package p WHERE p.id = pkg_id;
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+
+    UPDATE package_search_index
+       SET search_vector = vector, metadata_modified = LOCALTIMESTAMP
+     WHERE package_id = pkg_id;
+    IF NOT FOUND THEN
+        INSERT INTO package_search_index
+            (package_id, search_vector, metadata_created, metadata_modified)
+        SELECT pkg_id, vector,
+               coalesce(min(r.revision_timestamp), LOCALTIMESTAMP),
+               coalesce(max(r.revision_timestamp), LOCALTIMESTAMP)
+          FROM package_revision r WHERE r.id = pkg_id;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION package_search_package_trigger() RETURNS trigger AS $$
+BEGIN
+    PERFORM package_search_refresh(NEW.id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION package_search_package_child_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM package_search_refresh(OLD.package_id);
+    ELSE
+        PERFORM package_search_refresh(NEW.package_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION package_search_tag_trigger() RETURNS trigger AS $$
+BEGIN
+    IF NEW.name <> OLD.name THEN
+        PERFORM package_search_refresh(pt.package_id)
+           FROM package_tag pt WHERE pt.tag_id = NEW.id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER package_search_package
+    AFTER INSERT OR UPDATE ON package
+    FOR EACH ROW EXECUTE PROCEDURE package_search_package_trigger();
+CREATE TRIGGER package_search_package_tag
+    AFTER INSERT OR UPDATE OR DELETE ON package_tag
+    FOR EACH ROW EXECUTE PROCEDURE package_search_package_child_trigger();
+CREATE TRIGGER package_search_package_extra
+    AFTER INSERT OR UPDATE OR DELETE ON package_extra
+    FOR EACH ROW EXECUTE PROCEDURE package_search_package_child_trigger();
+CREATE TRIGGER package_search_tag
+    AFTER UPDATE ON tag
+    FOR EACH ROW EXECUTE PROCEDURE package_search_tag_trigger();
+
+SELECT package_search_refresh(id) FROM package;
+    ''')
@@ -0,0 +1,29 @@
+from sqlalchemy import *
+from migrate import *
+
+def upgrade(migrate_engine):
+    metadata = MetaData()
+    metadata.bind = migrate_engine
+    migrate_engine.execute('''
+ALTER TABLE dashboard
+    ADD COLUMN new_activities_count integer NOT NULL DEFAULT 0;
+
+UPDATE dashboard d SET new_activities_count = (
+    SELECT count(*) FROM activity a
+    WHERE a.timestamp > d.activity_stream_last_viewed
+    AND a.user_id <> d.user_id
+    AND (a.object_id = d.user_id
+         OR a.user_id IN (SELECT object_id FROM user_following_user
+                          WHERE follower_id = d.user_id)
+         OR a.object_id IN (
+             SELECT object_id FROM user_following_user
+                 WHERE follower_id = d.user_id
+             UNION SELECT object_id FROM user_following_dataset
+                 WHERE follower_id = d.user_id
+             UNION SELECT object_id FROM user_following_group
+                 WHERE follower_id = d.user_id
+             UNION SELECT m.table_id FROM user_following_group f
+                 JOIN member m ON m.group_id = f.object_id
+                 WHERE f.follower_id = d.user_id
+                 AND m.table_name = 'package' AND m.state = 'active')));
+    ''')
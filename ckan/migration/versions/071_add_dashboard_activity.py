@@ -0,0 +1,53 @@
+from sqlalchemy import *
+from migrate import *
+
+def upgrade(migrate_engine):
+    metadata = MetaData()
+    metadata.bind = migrate_engine
+    migrate_engine.execute('''
+CREATE TABLE dashboard_activity (
+    user_id text NOT NULL,
+    activity_id text NOT NULL,
+    "timestamp" timestamp without time zone NOT NULL
+);
+
+ALTER TABLE dashboard_activity
+    ADD CONSTRAINT dashboard_activity_pkey PRIMARY KEY (user_id, activity_id);
+
+ALTER TABLE dashboard_activity
+    ADD CONSTRAINT dashboard_activity_user_id_fkey FOREIGN KEY (user_id)
+    REFERENCES "user"(id) ON UPDATE CASCADE ON DELETE CASCADE;
+
+ALTER TABLE dashboard_activity
+    ADD CONSTRAINT dashboard_activity_activity_id_fkey
+    FOREIGN KEY (activity_id) REFERENCES activity(id)
+    ON UPDATE CASCADE ON DELETE CASCADE;
+
+INSERT INTO dashboard_activity (user_id, activity_id, "timestamp")
+SELECT feed.user_id, feed.activity_id, feed.timestamp FROM (
+    SELECT a.user_id, a.id AS activity_id, a.timestamp FROM activity a
+        JOIN "user" u ON u.id = a.user_id
+    UNION SELECT a.object_id, a.id, a.timestamp FROM activity a
+        JOIN "user" u ON u.id = a.object_id
+    UNION SELECT f.follower_id, a.id, a.timestamp FROM user_following_user f
+        JOIN activity a ON a.user_id = f.object_id
+                        OR a.object_id = f.object_id
+    UNION SELECT f.follower_id, a.id, a.timestamp
+        FROM user_following_dataset f
+        JOIN activity a ON a.object_id = f.object_id
+    UNION SELECT f.follower_id, a.id, a.timestamp FROM user_following_group f
+        JOIN activity a ON a.object_id = f.object_id
+    UNION SELECT f.follower_id, a.id, a.timestamp FROM user_following_group f
+        JOIN member m ON m.group_id = f.object_id
+        JOIN package p ON p.id = m.table_id
+        JOIN activity a ON a.object_id = m.table_id
+        WHERE m.table_name = 'package' AND m.state = 'active'
+        AND p.state IN ('active', 'pending') AND NOT p.private
+) AS feed
+WHERE feed.timestamp IS NOT NULL;
+
+CREATE INDEX idx_dashboard_activity_user_timestamp
+    ON dashboard_activity (user_id, "timestamp" DESC, activity_id DESC);
+CREATE INDEX idx_dashboard_activity_activity_id
+    ON dashboard_activity (activity_id);
+    ''')
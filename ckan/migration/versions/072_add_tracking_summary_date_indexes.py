@@ -0,0 +1,13 @@
+from sqlalchemy import *
+from migrate import *
+
+def upgrade(migrate_engine):
+    migrate_engine.execute('''
+        BEGIN;
+        CREATE INDEX tracking_summary_url_date
+            ON tracking_summary(url, tracking_date);
+        CREATE INDEX tracking_summary_package_id_date
+            ON tracking_summary(package_id, tracking_date);
+        COMMIT;
+    '''
+    )
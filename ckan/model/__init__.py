@@ -144,6 +144,7 @@ from system_info import (
     system_info_table,
     SystemInfo,
     get_system_info,
+    get_system_info_dict,
     set_system_info,
     delete_system_info,
 )
@@ -153,6 +154,10 @@ from domain_object import (
 )
 from dashboard import (
     Dashboard,
+    dashboard_activity_table,
+)
+from search_index_queue import (
+    search_index_queue_table,
 )
 
 import ckan.migration
@@ -1,10 +1,13 @@
 import datetime
 
-from sqlalchemy import orm, types, Column, Table, ForeignKey, desc, or_
+from sqlalchemy import (orm, types, Column, Table, ForeignKey, desc, or_,
+                        and_)
+from sqlalchemy.orm.interfaces import MapperExtension
 
 import meta
 import types as _types
 import domain_object
+import dashboard
 
 __all__ = ['Activity', 'activity_table',
            'ActivityDetail', 'activity_detail_table',
@@ -46,7 +49,17 @@ class Activity(domain_object.DomainObject):
         else:
             self.data = data
 
-meta.mapper(Activity, activity_table)
+
+class ActivityMapperExtension(MapperExtension):
+    '''Updates the new activities count of the dashboards of the users who
+    will see the activities, as they are inserted.'''
+
+    def after_insert(self, mapper, connection, instance):
+        dashboard.activity_emitted(connection, instance)
+
+
+meta.mapper(Activity, activity_table,
+            extension=[ActivityMapperExtension()])
 
 
 class ActivityDetail(domain_object.DomainObject):
@@ -257,13 +270,22 @@ def activities_from_everything_followed_by_user(user_id, limit, offset):
 
 
 def _dashboard_activity_query(user_id):
-    '''Return an SQLAlchemy query for user_id's dashboard activity stream.'''
-    q = _user_activity_query(user_id)
-    q = q.union(_activities_from_everything_followed_by_user_query(user_id))
+    '''Return an SQLAlchemy query for user_id's dashboard activity stream.
+
+    The activities are read from the user's materialized dashboard activity
+    feed (see ckan.model.dashboard), newest first.
+
+    '''
+    import ckan.model as model
+    feed = dashboard.dashboard_activity_table
+    q = model.Session.query(model.Activity)
+    q = q.join((feed, feed.c.activity_id == model.Activity.id))
+    q = q.filter(feed.c.user_id == user_id)
+    q = q.order_by(desc(feed.c.timestamp), desc(feed.c.activity_id))
     return q
 
 
-def dashboard_activity_list(user_id, limit, offset):
+def dashboard_activity_list(user_id, limit, offset, before=None):
     '''Return the given user's dashboard activity stream.
 
     Returns activities from the user's public activity stream, plus
@@ -272,9 +294,28 @@ def dashboard_activity_list(user_id, limit, offset):
     This is the union of user_activity_list(user_id) and
     activities_from_everything_followed_by_user(user_id).
 
+    If before is the id of an activity of the stream, only the activities
+    after it in the stream (i.e. older ones) are returned, which unlike an
+    offset doesn't get slower the further back the page is.
+
     '''
+    import ckan.model as model
     q = _dashboard_activity_query(user_id)
-    return _activities_at_offset(q, limit, offset)
+    if before:
+        feed = dashboard.dashboard_activity_table
+        last = model.Session.query(feed.c.timestamp).filter(
+            feed.c.user_id == user_id).filter(
+            feed.c.activity_id == before).first()
+        if not last:
+            return []
+        q = q.filter(or_(feed.c.timestamp < last.timestamp,
+                         and_(feed.c.timestamp == last.timestamp,
+                              feed.c.activity_id < before)))
+    if offset:
+        q = q.offset(offset)
+    if limit:
+        q = q.limit(limit)
+    return q.all()
 
 def _changed_packages_activity_query():
     '''Return an SQLAlchemyu query for all changed package activities.
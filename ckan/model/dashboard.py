@@ -10,9 +10,118 @@ dashboard_table = sqlalchemy.Table('dashboard', meta.metadata,
     sqlalchemy.Column('activity_stream_last_viewed', sqlalchemy.types.DateTime,
         nullable=False),
     sqlalchemy.Column('email_last_sent', sqlalchemy.types.DateTime,
-        nullable=False)
+        nullable=False),
+    sqlalchemy.Column('new_activities_count', sqlalchemy.types.Integer,
+        nullable=False, default=0)
 )
 
+dashboard_activity_table = sqlalchemy.Table('dashboard_activity',
+        meta.metadata,
+    sqlalchemy.Column('user_id', sqlalchemy.types.UnicodeText,
+            sqlalchemy.ForeignKey('user.id', onupdate='CASCADE',
+                ondelete='CASCADE'),
+            primary_key=True, nullable=False),
+    sqlalchemy.Column('activity_id', sqlalchemy.types.UnicodeText,
+            sqlalchemy.ForeignKey('activity.id', onupdate='CASCADE',
+                ondelete='CASCADE'),
+            primary_key=True, nullable=False),
+    sqlalchemy.Column('timestamp', sqlalchemy.types.DateTime,
+        nullable=False),
+)
+
+sqlalchemy.Index('idx_dashboard_activity_user_timestamp',
+                 dashboard_activity_table.c.user_id,
+                 dashboard_activity_table.c.timestamp,
+                 dashboard_activity_table.c.activity_id)
+sqlalchemy.Index('idx_dashboard_activity_activity_id',
+                 dashboard_activity_table.c.activity_id)
+
+# The datasets of a group whose activities appear in the dashboards of the
+# group's followers (see ckan.model.Group.packages)
+_GROUP_DATASETS = """SELECT m.table_id FROM member m
+        JOIN package p ON p.id = m.table_id
+        WHERE m.group_id = {group} AND m.table_name = 'package'
+        AND m.state = 'active' AND p.state IN ('active', 'pending')
+        AND NOT p.private"""
+
+# Adds a new activity to the dashboard activity feeds it appears in: those
+# of the user who did it and of the user it is about, and of the followers
+# of these users, of its object, and of the groups its object is in.
+_add_activity = sqlalchemy.text("""
+INSERT INTO dashboard_activity (user_id, activity_id, timestamp)
+SELECT recipient.user_id, :activity_id, :timestamp FROM (
+    SELECT id AS user_id FROM "user" WHERE id IN (:user_id, :object_id)
+    UNION SELECT follower_id FROM user_following_user
+        WHERE object_id IN (:user_id, :object_id)
+    UNION SELECT follower_id FROM user_following_dataset
+        WHERE object_id = :object_id
+    UNION SELECT follower_id FROM user_following_group
+        WHERE object_id = :object_id
+    UNION SELECT f.follower_id FROM user_following_group f
+        WHERE :object_id IN ({0})) AS recipient""".format(
+    _GROUP_DATASETS.format(group='f.object_id')))
+
+# The user's own activities are not new to them
+_increment_new_activities_count = sqlalchemy.text("""
+UPDATE dashboard SET new_activities_count = new_activities_count + 1
+WHERE user_id IN (
+    SELECT user_id FROM dashboard_activity WHERE activity_id = :activity_id)
+AND (:user_id IS NULL OR user_id <> :user_id)""")
+
+# Past activities of an object that appear in the feed of its new followers
+_FOLLOWEE_ACTIVITIES = {
+    'user': 'a.user_id = :object_id OR a.object_id = :object_id',
+    'dataset': 'a.object_id = :object_id',
+    'group': 'a.object_id = :object_id OR a.object_id IN ({0})'.format(
+        _GROUP_DATASETS.format(group=':object_id')),
+}
+
+_add_followee_activities = """
+INSERT INTO dashboard_activity (user_id, activity_id, timestamp)
+SELECT :follower_id, a.id, a.timestamp FROM activity a
+WHERE ({0}) AND NOT EXISTS (
+    SELECT 1 FROM dashboard_activity d
+    WHERE d.user_id = :follower_id AND d.activity_id = a.id)"""
+
+# Removes the activities of an unfollowed object from the feed of its former
+# follower, unless they still appear in it: activities of or about the
+# follower, or of what they still follow
+_remove_followee_activities = """
+DELETE FROM dashboard_activity
+WHERE user_id = :follower_id AND activity_id IN (
+    SELECT a.id FROM activity a
+    WHERE ({0})
+    AND (a.user_id IS NULL OR a.user_id <> :follower_id)
+    AND (a.object_id IS NULL OR a.object_id <> :follower_id)
+    AND NOT EXISTS (SELECT 1 FROM user_following_user f
+        WHERE f.follower_id = :follower_id
+        AND f.object_id IN (a.user_id, a.object_id))
+    AND NOT EXISTS (SELECT 1 FROM user_following_dataset f
+        WHERE f.follower_id = :follower_id AND f.object_id = a.object_id)
+    AND NOT EXISTS (SELECT 1 FROM user_following_group f
+        WHERE f.follower_id = :follower_id
+        AND (f.object_id = a.object_id OR a.object_id IN ({1}))))"""
+
+# All the activities of the dashboard activity feeds, computed from the
+# activities and what each user follows
+_ALL_FEEDS = """
+SELECT a.user_id, a.id AS activity_id, a.timestamp FROM activity a
+    JOIN "user" u ON u.id = a.user_id
+UNION SELECT a.object_id, a.id, a.timestamp FROM activity a
+    JOIN "user" u ON u.id = a.object_id
+UNION SELECT f.follower_id, a.id, a.timestamp FROM user_following_user f
+    JOIN activity a ON a.user_id = f.object_id OR a.object_id = f.object_id
+UNION SELECT f.follower_id, a.id, a.timestamp FROM user_following_dataset f
+    JOIN activity a ON a.object_id = f.object_id
+UNION SELECT f.follower_id, a.id, a.timestamp FROM user_following_group f
+    JOIN activity a ON a.object_id = f.object_id
+UNION SELECT f.follower_id, a.id, a.timestamp FROM user_following_group f
+    JOIN member m ON m.group_id = f.object_id
+    JOIN package p ON p.id = m.table_id
+    JOIN activity a ON a.object_id = m.table_id
+    WHERE m.table_name = 'package' AND m.state = 'active'
+    AND p.state IN ('active', 'pending') AND NOT p.private"""
+
 
 class Dashboard(object):
     '''Saved data used for the user's dashboard.'''
@@ -21,6 +130,7 @@ class Dashboard(object):
         self.user_id = user_id
         self.activity_stream_last_viewed = datetime.datetime.now()
         self.email_last_sent = datetime.datetime.now()
+        self.new_activities_count = 0
 
     @classmethod
     def get(cls, user_id):
@@ -40,4 +150,69 @@ class Dashboard(object):
             meta.Session.commit()
         return row
 
+    @classmethod
+    def new_activities_count(cls, user_id):
+        '''Return the number of new activities in the given user's dashboard.
+
+        Unlike get(), this doesn't create the dashboard row if there isn't
+        one (the user has no new activities then), so it only costs one
+        lookup by primary key.
+
+        '''
+        count = meta.Session.execute(
+            sqlalchemy.select([dashboard_table.c.new_activities_count])
+            .where(dashboard_table.c.user_id == user_id)).scalar()
+        return count or 0
+
+
+def activity_emitted(connection, activity):
+    '''Add the given (just inserted) activity to the dashboard activity feeds
+    it appears in, and count it as new in them.'''
+    params = {'activity_id': activity.id, 'timestamp': activity.timestamp,
+              'user_id': activity.user_id, 'object_id': activity.object_id}
+    connection.execute(_add_activity, **params)
+    connection.execute(_increment_new_activities_count, **params)
+
+
+def followee_added(follower_id, object_id, object_type):
+    '''Add the past activities of an object ('user', 'dataset' or 'group')
+    to the dashboard activity feed of its new follower.'''
+    meta.Session.execute(
+        _add_followee_activities.format(_FOLLOWEE_ACTIVITIES[object_type]),
+        {'follower_id': follower_id, 'object_id': object_id})
+
+
+def followee_removed(follower_id, object_id, object_type):
+    '''Remove the activities of an object ('user', 'dataset' or 'group')
+    from the dashboard activity feed of its former follower.
+
+    The follower row must have been deleted (and flushed) already.'''
+    meta.Session.execute(
+        _remove_followee_activities.format(
+            _FOLLOWEE_ACTIVITIES[object_type],
+            _GROUP_DATASETS.format(group='f.object_id')),
+        {'follower_id': follower_id, 'object_id': object_id})
+
+
+def rebuild_activity_feeds(user_id=None):
+    '''Recompute the dashboard activity feed of the given user (of all the
+    users by default) from the activities and what they follow.
+
+    Returns the number of activities in the rebuilt feeds.'''
+    table = dashboard_activity_table
+    delete = table.delete()
+    where = ''
+    params = {}
+    if user_id is not None:
+        delete = delete.where(table.c.user_id == user_id)
+        where = 'WHERE feed.user_id = :user_id'
+        params['user_id'] = user_id
+    meta.Session.execute(delete)
+    result = meta.Session.execute(
+        """INSERT INTO dashboard_activity (user_id, activity_id, timestamp)
+        SELECT feed.user_id, feed.activity_id, feed.timestamp
+        FROM ({0}) AS feed {1}""".format(_ALL_FEEDS, where), params)
+    return result.rowcount
+
+
 meta.mapper(Dashboard, dashboard_table)
@@ -5,6 +5,7 @@ import extension
 import domain_object
 import package as _package
 import resource
+import group as _group
 
 log = logging.getLogger(__name__)
 
@@ -33,13 +34,15 @@ class DomainObjectModificationExtension(plugins.SingletonPlugin, extension.Obser
         deleted = obj_cache['deleted']
 
         for obj in set(new):
-            if isinstance(obj, (_package.Package, resource.Resource)):
+            if isinstance(obj, (_package.Package, resource.Resource,
+                                _group.Group)):
                 self.notify(obj, domain_object.DomainObjectOperation.new)
         for obj in set(deleted):
-            if isinstance(obj, (_package.Package, resource.Resource)):
+            if isinstance(obj, (_package.Package, resource.Resource,
+                                _group.Group)):
                 self.notify(obj, domain_object.DomainObjectOperation.deleted)
         for obj in set(changed):
-            if isinstance(obj, resource.Resource):
+            if isinstance(obj, (resource.Resource, _group.Group)):
                 self.notify(obj, domain_object.DomainObjectOperation.changed)
             if getattr(obj, 'url_changed', False):
                 for item in plugins.PluginImplementations(plugins.IResourceUrlChange):
@@ -0,0 +1,22 @@
+import datetime
+
+from sqlalchemy import types, Column, Table, Index
+
+import meta
+
+__all__ = ['search_index_queue_table']
+
+# Datasets waiting to be (re)indexed when asynchronous indexing is enabled
+search_index_queue_table = Table('search_index_queue', meta.metadata,
+        Column('id', types.Integer, primary_key=True, nullable=False),
+        Column('package_id', types.UnicodeText, nullable=False),
+        Column('operation', types.Unicode(10), nullable=False),
+        Column('queued', types.DateTime, nullable=False,
+               default=datetime.datetime.now),
+        Column('attempts', types.Integer, nullable=False, default=0),
+        Column('next_attempt', types.DateTime),
+        Column('error', types.UnicodeText),
+    )
+
+Index('idx_search_index_queue_package_id',
+      search_index_queue_table.c.package_id)
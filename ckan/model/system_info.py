@@ -5,7 +5,7 @@ import core
 import domain_object
 
 __all__ = ['system_info_revision_table', 'system_info_table', 'SystemInfo',
-          'get_system_info', 'set_system_info']
+          'get_system_info', 'get_system_info_dict', 'set_system_info']
 
 system_info_table = Table('system_info', meta.metadata,
         Column('id', types.Integer(),  primary_key=True, nullable=False),
@@ -35,6 +35,12 @@ def get_system_info(key, default=None):
         return default
 
 
+def get_system_info_dict():
+    ''' get all the data from system_info table as a dict '''
+    query = meta.Session.query(SystemInfo.key, SystemInfo.value)
+    return dict(query.all())
+
+
 def delete_system_info(key, default=None):
     ''' delete data from system_info table '''
     obj = meta.Session.query(SystemInfo).filter_by(key=key).first()
@@ -177,7 +177,8 @@ class ISession(Interface):
 
 class IDomainObjectModification(Interface):
     """
-    Receives notification of new, changed and deleted datesets.
+    Receives notification of new, changed and deleted datesets, resources
+    and groups.
     """
 
     def notify(self, entity, operation):
@@ -394,6 +395,9 @@ class IPackageController(Interface):
             from fields starting with `ext_`, so extensions can receive user
             input from specific fields.
 
+            When the results are displayed, before_view is called on each of
+            them after after_search.
+
         '''
 
         return search_results
@@ -348,3 +348,68 @@ class TestDashboard(object):
                 extra_environ={'Authorization':
                     str(self.annafan['apikey'])})
         assert res.json['success'] is True
+
+    def test_11_dashboard_activity_list_before(self):
+        '''Test paging through the dashboard activity stream with the id of
+        the last activity of the previous page.'''
+        activities = self.dashboard_activity_list(self.new_user)
+        assert len(activities) > 5
+        page = self.post('dashboard_activity_list',
+                {'before': activities[4]['id'], 'limit': 3},
+                apikey=self.new_user['apikey'])
+        assert page == activities[5:8]
+
+        page = self.post('dashboard_activity_list',
+                {'before': activities[-1]['id']},
+                apikey=self.new_user['apikey'])
+        assert page == []
+
+    def test_12_rebuild_activity_feeds(self):
+        '''Test that rebuilding the dashboard activity feeds does not change
+        the dashboard activity stream.'''
+        before = self.dashboard_activity_list(self.new_user)
+        ckan.model.dashboard.rebuild_activity_feeds()
+        ckan.model.repo.commit_and_remove()
+        after = self.dashboard_activity_list(self.new_user)
+        assert before == after
+
+    def test_13_unfollow_removes_activities(self):
+        '''Test that the activities of a dataset are removed from the
+        dashboard activity stream when the user unfollows it.'''
+        dataset = self.post('package_create', {'name': 'unfollowed_dataset'},
+                            apikey=self.joeadmin['apikey'])
+
+        def dataset_activities():
+            return [activity for activity
+                    in self.dashboard_activity_list(self.new_user)
+                    if activity['object_id'] == dataset['id']]
+
+        assert dataset_activities() == []
+        self.post('follow_dataset', {'id': dataset['id']},
+                  apikey=self.new_user['apikey'])
+        assert len(dataset_activities()) == 1
+        self.post('unfollow_dataset', {'id': dataset['id']},
+                  apikey=self.new_user['apikey'])
+        assert dataset_activities() == []
+
+    def test_14_unfollow_keeps_activities_still_followed(self):
+        '''Test that unfollowing a dataset leaves the activities that still
+        appear in the dashboard for other reasons.'''
+        # the user follows annafan
+        dataset = self.post('package_create', {'name': 'annafans_dataset'},
+                            apikey=self.annafan['apikey'])
+        own_dataset = self.post('package_show', {'id': 'my_new_package'})
+
+        def activities(dataset):
+            return [activity for activity
+                    in self.dashboard_activity_list(self.new_user)
+                    if activity['object_id'] == dataset['id']]
+
+        for followed in (dataset, own_dataset):
+            before = activities(followed)
+            assert len(before) >= 1, before
+            self.post('follow_dataset', {'id': followed['id']},
+                      apikey=self.new_user['apikey'])
+            self.post('unfollow_dataset', {'id': followed['id']},
+                      apikey=self.new_user['apikey'])
+            assert activities(followed) == before
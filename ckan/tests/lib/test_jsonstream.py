@@ -0,0 +1,66 @@
+import json
+
+from nose.tools import assert_equal
+
+import ckan.lib.jsonstream as jsonstream
+
+
+class TestJsonStream:
+    def _stream(self, items, closed):
+        return jsonstream.JsonStream(
+            (json.dumps(item) for item in items),
+            close=lambda: closed.append(True))
+
+    def test_not_streamed(self):
+        data = {'a': [1, 2], 'b': {'c': None}}
+        assert not jsonstream.is_streamed(data)
+        assert_equal(''.join(jsonstream.iterencode(data)), json.dumps(data))
+
+    def test_stream(self):
+        closed = []
+        records = [{'a': 1}, {'b': u'\xfc'}, {'c': [1.5, None]}]
+        data = {'success': True,
+                'result': {'records': self._stream(records, closed),
+                           'total': 3}}
+        assert jsonstream.is_streamed(data)
+        encoded = ''.join(jsonstream.iterencode(data))
+        assert_equal(json.loads(encoded),
+                     {'success': True,
+                      'result': {'records': records, 'total': 3}})
+        assert_equal(closed, [True])
+
+    def test_chunks_are_byte_strings(self):
+        data = {'records': jsonstream.JsonStream(
+            [u'{"a": "\\u00fc"}', u'"\u00fc"'])}
+        chunks = list(jsonstream.iterencode(data, chunk_size=4))
+        for chunk in chunks:
+            assert type(chunk) is str, chunk
+        assert_equal(json.loads(''.join(chunks)),
+                     {'records': [{'a': u'\xfc'}, u'\xfc']})
+
+    def test_empty_stream(self):
+        closed = []
+        encoded = ''.join(jsonstream.iterencode([self._stream([], closed)]))
+        assert_equal(json.loads(encoded), [[]])
+        assert_equal(closed, [True])
+
+    def test_deferred_values_come_last(self):
+        seen = []
+
+        def items():
+            for i in range(3):
+                seen.append(i)
+                yield json.dumps(i)
+
+        data = {'a': jsonstream.Deferred(lambda: len(seen)),
+                'records': jsonstream.JsonStream(items())}
+        encoded = ''.join(jsonstream.iterencode(data))
+        assert_equal(json.loads(encoded), {'a': 3, 'records': [0, 1, 2]})
+
+    def test_chunk_size(self):
+        records = range(1000)
+        chunks = list(jsonstream.iterencode(
+            {'records': self._stream(records, [])}, chunk_size=100))
+        assert len(chunks) > 10
+        assert all(len(chunk) < 200 for chunk in chunks)
+        assert_equal(json.loads(''.join(chunks)), {'records': records})
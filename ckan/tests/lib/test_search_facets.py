@@ -0,0 +1,83 @@
+from nose.tools import assert_equal
+
+from ckan import model
+from ckan.lib.create_test_data import CreateTestData
+from ckan.tests import setup_test_search_index
+import ckan.lib.search as search
+import ckan.lib.search.facets as facets
+
+
+class TestGroupDisplayNames:
+    @classmethod
+    def setup_class(cls):
+        CreateTestData.create()
+
+    @classmethod
+    def teardown_class(cls):
+        model.repo.rebuild_db()
+
+    def setup(self):
+        facets.clear_group_display_names()
+
+    def test_display_names(self):
+        group = model.Group.get('david')
+        names = facets.group_display_names(['david', 'roger', group.id])
+        assert_equal(names, {
+            'david': "Dave's books",
+            'roger': "Roger's books",
+            group.id: "Dave's books",
+        })
+
+    def test_unknown_group(self):
+        names = facets.group_display_names(['not-a-group'])
+        assert_equal(names, {'not-a-group': 'not-a-group'})
+
+    def test_cached(self):
+        facets.group_display_names(['david'])
+        assert 'david' in facets._group_display_names
+        assert 'roger' not in facets._group_display_names
+
+    def test_cache_cleared_on_group_update(self):
+        facets.group_display_names(['roger'])
+        rev = model.repo.new_revision()
+        group = model.Group.get('roger')
+        group.title = u"Roger's updated books"
+        model.repo.commit_and_remove()
+        try:
+            names = facets.group_display_names(['roger'])
+            assert_equal(names['roger'], u"Roger's updated books")
+        finally:
+            rev = model.repo.new_revision()
+            group = model.Group.get('roger')
+            group.title = u"Roger's books"
+            model.repo.commit_and_remove()
+
+
+class TestGroupPackageCounts:
+    @classmethod
+    def setup_class(cls):
+        setup_test_search_index()
+        CreateTestData.create()
+
+    @classmethod
+    def teardown_class(cls):
+        model.repo.rebuild_db()
+        search.clear()
+
+    def setup(self):
+        facets.clear_group_package_counts()
+
+    def test_package_counts(self):
+        counts = facets.group_package_counts()
+        assert_equal(counts['groups'].get('david'), 2)
+        assert_equal(counts['groups'].get('roger'), 1)
+
+    def test_cached(self):
+        facets.group_package_counts()
+        assert False in facets._group_package_counts
+        assert True not in facets._group_package_counts
+
+    def test_cache_cleared_on_index_update(self):
+        facets.group_package_counts()
+        search.commit()
+        assert_equal(facets._group_package_counts, {})
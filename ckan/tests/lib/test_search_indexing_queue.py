@@ -0,0 +1,62 @@
+from nose.tools import assert_equal
+from pylons import config
+
+from ckan import model
+import ckan.lib.search as search
+from ckan.lib.search import indexing_queue
+from ckan.tests import CreateTestData, setup_test_search_index
+
+
+class TestIndexingQueue:
+    @classmethod
+    def setup_class(cls):
+        setup_test_search_index()
+        config['ckan.search.asynchronous_indexing'] = 'true'
+        CreateTestData.create()
+        cls.solr = search.make_connection()
+        cls.fq = ' +site_id:"%s" ' % config['ckan.site_id']
+
+    @classmethod
+    def teardown_class(cls):
+        config.pop('ckan.search.asynchronous_indexing', None)
+        model.repo.rebuild_db()
+        cls.solr.close()
+        search.clear()
+
+    def _queued(self):
+        table = model.search_index_queue_table
+        return [row.package_id for row in
+                model.Session.execute(table.select().order_by(table.c.id))]
+
+    def _indexed_names(self):
+        return set(r['name'] for r in self.solr.query('*:*', fq=self.fq))
+
+    def test_1_changes_are_queued(self):
+        pkg_ids = set(pkg.id for pkg in model.Session.query(model.Package))
+        assert pkg_ids.issubset(set(self._queued()))
+        assert_equal(self._indexed_names(), set())
+
+        status = indexing_queue.queue_status()
+        assert_equal(status['datasets'], len(pkg_ids))
+        assert_equal(status['failed'], 0)
+
+    def test_2_process_queue(self):
+        while indexing_queue.process_queue():
+            pass
+        assert_equal(self._queued(), [])
+        assert_equal(self._indexed_names(),
+                     set(['annakarenina', 'warandpeace']))
+
+    def test_3_repeated_updates_are_coalesced(self):
+        for title in (u'War and Peace 1', u'War and Peace 2'):
+            rev = model.repo.new_revision()
+            pkg = model.Package.get('warandpeace')
+            pkg.title = title
+            model.repo.commit_and_remove()
+        pkg_id = model.Package.get('warandpeace').id
+        assert_equal(self._queued(), [pkg_id, pkg_id])
+
+        assert_equal(indexing_queue.process_queue(), 1)
+        assert_equal(self._queued(), [])
+        results = self.solr.query('name:warandpeace', fq=self.fq)
+        assert_equal(results.results[0]['title'], u'War and Peace 2')
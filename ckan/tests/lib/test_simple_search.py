@@ -1,4 +1,5 @@
 from nose.tools import assert_equal
+from nose.plugins.skip import SkipTest
 
 from ckan import model
 from ckan.lib.create_test_data import CreateTestData
@@ -33,3 +34,53 @@ class TestSimpleSearch:
         # This is the default query from the search page
         res = PackageSearchQuery().run({'q': u''})
         assert res['count'] >= 2, res['count']
+
+class TestSimpleSearchFullText:
+    @classmethod
+    def setup_class(cls):
+        if not model.engine_is_pg():
+            raise SkipTest('Full text simple search requires PostgreSQL')
+        CreateTestData.create()
+
+    @classmethod
+    def teardown_class(cls):
+        model.repo.rebuild_db()
+
+    def _names(self, res):
+        return [model.Package.get(r['id']).name for r in res['results']]
+
+    def test_notes_and_tags_are_searched(self):
+        res = PackageSearchQuery().run({'q': u'tolstoy'})
+        assert_equal(self._names(res), [u'annakarenina'])
+
+    def test_filter_by_tag(self):
+        res = PackageSearchQuery().run({'q': u'', 'fq': u'tags:"russian"',
+                                        'sort': u'name asc'})
+        assert_equal(self._names(res), [u'annakarenina', u'warandpeace'])
+
+    def test_negative_filter(self):
+        res = PackageSearchQuery().run({'q': u'-license_id:cc-nc'})
+        assert_equal(self._names(res), [u'annakarenina'])
+
+    def test_sort_and_paging(self):
+        query = {'q': u'*:*', 'fq': u'+tags:russian', 'sort': u'name desc',
+                 'rows': 1, 'start': 1}
+        res = PackageSearchQuery().run(query)
+        assert_equal(self._names(res), [u'annakarenina'])
+        assert_equal(res['count'], 2)
+
+    def test_facets(self):
+        query = PackageSearchQuery()
+        query.run({'q': u'', 'fq': u'tags:russian',
+                   'facet.field': ['tags', 'groups', 'license_id']})
+        assert_equal(query.facets['tags'][u'russian'], 2)
+        assert_equal(query.facets['tags'][u'tolstoy'], 1)
+        assert_equal(query.facets['groups'],
+                     {u'david': 2, u'roger': 1})
+        assert_equal(query.facets['license_id'],
+                     {u'other-open': 1, u'cc-nc': 1})
+
+    def test_facet_limit(self):
+        query = PackageSearchQuery()
+        query.run({'q': u'', 'facet.field': ['tags'], 'facet.limit': 1})
+        assert_equal(query.facets['tags'].values(), [2])
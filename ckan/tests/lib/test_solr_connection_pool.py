@@ -0,0 +1,83 @@
+from nose.tools import assert_equal, assert_raises
+
+from ckan.lib.search import common
+
+
+class MockConnection(object):
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class TestSolrConnectionPool:
+    def setup(self):
+        self._make_connection = common.make_connection
+        self._pool_size = common.SolrSettings.pool_size
+        self._pool_max_idle = common.SolrSettings.pool_max_idle
+        common.make_connection = MockConnection
+        self.pool = common.SolrConnectionPool()
+
+    def teardown(self):
+        common.make_connection = self._make_connection
+        common.SolrSettings.pool_size = self._pool_size
+        common.SolrSettings.pool_max_idle = self._pool_max_idle
+
+    def test_connections_are_reused(self):
+        conn = self.pool.get()
+        self.pool.put(conn)
+        assert self.pool.get() is conn
+        stats = self.pool.stats()
+        assert_equal(stats['created'], 1)
+        assert_equal(stats['reused'], 1)
+        assert_equal(stats['in_use'], 1)
+        assert_equal(stats['idle'], 0)
+
+    def test_unhealthy_connections_are_discarded(self):
+        conn = self.pool.get()
+        self.pool.put(conn, healthy=False)
+        assert conn.closed
+        assert self.pool.get() is not conn
+        assert_equal(self.pool.stats()['discarded'], 1)
+
+    def test_pool_size(self):
+        common.SolrSettings.pool_size = 1
+        conns = [self.pool.get(), self.pool.get()]
+        for conn in conns:
+            self.pool.put(conn)
+        assert not conns[0].closed
+        assert conns[1].closed
+        assert_equal(self.pool.stats()['idle'], 1)
+
+    def test_idle_connections_expire(self):
+        common.SolrSettings.pool_max_idle = -1
+        conn = self.pool.get()
+        self.pool.put(conn)
+        assert self.pool.get() is not conn
+        assert conn.closed
+
+    def test_clear(self):
+        conn = self.pool.get()
+        self.pool.put(conn)
+        self.pool.clear()
+        assert conn.closed
+        assert_equal(self.pool.stats()['idle'], 0)
+
+    def test_context_manager_discards_on_error(self):
+        common._pool.clear()
+        original_pool = common._pool
+        common._pool = self.pool
+        try:
+            def use_connection():
+                with common.solr_connection() as conn:
+                    raise ValueError()
+            assert_raises(ValueError, use_connection)
+            assert_equal(self.pool.stats()['discarded'], 1)
+            assert_equal(self.pool.stats()['in_use'], 0)
+
+            with common.solr_connection() as conn:
+                pass
+            assert_equal(self.pool.stats()['idle'], 1)
+        finally:
+            common._pool = original_pool
@@ -157,3 +157,57 @@ class TestSolrSearch:
         assert 'se-publications' in result_names
         assert 'se-opengov' in result_names
 
+
+
+class TestSolrSearchBatchRebuild:
+    @classmethod
+    def setup_class(cls):
+        setup_test_search_index()
+        CreateTestData.create_search_test_data()
+        cls.solr = search.make_connection()
+        cls.fq = " +site_id:\"%s\" " % config['ckan.site_id']
+
+    @classmethod
+    def teardown_class(cls):
+        model.repo.rebuild_db()
+        cls.solr.close()
+        search.index_for('Package').clear()
+
+    def test_rebuild_in_batches(self):
+        search.rebuild(batch_size=4)
+        results = self.solr.query('*:*', fq=self.fq)
+        assert len(results) == 6, len(results)
+
+    def test_rebuild_in_batches_deferred_commit(self):
+        search.index_for('Package').clear()
+        search.rebuild(batch_size=4, defer_commit=True)
+        search.commit()
+        results = self.solr.query('*:*', fq=self.fq)
+        assert len(results) == 6, len(results)
+
+    def test_rebuild_with_workers(self):
+        search.index_for('Package').clear()
+        search.rebuild(batch_size=2, workers=2)
+        results = self.solr.query('*:*', fq=self.fq)
+        assert len(results) == 6, len(results)
+
+    def test_rebuild_falls_back_to_one_by_one(self):
+        search.index_for('Package').clear()
+        index_packages = search.PackageSearchIndex.index_packages
+        calls = []
+
+        def failing_index_packages(self, pkg_dicts):
+            # the datasets are sent, then the whole batch fails
+            index_packages(self, pkg_dicts)
+            calls.append(len(pkg_dicts))
+            if len(pkg_dicts) > 1:
+                raise search.SearchIndexError('batch failed')
+
+        search.PackageSearchIndex.index_packages = failing_index_packages
+        try:
+            search.rebuild(batch_size=10, force=True)
+        finally:
+            search.PackageSearchIndex.index_packages = index_packages
+        assert calls == [6, 1, 1, 1, 1, 1, 1], calls
+        results = self.solr.query('*:*', fq=self.fq)
+        assert len(results) == 6, len(results)
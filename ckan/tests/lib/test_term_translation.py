@@ -0,0 +1,84 @@
+from nose.tools import assert_equal
+
+import ckan.model as model
+import ckan.logic.action.update as update
+import ckan.lib.term_translation as term_translation
+
+
+class TestTermTranslationCache:
+    def setup(self):
+        model.repo.rebuild_db()
+        self.context = {'model': model, 'session': model.Session,
+                        'ignore_auth': True}
+
+    def teardown(self):
+        model.repo.rebuild_db()
+        term_translation._cache.clear()
+
+    def _update(self, term, translation, lang_code):
+        update.term_translation_update(self.context, {
+            'term': term, 'term_translation': translation,
+            'lang_code': lang_code})
+
+    def test_get_translations(self):
+        self._update(u'moo', u'french moo', u'fr')
+        self._update(u'moo', u'german moo', u'de')
+        translations = term_translation.get_translations(
+            [u'moo', u'cow'], (u'fr', u'it'))
+        assert_equal(translations, {(u'moo', u'fr'): u'french moo'})
+
+    def test_cached(self):
+        self._update(u'moo', u'french moo', u'fr')
+        cache = term_translation.TermTranslationCache()
+        cache.get([u'moo', u'cow'], (u'fr',))
+        # changed without invalidating the cache
+        model.Session.execute(
+            "UPDATE term_translation SET term_translation = 'changed'")
+        model.Session.execute("INSERT INTO term_translation VALUES "
+                              "('cow', 'french cow', 'fr')")
+        model.Session.commit()
+        assert_equal(cache.get([u'moo', u'cow'], (u'fr',)),
+                     {(u'moo', u'fr'): u'french moo'})
+        cache.clear()
+        assert_equal(cache.get([u'moo', u'cow'], (u'fr',)),
+                     {(u'moo', u'fr'): u'changed',
+                      (u'cow', u'fr'): u'french cow'})
+
+    def test_update_invalidates(self):
+        self._update(u'moo', u'french moo', u'fr')
+        assert_equal(term_translation.get_translations([u'moo'], (u'fr',)),
+                     {(u'moo', u'fr'): u'french moo'})
+        self._update(u'moo', u'new french moo', u'fr')
+        assert_equal(term_translation.get_translations([u'moo'], (u'fr',)),
+                     {(u'moo', u'fr'): u'new french moo'})
+
+    def test_update_many_invalidates(self):
+        assert_equal(term_translation.get_translations([u'moo'], (u'fr',)),
+                     {})
+        update.term_translation_update_many(self.context, {'data': [
+            {'term': u'moo', 'term_translation': u'french moo',
+             'lang_code': u'fr'}]})
+        assert_equal(term_translation.get_translations([u'moo'], (u'fr',)),
+                     {(u'moo', u'fr'): u'french moo'})
+
+    def test_invalidated_during_lookup(self):
+        self._update(u'moo', u'french moo', u'fr')
+        cache = term_translation.TermTranslationCache()
+        lookup = term_translation._lookup
+
+        def changed_during_lookup(terms, lang_codes):
+            translations = lookup(terms, lang_codes)
+            model.Session.execute(
+                "UPDATE term_translation SET term_translation = 'changed'")
+            model.Session.commit()
+            cache.invalidate()
+            return translations
+        term_translation._lookup = changed_during_lookup
+        try:
+            assert_equal(cache.get([u'moo'], (u'fr',)),
+                         {(u'moo', u'fr'): u'french moo'})
+        finally:
+            term_translation._lookup = lookup
+        # the translation read before the change wasn't cached
+        assert_equal(cache.get([u'moo'], (u'fr',)),
+                     {(u'moo', u'fr'): u'changed'})
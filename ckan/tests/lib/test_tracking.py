@@ -0,0 +1,221 @@
+import time
+import datetime
+
+from nose.tools import assert_equal
+from nose.plugins.skip import SkipTest
+
+import ckan.model as model
+import ckan.lib.tracking as tracking
+from ckan.lib.create_test_data import CreateTestData
+
+
+class TestParsePayload:
+    def test_parse_payload(self):
+        data = tracking.parse_payload(
+            'url=%2Fdataset%2Fa%3Db&type=page&q=x=y+z&empty=')
+        assert_equal(data, {'url': u'/dataset/a=b', 'type': u'page',
+                            'q': u'x=y z', 'empty': u''})
+
+
+class TestTrackingWriter:
+    def setup(self):
+        model.repo.rebuild_db()
+
+    def teardown(self):
+        model.repo.rebuild_db()
+
+    def _urls(self):
+        return sorted(row[0] for row in model.meta.engine.execute(
+            'SELECT url FROM tracking_raw'))
+
+    def test_stop_writes_buffered_events(self):
+        writer = tracking.TrackingWriter(model.meta.engine, batch_size=2,
+                                         flush_interval=60)
+        for url in [u'/dataset/a', u'/dataset/b', u'/dataset/c']:
+            writer.add('key', url, u'page')
+        writer.stop()
+        assert_equal(self._urls(),
+                     [u'/dataset/a', u'/dataset/b', u'/dataset/c'])
+        assert_equal(writer.stats(),
+                     {'buffered': 0, 'flushed': 3, 'dropped': 0})
+
+    def test_full_buffer_drops_events(self):
+        writer = tracking.TrackingWriter(model.meta.engine, batch_size=10,
+                                         max_buffer=2, flush_interval=60)
+        for url in [u'/dataset/a', u'/dataset/b', u'/dataset/c']:
+            writer.add('key', url, u'page')
+        writer.stop()
+        assert_equal(self._urls(), [u'/dataset/a', u'/dataset/b'])
+        assert_equal(writer.stats(),
+                     {'buffered': 0, 'flushed': 2, 'dropped': 1})
+
+    def test_thread_writes_events(self):
+        writer = tracking.TrackingWriter(model.meta.engine, batch_size=10,
+                                         flush_interval=0.1)
+        writer.add('key', u'/dataset/a', u'page')
+        for wait in range(50):
+            if writer.stats()['flushed']:
+                break
+            time.sleep(0.1)
+        assert_equal(self._urls(), [u'/dataset/a'])
+        writer.stop()
+
+    def test_large_batches(self):
+        # more parameters than SQLite accepts in a statement
+        writer = tracking.TrackingWriter(model.meta.engine, batch_size=1000,
+                                         flush_interval=60)
+        for num in range(600):
+            writer.add('key', u'/dataset/{0}'.format(num), u'page')
+        writer.stop()
+        assert_equal(len(self._urls()), 600)
+        assert_equal(writer.stats(),
+                     {'buffered': 0, 'flushed': 600, 'dropped': 0})
+
+
+class TestUpdateSummary:
+    '''Tests of the tracking summaries, compared to the totals computed
+    from all the raw events like the previous summarizing code did.'''
+
+    @classmethod
+    def setup_class(cls):
+        if model.engine_is_sqlite():
+            raise SkipTest('The tracking summaries need PostgreSQL')
+
+    def setup(self):
+        model.repo.rebuild_db()
+        CreateTestData.create()
+
+    def teardown(self):
+        model.repo.rebuild_db()
+
+    def _add_events(self, *events):
+        for user_key, url, tracking_type, timestamp in events:
+            model.Session.execute(
+                '''INSERT INTO tracking_raw
+                    (user_key, url, tracking_type, access_timestamp)
+                    VALUES (:user_key, :url, :type, :timestamp)''',
+                {'user_key': user_key, 'url': url, 'type': tracking_type,
+                 'timestamp': timestamp})
+        model.Session.commit()
+
+    def _summaries(self):
+        rows = model.Session.execute(
+            '''SELECT url, CAST(tracking_date AS Date), tracking_type,
+                package_id, count, running_total, recent_views
+            FROM tracking_summary''')
+        return dict(((url, date, tracking_type),
+                     (package_id, count, running_total, recent_views))
+                    for url, date, tracking_type, package_id, count,
+                        running_total, recent_views in rows)
+
+    def _expected(self, raw_events):
+        '''Return the summaries of the given events, computed like the
+        previous tracking update command did.'''
+        users = {}
+        for user_key, url, tracking_type, timestamp in raw_events:
+            key = (url, timestamp.date(), tracking_type)
+            users.setdefault(key, set()).add(user_key)
+        package_ids = dict((package.name, package.id)
+                           for package in model.Session.query(model.Package))
+        rows = {}
+        for (url, date, tracking_type), keys in users.items():
+            package_id = None
+            if tracking_type == 'page':
+                name = url.rsplit('/dataset/', 1)[-1] \
+                    if '/dataset/' in url else None
+                package_id = package_ids.get(name, tracking.PACKAGE_NOT_FOUND)
+            rows[(url, date, tracking_type)] = [package_id, len(keys), 0, 0]
+        for (url, date, tracking_type), row in rows.items():
+            if row[0] == tracking.PACKAGE_NOT_FOUND:
+                continue
+            # the totals of the resources are by URL, those of the pages by
+            # dataset
+            same = []
+            for (other_url, other_date, other_type), other in rows.items():
+                if other_type != tracking_type:
+                    continue
+                if tracking_type == 'resource' and other_url != url:
+                    continue
+                if tracking_type == 'page' and other[0] != row[0]:
+                    continue
+                same.append((other_date, other[1]))
+            row[2] = sum(count for other_date, count in same
+                         if other_date <= date)
+            row[3] = sum(count for other_date, count in same
+                         if date - datetime.timedelta(days=14) <= other_date
+                         <= date)
+        return dict((key, tuple(row)) for key, row in rows.items())
+
+    def _events(self, day, hour=12):
+        timestamp = datetime.datetime(2013, 1, day, hour)
+        anna = u'http://test.ckan.net/dataset/annakarenina'
+        return [
+            (u'a', anna, u'page', timestamp),
+            (u'a', anna, u'page', timestamp + datetime.timedelta(minutes=1)),
+            (u'b', anna, u'page', timestamp),
+            (u'c', u'http://test.ckan.net/en/dataset/annakarenina', u'page',
+             timestamp),
+            (u'a', u'http://test.ckan.net/dataset/warandpeace', u'page',
+             timestamp),
+            (u'a', u'http://test.ckan.net/dataset/unknown', u'page',
+             timestamp),
+            (u'a', u'http://test.ckan.net/about', u'page', timestamp),
+            (u'b', u'http://data.org/file.csv', u'resource', timestamp),
+        ]
+
+    def test_summary(self):
+        events = self._events(1) + self._events(2) + self._events(20)
+        self._add_events(*events)
+        assert_equal(tracking.update_summary(), datetime.date(2013, 1, 1))
+        summaries = self._summaries()
+        assert_equal(summaries, self._expected(events))
+        anna = (u'http://test.ckan.net/dataset/annakarenina',
+                datetime.date(2013, 1, 20), u'page')
+        # 3 users a day on 2 URLs, and the views of the 1st are not recent
+        assert_equal(summaries[anna][1:], (2, 9, 3))
+        # nothing new to summarize
+        assert_equal(tracking.update_summary(), None)
+
+    def test_incremental_summary(self):
+        first = self._events(1) + self._events(2, hour=23)
+        self._add_events(*first)
+        tracking.update_summary()
+        # a late event of the last day summarized, and events of new days
+        late = [(u'd', u'http://test.ckan.net/dataset/annakarenina',
+                 u'page', datetime.datetime(2013, 1, 2, 22, 30))]
+        later = self._events(3) + self._events(10)
+        self._add_events(*(late + later))
+        assert_equal(tracking.update_summary(), datetime.date(2013, 1, 2))
+        assert_equal(self._summaries(), self._expected(first + late + later))
+
+    def test_prune_raw(self):
+        assert_equal(tracking.prune_raw(), 0)
+        first = self._events(1) + self._events(2) + self._events(3, hour=0)
+        self._add_events(*first)
+        tracking.update_summary()
+        # the events of the 3rd at midnight are less than an hour after
+        # those of the 2nd, so the next update recomputes the 2nd
+        assert_equal(tracking.prune_raw(), len(self._events(1)))
+        dates = [row[0] for row in model.Session.execute(
+            'SELECT DISTINCT CAST(access_timestamp AS Date) '
+            'FROM tracking_raw ORDER BY 1')]
+        assert_equal(dates, [datetime.date(2013, 1, 2),
+                             datetime.date(2013, 1, 3)])
+
+        # the totals of the pruned days are carried forward
+        later = self._events(4)
+        self._add_events(*later)
+        assert_equal(tracking.update_summary(), datetime.date(2013, 1, 2))
+        assert_equal(self._summaries(), self._expected(first + later))
+
+    def test_update_after_prune(self):
+        first = self._events(1) + self._events(2) + self._events(3)
+        self._add_events(*first)
+        tracking.update_summary()
+        tracking.prune_raw()
+        summaries = self._summaries()
+        # the summaries of the pruned days can't be recomputed
+        assert_equal(tracking.update_summary(datetime.date(2013, 1, 1)),
+                     datetime.date(2013, 1, 3))
+        assert_equal(self._summaries(), summaries)
+        assert_equal(summaries, self._expected(first))
@@ -295,6 +295,25 @@ class TestAction(WsgiAppCase):
         assert res_obj['result'][0]['about'] == 'I love reading Annakarenina. My site: http://anna.com'
         assert not 'apikey' in res_obj['result'][0]
 
+    def test_04_user_list_paginated(self):
+        postparams = '%s=1' % json.dumps({})
+        res = self.app.post('/api/action/user_list', params=postparams)
+        all_users = json.loads(res.body)['result']
+        pages = []
+        for offset in (0, 3, 6):
+            postparams = '%s=1' % json.dumps({'limit': 3, 'offset': offset})
+            res = self.app.post('/api/action/user_list', params=postparams)
+            pages.append(json.loads(res.body)['result'])
+        assert [len(page) for page in pages] == [3, 3, 1], pages
+        assert sum(pages, []) == all_users
+        assert all_users[0]['number_of_edits'] >= 0
+        assert 'number_administered_packages' in all_users[0]
+
+        for limit in ('many', [3], {'limit': 3}):
+            postparams = '%s=1' % json.dumps({'limit': limit})
+            res = self.app.post('/api/action/user_list', params=postparams,
+                                status=StatusCodes.STATUS_409_CONFLICT)
+
     def test_05_user_show(self):
         # Anonymous request
         postparams = '%s=1' % json.dumps({'id':'annafan'})
@@ -582,6 +601,25 @@ class TestAction(WsgiAppCase):
         assert res_obj['help'].startswith('Return the details of a group.')
         assert res_obj['success'] is False
 
+    def test_14_group_show_member_limit(self):
+        postparams = '%s=1' % json.dumps({'id': 'david', 'member_limit': 1})
+        res = self.app.post('/api/action/group_show', params=postparams)
+        result = json.loads(res.body)['result']
+        assert len(result['packages']) == 1
+        assert result['member_counts']['packages'] == 2
+
+        postparams = '%s=1' % json.dumps({'id': 'david'})
+        res = self.app.post('/api/action/group_show', params=postparams)
+        all_packages = json.loads(res.body)['result']['packages']
+        assert result['packages'][0]['id'] == min(
+            package['id'] for package in all_packages)
+
+        for member_limit in ('one', [1]):
+            postparams = '%s=1' % json.dumps({'id': 'david',
+                                              'member_limit': member_limit})
+            self.app.post('/api/action/group_show', params=postparams,
+                          status=StatusCodes.STATUS_409_CONFLICT)
+
     def test_16_user_autocomplete(self):
         #Empty query
         postparams = '%s=1' % json.dumps({})
@@ -1381,6 +1419,41 @@ class TestActionPackageSearch(WsgiAppCase):
         result_names = [r['name'] for r in result['results']]
         assert result_names == ['warandpeace', 'annakarenina'], result_names
 
+    def test_5_package_in_index_but_not_in_db(self):
+        import datetime
+        now = datetime.datetime.now().isoformat()
+        pkg_dict = {
+            'id': u'penguin-id',
+            'name': u'penguin',
+            'title': u'penguin',
+            'state': u'active',
+            'type': u'dataset',
+            'private': False,
+            'owner_org': None,
+            'metadata_created': now,
+            'metadata_modified': now,
+        }
+        search.dispatch_by_operation('Package', pkg_dict, 'new')
+        search_params = '%s=1' % json.dumps({'q': '*:*'})
+        try:
+            res = self.app.post('/api/action/package_search',
+                                params=search_params)
+            result = json.loads(res.body)['result']
+            result_names = [r['name'] for r in result['results']]
+            assert 'penguin' not in result_names, result_names
+            assert_equal(len(result_names), 2)
+
+            config['ckan.search.trust_index'] = 'true'
+            res = self.app.post('/api/action/package_search',
+                                params=search_params)
+            result = json.loads(res.body)['result']
+            result_names = [r['name'] for r in result['results']]
+            assert 'penguin' in result_names, result_names
+            assert_equal(len(result_names), 3)
+        finally:
+            config.pop('ckan.search.trust_index', None)
+            search.index_for('Package').remove_dict(pkg_dict)
+
 class MockPackageSearchPlugin(SingletonPlugin):
     implements(IPackageController, inherit=True)
 
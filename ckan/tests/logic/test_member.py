@@ -61,6 +61,49 @@ class TestMemberLogic(object):
         assert len(res) == 1, res
         assert (self.username, 'user', 'Admin') in res
 
+    def test_member_list_paginated(self):
+        self._add_member(self.pkgs[0].id, 'package', 'public')
+        self._add_member(self.pkgs[1].id, 'package', 'public')
+        ctx, dd = self._build_context('', 'package')
+        all_members = logic.get_action('member_list')(ctx, dd)
+        assert len(all_members) == 2, all_members
+        assert all_members == sorted(all_members)
+
+        dd['limit'] = 1
+        res = logic.get_action('member_list')(ctx, dd)
+        assert res == all_members[:1], res
+
+        dd['after'] = res[-1][0]
+        res = logic.get_action('member_list')(ctx, dd)
+        assert res == all_members[1:], res
+
+        dd['after'] = res[-1][0]
+        res = logic.get_action('member_list')(ctx, dd)
+        assert res == [], res
+
+        for limit in ('one', [1]):
+            dd['limit'] = limit
+            assert_raises(logic.ParameterError,
+                          logic.get_action('member_list'), ctx, dd)
+
+    def test_member_list_private_datasets(self):
+        public_id = model.Package.by_name(u'warandpeace').id
+        private_id = model.Package.by_name(u'annakarenina').id
+        self._add_member(public_id, 'package', 'public')
+        self._add_member(private_id, 'package', 'public')
+        self._set_private(u'annakarenina', True)
+        try:
+            ctx, dd = self._build_context('', 'package')
+            res = logic.get_action('member_list')(ctx, dd)
+        finally:
+            self._set_private(u'annakarenina', False)
+        assert res == [(public_id, 'package', 'public')], res
+
+    def _set_private(self, name, private):
+        model.repo.new_revision()
+        model.Package.by_name(name).private = private
+        model.repo.commit_and_remove()
+
     def test_member_delete(self):
         self._add_member(self.username, 'user', 'admin')
         ctx, dd = self._build_context(self.username, 'user', 'admin')
@@ -0,0 +1,128 @@
+'''
+Compare the time taken to guess the types of the fields of a datastore_create
+request with the column by column guessing of a sample of the records (the
+method used by datastore_create) and with the previous guessing of each
+value with int(), float() and strptime().
+
+The records are read from a CSV file, so all the values are strings, or
+generated with the given number of columns, e.g.:
+
+    python benchmark_guess_types.py -c 250 -n 10000
+    python benchmark_guess_types.py --csv data.csv
+'''
+import os
+import csv
+import time
+import random
+import datetime
+
+os.environ.setdefault('DATASTORE_LOAD', 'true')
+
+import ckanext.datastore.db as db
+
+WORDS = ['river', 'station', 'school', 'hospital', 'road', 'park', 'library']
+
+
+def guess_type(field):
+    '''The previous implementation of the type guessing of a value'''
+    data_types = set([int, float])
+    if isinstance(field, (dict, list)):
+        return 'nested'
+    if isinstance(field, int):
+        return 'int'
+    if isinstance(field, float):
+        return 'float'
+    for data_type in list(data_types):
+        try:
+            data_type(field)
+        except (TypeError, ValueError):
+            data_types.discard(data_type)
+            if not data_types:
+                break
+    if int in data_types:
+        return 'integer'
+    elif float in data_types:
+        return 'numeric'
+
+    ##try iso dates
+    for format in db._date_formats:
+        try:
+            datetime.datetime.strptime(field, format)
+            return 'timestamp'
+        except (ValueError, TypeError):
+            continue
+    return 'text'
+
+
+def generated_records(columns, number):
+    start = datetime.datetime(2000, 1, 1)
+    makers = [
+        lambda i: str(i),
+        lambda i: '%.2f' % (random.random() * 1000),
+        lambda i: (start + datetime.timedelta(hours=i)).strftime('%Y-%m-%d'),
+        lambda i: ' '.join(random.sample(WORDS, 2)),
+    ]
+    field_makers = [('field%i' % num, makers[num % len(makers)])
+                    for num in range(columns)]
+    return [dict((name, maker(i)) for name, maker in field_makers)
+            for i in xrange(number)]
+
+
+def csv_records(path):
+    with open(path, 'rb') as f:
+        return [dict((key.decode('utf-8'), value.decode('utf-8'))
+                     for key, value in row.iteritems())
+                for row in csv.DictReader(f)]
+
+
+def guess_each_value(records, field_ids):
+    '''Guess the type of every value of the sample with guess_type'''
+    for record in records:
+        for field_id in field_ids:
+            guess_type(record[field_id])
+
+
+def guess_first_record(records, field_ids):
+    for field_id in field_ids:
+        guess_type(records[0][field_id])
+
+
+def guess_columns(records, field_ids):
+    db._guess_types(records, field_ids)
+
+
+if __name__ == '__main__':
+    import argparse
+    argparser = argparse.ArgumentParser(
+        description='Benchmark guessing the types of datastore fields.')
+    argparser.add_argument('--csv', dest='csv', type=str,
+                           help='CSV file to read the records from')
+    argparser.add_argument('-c', '--columns', dest='columns', type=int,
+                           default=250, help='number of columns generated')
+    argparser.add_argument('-n', '--number', dest='number', type=int,
+                           default=10000, help='number of records generated')
+    argparser.add_argument('-s', '--sample', dest='sample', type=int,
+                           default=db._TYPE_GUESS_SAMPLE_SIZE,
+                           help='number of records sampled (0 for all)')
+    args = argparser.parse_args()
+
+    if args.csv:
+        records = csv_records(args.csv)
+    else:
+        records = generated_records(args.columns, args.number)
+    sample = records[:args.sample] if args.sample else records
+    field_ids = records[0].keys()
+    print '{0} records, {1} columns, {2} sampled'.format(
+        len(records), len(field_ids), len(sample))
+
+    print '{0:<28} {1:>10} {2:>14}'.format('method', 'time (s)', 'values/s')
+    for name, method, rows in [
+            ('first record, per value', guess_first_record, sample[:1]),
+            ('sample, per value', guess_each_value, sample),
+            ('sample, column by column', guess_columns, sample)]:
+        start = time.time()
+        method(rows, field_ids)
+        elapsed = time.time() - start
+        values = len(rows) * len(field_ids)
+        print '{0:<28} {1:>10.3f} {2:>14.0f}'.format(
+            name, elapsed, values / max(elapsed, 1e-6))
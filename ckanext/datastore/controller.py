@@ -0,0 +1,110 @@
+import csv
+import json
+import itertools
+import StringIO
+
+import ckan.logic as logic
+import ckan.lib.base as base
+
+# Size of the chunks of the dump sent to the client
+CHUNK_SIZE = 64 * 1024
+
+# content type and file extension of each dump format
+DUMP_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'tsv': ('text/tab-separated-values; charset=utf-8', 'tsv'),
+    'jsonl': ('application/x-ndjson; charset=utf-8', 'jsonl'),
+}
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def _chunks(lines):
+    '''Join the lines in chunks of about CHUNK_SIZE bytes.'''
+    buffer = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def dump_csv(fields, records, delimiter=','):
+    output = StringIO.StringIO()
+    writer = csv.writer(output, delimiter=delimiter)
+
+    def lines():
+        header = [field['id'].encode('utf-8') for field in fields]
+        for row in itertools.chain([header], records):
+            writer.writerow([_csv_value(value) for value in row])
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+    return _chunks(lines())
+
+
+def dump_jsonl(fields, records):
+    keys = [json.dumps(field['id']) + ': ' for field in fields]
+
+    def lines():
+        for values in records:
+            yield '{' + ', '.join([key + json.dumps(value)
+                for key, value in zip(keys, values)]) + '}\n'
+    return _chunks(lines())
+
+
+class DatastoreController(base.BaseController):
+    def dump(self, resource_id):
+        '''Download the records of a resource as a CSV, TSV or JSON lines
+        file, which is written while the records are read from the
+        database.'''
+        params = dict(base.request.params)
+        format = params.pop('format', 'csv')
+        if format not in DUMP_FORMATS:
+            base.abort(400, 'Unsupported format: {0}'.format(format))
+
+        context = {'model': base.model, 'session': base.model.Session,
+                   'user': base.c.user or base.c.author,
+                   'lazy_records': True}
+        data_dict = dict(params, resource_id=resource_id)
+        try:
+            result = logic.get_action('datastore_dump')(context, data_dict)
+        except logic.NotFound, e:
+            base.abort(404, str(e))
+        except logic.NotAuthorized, e:
+            base.abort(403, str(e))
+        except logic.ValidationError, e:
+            base.abort(409, json.dumps(e.error_dict))
+
+        content_type, extension = DUMP_FORMATS[format]
+        base.response.headers['Content-Type'] = content_type
+        base.response.headers['Content-Disposition'] = (
+            'attachment; filename="{0}.{1}"'.format(resource_id, extension))
+
+        records = result['records']
+        if format == 'jsonl':
+            chunks = dump_jsonl(result['fields'], records)
+        else:
+            chunks = dump_csv(result['fields'], records,
+                              '\t' if format == 'tsv' else ',')
+
+        def dump():
+            try:
+                for chunk in chunks:
+                    yield chunk
+            finally:
+                records.close()
+        return dump()
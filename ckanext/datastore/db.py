@@ -1,4 +1,6 @@
+import re
 import json
+import base64
 import datetime
 import shlex
 import os
@@ -10,15 +12,18 @@ import string
 import distutils.version
 import logging
 import pprint
+import StringIO
 import sqlalchemy
 from sqlalchemy.exc import ProgrammingError, IntegrityError, DBAPIError
 import psycopg2.extras
+import psycopg2.extensions
 
 log = logging.getLogger(__name__)
 
 if not os.environ.get('DATASTORE_LOAD'):
     import paste.deploy.converters as converters
     import ckan.plugins.toolkit as toolkit
+    import ckan.lib.jsonstream as jsonstream
     ValidationError = toolkit.ValidationError
 else:
     log.warn("Running datastore without CKAN")
@@ -30,6 +35,18 @@ else:
 _pg_types = {}
 _type_names = set()
 _engines = {}
+# Version of the PostgreSQL server, by database URL
+_pg_versions = {}
+
+# Metadata (fields, unique key, whether it is a table or a view) of the
+# datastore tables, by table name. Each entry keeps the version of the
+# table in _METADATA_VERSION_TABLE it was cached at, which is bumped
+# whenever the table is changed.
+_table_metadata_cache = {}
+_METADATA_VERSION_TABLE = '_table_metadata_version'
+_metadata_version_table_exists = None
+# version of tables whose metadata must not be cached
+_UNCACHED = object()
 
 # See http://www.postgresql.org/docs/9.2/static/errcodes-appendix.html
 _PG_ERR_CODE = {
@@ -49,6 +66,28 @@ _date_formats = ['%Y-%m-%d',
                  '%m-%d-%Y',
                  ]
 
+# Number of records sent to the database at once when inserting with COPY
+_COPY_CHUNK_SIZE = 10000
+# Number of rows fetched at once from the database when streaming results
+_STREAM_BATCH_SIZE = 1000
+
+# Maximum number of records returned by search_sql, unless given in the
+# context
+_SEARCH_SQL_MAX_ROWS = 32000
+# Statements which can be run with a server side cursor
+_select_re = re.compile(r'\s*(SELECT|WITH|VALUES|TABLE)\b', re.IGNORECASE)
+
+# Number of records the types of the fields are guessed from, unless given
+# in the context (0 for all of them)
+_TYPE_GUESS_SAMPLE_SIZE = 1000
+# Fast paths to guess the types of strings
+_integer_re = re.compile(r'\s*[+-]?\d+\s*$')
+_numeric_re = re.compile(r'\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?\s*$')
+_date_re = re.compile(r'\d{1,4}[-/]\d{1,2}[-/]\d{1,4}([ T]\d{1,2}:\d{2}:\d{2}Z?)?$')
+_INT4_MAX = 2 ** 31 - 1
+_INT8_MAX = 2 ** 63 - 1
+_NUMBER_KINDS = set(['int', 'float', 'integer', 'bigint', 'numeric'])
+
 _INSERT = 'insert'
 _UPSERT = 'upsert'
 _UPDATE = 'update'
@@ -148,12 +187,20 @@ def _cache_types(context):
         psycopg2.extras.register_composite('nested', connection.connection, True)
 
 
+def _pg_version(connection):
+    '''Return the version number of the PostgreSQL server, which is only
+    queried once per database.'''
+    url = str(connection.engine.url)
+    if url not in _pg_versions:
+        pg_version = connection.execute('select version();').fetchone()
+        _pg_versions[url] = pg_version[0].split()[1]
+    return _pg_versions[url]
+
+
 def _pg_version_is_at_least(connection, version):
     try:
         v = distutils.version.LooseVersion(version)
-        pg_version = connection.execute('select version();').fetchone()
-        pg_version_number = pg_version[0].split()[1]
-        pv = distutils.version.LooseVersion(pg_version_number)
+        pv = distutils.version.LooseVersion(_pg_version(connection))
         return v <= pv
     except ValueError:
         return False
@@ -198,50 +245,227 @@ def _rename_field(data_dict, term, replace):
     return data_dict
 
 
-def _guess_type(field):
-    '''Simple guess type of field, only allowed are
-    integer, numeric and text'''
-    data_types = set([int, float])
-    if isinstance(field, (dict, list)):
+def _value_kind(value, date_formats):
+    '''Return the narrowest type a single (not null) value can be stored as.
+    Strings are matched against regular expressions before trying to parse
+    them, so most values are never converted.
+
+    date_formats is the list of _date_formats to try, and the format a date
+    is parsed with is moved to the front of it, as the values of a column
+    usually share the same format.'''
+    if isinstance(value, (dict, list)):
         return 'nested'
-    if isinstance(field, int):
-        return 'int'
-    if isinstance(field, float):
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, (int, long)):
+        if -_INT4_MAX <= value <= _INT4_MAX:
+            return 'int'
+        return _integer_type(value)
+    if isinstance(value, float):
         return 'float'
-    for data_type in list(data_types):
-        try:
-            data_type(field)
-        except (TypeError, ValueError):
-            data_types.discard(data_type)
-            if not data_types:
-                break
-    if int in data_types:
+    if not isinstance(value, basestring):
+        return 'text'
+    if _integer_re.match(value):
+        return _integer_type(int(value))
+    if _numeric_re.match(value):
+        return 'numeric'
+    if _date_re.match(value):
+        for num, format in enumerate(date_formats):
+            try:
+                datetime.datetime.strptime(value, format)
+            except ValueError:
+                continue
+            if num:
+                date_formats.insert(0, date_formats.pop(num))
+            return 'timestamp'
+    return 'text'
+
+
+def _integer_type(value):
+    if -_INT4_MAX <= value <= _INT4_MAX:
         return 'integer'
-    elif float in data_types:
+    if -_INT8_MAX <= value <= _INT8_MAX:
+        return 'bigint'
+    return 'numeric'
+
+
+def _narrowest_type(kinds):
+    '''Return the narrowest type that can store values of all the kinds.'''
+    if 'nested' in kinds:
+        return 'nested'
+    if len(kinds) == 1:
+        return iter(kinds).next()
+    if kinds <= set(['int', 'integer']):
+        return 'integer'
+    if kinds <= set(['int', 'integer', 'bigint']):
+        return 'bigint'
+    if kinds <= set(['int', 'float']):
+        return 'float'
+    if kinds <= _NUMBER_KINDS:
         return 'numeric'
+    return 'text'
 
-    ##try iso dates
-    for format in _date_formats:
-        try:
-            datetime.datetime.strptime(field, format)
-            return 'timestamp'
-        except (ValueError, TypeError):
+
+def _guess_types(records, field_ids):
+    '''Guess the type of each field from all its values in the records,
+    column by column.
+
+    Returns a dict with the narrowest type consistent with all the values of
+    each field ('text' if they are all null), or None for the fields which
+    are not in any record.'''
+    types = {}
+    for field_id in field_ids:
+        kinds = set()
+        seen = False
+        date_formats = list(_date_formats)
+        for record in records:
+            if field_id not in record:
+                continue
+            seen = True
+            value = record[field_id]
+            if value is None:
+                continue
+            if 'text' in kinds:
+                # only a nested value can widen the type further
+                if isinstance(value, (dict, list)):
+                    kinds.add('nested')
+                    break
+                continue
+            kinds.add(_value_kind(value, date_formats))
+            if 'nested' in kinds:
+                break
+        if kinds:
+            types[field_id] = _narrowest_type(kinds)
+        else:
+            types[field_id] = 'text' if seen else None
+    return types
+
+
+def _guess_fields(context, records, supplied_fields, field_ids):
+    '''Set the type of the supplied fields without one, and return the
+    fields in the records which are not in field_ids, guessing their types
+    from (a sample of) the records.'''
+    if records and not isinstance(records[0], dict):
+        raise ValidationError({
+            'records': ['The first row is not a json object']
+        })
+    sample_size = context.get('type_guess_sample_size',
+                              _TYPE_GUESS_SAMPLE_SIZE)
+    sample = [record for record in
+              (records[:sample_size] if sample_size else records or [])
+              if isinstance(record, dict)]
+
+    extra_ids = []
+    known_ids = set(field_ids)
+    for record in sample:
+        for field_id in record:
+            if field_id not in known_ids:
+                known_ids.add(field_id)
+                extra_ids.append(field_id)
+
+    untyped = [field for field in supplied_fields if 'type' not in field]
+    types = _guess_types(sample, _pluck('id', untyped) + extra_ids)
+
+    # if type is field is not given try and guess or throw an error
+    for field in untyped:
+        if types[field['id']] is None:
+            raise ValidationError({
+                'fields': ['"{0}" type not guessable'.format(field['id'])]
+            })
+        field['type'] = types[field['id']]
+
+    return [{'id': field_id, 'type': types[field_id]}
+            for field_id in extra_ids]
+
+
+def _has_metadata_version_table(connection):
+    global _metadata_version_table_exists
+    if _metadata_version_table_exists is None:
+        _metadata_version_table_exists = bool(connection.execute(
+            u'SELECT 1 FROM pg_tables WHERE tablename = %s',
+            _METADATA_VERSION_TABLE).fetchone())
+    return _metadata_version_table_exists
+
+
+def _clear_table_metadata_cache():
+    global _metadata_version_table_exists
+    _table_metadata_cache.clear()
+    _metadata_version_table_exists = None
+
+
+def _metadata_version(context, name):
+    '''Return the version of the metadata of a table, from the
+    _table_metadata_version table (None if it has never changed).'''
+    connection = context['connection']
+    if not _has_metadata_version_table(connection):
+        return _UNCACHED
+    return connection.execute(
+        u'SELECT version FROM "{0}" WHERE name = %s'.format(
+            _METADATA_VERSION_TABLE), name).scalar()
+
+
+def _table_metadata(context, name):
+    '''Return the cached metadata of a table or view.
+
+    The cache is dropped when the version of the table changed since it was
+    cached. The version is looked up once per action.'''
+    versions = context.setdefault('table_metadata_versions', {})
+    if name not in versions:
+        versions[name] = _metadata_version(context, name)
+    version = versions[name]
+    if version is _UNCACHED:
+        return {}
+    metadata = _table_metadata_cache.get(name)
+    if metadata is None or metadata['version'] != version:
+        metadata = _table_metadata_cache[name] = {'version': version}
+    return metadata
+
+
+def _invalidate_table_metadata(context, names):
+    '''Drop the cached metadata of the given tables or views, in this and
+    (once the transaction is committed) in other processes.'''
+    versions = context.setdefault('table_metadata_versions', {})
+    for name in names:
+        _table_metadata_cache.pop(name, None)
+        # do not cache anything until the transaction is committed
+        versions[name] = _UNCACHED
+        if not _has_metadata_version_table(context['connection']):
             continue
-    return 'text'
+        context['connection'].execute(u'''
+            UPDATE "{table}" SET version = version + 1 WHERE name = %s;
+            INSERT INTO "{table}" (name, version) SELECT %s, 1
+            WHERE NOT EXISTS (SELECT 1 FROM "{table}" WHERE name = %s)
+            '''.format(table=_METADATA_VERSION_TABLE), name, name, name)
+
+
+def _get_table_kind(context, name):
+    '''Return "table" or "view" depending on what name is, or None if it
+    does not exist.'''
+    metadata = _table_metadata(context, name)
+    if 'kind' not in metadata:
+        result = context['connection'].execute(
+            u'''(SELECT 'table' FROM pg_tables WHERE tablename = %s) UNION
+                (SELECT 'view' FROM pg_views WHERE viewname = %s)''',
+            name, name).fetchone()
+        metadata['kind'] = result[0] if result else None
+    return metadata['kind']
 
 
 def _get_fields(context, data_dict):
-    fields = []
-    all_fields = context['connection'].execute(
-        u'SELECT * FROM "{0}" LIMIT 1'.format(data_dict['resource_id'])
-    )
-    for field in all_fields.cursor.description:
-        if not field[0].startswith('_'):
-            fields.append({
-                'id': field[0].decode('utf-8'),
-                'type': _get_type(context, field[1])
-            })
-    return fields
+    metadata = _table_metadata(context, data_dict['resource_id'])
+    if 'fields' not in metadata:
+        fields = []
+        all_fields = context['connection'].execute(
+            u'SELECT * FROM "{0}" LIMIT 1'.format(data_dict['resource_id'])
+        )
+        for field in all_fields.cursor.description:
+            if not field[0].startswith('_'):
+                fields.append({
+                    'id': field[0].decode('utf-8'),
+                    'type': _get_type(context, field[1])
+                })
+        metadata['fields'] = fields
+    return [dict(field) for field in metadata['fields']]
 
 
 def json_get_values(obj, current_list=None):
@@ -271,15 +495,7 @@ def check_fields(context, fields):
             })
 
 
-def convert(data, type_name):
-    if data is None:
-        return None
-    if type_name == 'nested':
-        return json.loads(data[0])
-    # array type
-    if type_name.startswith('_'):
-        sub_type = type_name[1:]
-        return [convert(item, sub_type) for item in data]
+def _convert_default(data):
     if isinstance(data, datetime.datetime):
         return data.isoformat()
     if isinstance(data, (int, float)):
@@ -287,43 +503,68 @@ def convert(data, type_name):
     return unicode(data)
 
 
+def _convert_identity(data):
+    return data
+
+
+def _convert_nested(data):
+    return json.loads(data[0])
+
+
+def _convert_timestamp(data):
+    return data.isoformat()
+
+
+# Converters of the (not null) values of the types whose values always have
+# the same Python type, any other type uses _convert_default
+_converters = {
+    'nested': _convert_nested,
+    'text': unicode,
+    'varchar': unicode,
+    'numeric': unicode,
+    'date': unicode,
+    'int2': _convert_identity,
+    'int4': _convert_identity,
+    'float4': _convert_identity,
+    'float8': _convert_identity,
+    'bool': _convert_identity,
+    'timestamp': _convert_timestamp,
+}
+
+
+def _get_converter(type_name):
+    '''Return the function converting the (not null) values of a type.'''
+    converter = _converters.get(type_name)
+    if converter:
+        return converter
+    # array type
+    if type_name.startswith('_'):
+        sub_converter = _get_converter(type_name[1:])
+        return lambda data: [None if item is None else sub_converter(item)
+                             for item in data]
+    return _convert_default
+
+
+def convert(data, type_name):
+    if data is None:
+        return None
+    return _get_converter(type_name)(data)
+
+
 def create_table(context, data_dict):
-    '''Create table from combination of fields and first row of data.'''
+    '''Create table from combination of fields and a sample of the data.'''
 
     datastore_fields = [
         {'id': '_id', 'type': 'serial primary key'},
         {'id': '_full_text', 'type': 'tsvector'},
     ]
 
-    # check first row of data for additional fields
-    extra_fields = []
+    # check the records for additional fields
     supplied_fields = data_dict.get('fields', [])
     check_fields(context, supplied_fields)
     field_ids = _pluck('id', supplied_fields)
     records = data_dict.get('records')
-
-    # if type is field is not given try and guess or throw an error
-    for field in supplied_fields:
-        if 'type' not in field:
-            if not records or field['id'] not in records[0]:
-                raise ValidationError({
-                    'fields': ['"{0}" type not guessable'.format(field['id'])]
-                })
-            field['type'] = _guess_type(records[0][field['id']])
-
-    if records:
-        # check record for sanity
-        if not isinstance(records[0], dict):
-            raise ValidationError({
-                'records': ['The first row is not a json object']
-            })
-        supplied_field_ids = records[0].keys()
-        for field_id in supplied_field_ids:
-            if not field_id in field_ids:
-                extra_fields.append({
-                    'id': field_id,
-                    'type': _guess_type(records[0][field_id])
-                })
+    extra_fields = _guess_fields(context, records, supplied_fields, field_ids)
 
     fields = datastore_fields + supplied_fields + extra_fields
     sql_fields = u", ".join([u'"{0}" {1}'.format(f['id'].replace('%', '%%'), f['type'])
@@ -335,6 +576,7 @@ def create_table(context, data_dict):
     )
 
     context['connection'].execute(sql_string)
+    _invalidate_table_metadata(context, [data_dict['resource_id']])
 
 
 def _get_aliases(context, data_dict):
@@ -361,6 +603,7 @@ def create_alias(context, data_dict):
     if aliases != None:
         # delete previous aliases
         previous_aliases = _get_aliases(context, data_dict)
+        _invalidate_table_metadata(context, previous_aliases + aliases)
         for alias in previous_aliases:
             sql_alias_drop_string = u'DROP VIEW "{0}"'.format(alias)
             context['connection'].execute(sql_alias_drop_string)
@@ -391,6 +634,8 @@ def create_indexes(context, data_dict):
     if indexes is None and primary_key is None:
         return
 
+    _invalidate_table_metadata(context, [data_dict['resource_id']])
+
     sql_index_skeletton = u'CREATE {unique} INDEX {name} ON "{res_id}"'
     sql_index_string_method = sql_index_skeletton + u' USING {method}({fields})'
     sql_index_string = sql_index_skeletton + u' ({fields})'
@@ -474,7 +719,7 @@ def _drop_indexes(context, data_dict, unique=False):
 
 
 def alter_table(context, data_dict):
-    '''alter table from combination of fields and first row of data
+    '''alter table from combination of fields and a sample of the data
     return: all fields of the resource table'''
     supplied_fields = data_dict.get('fields', [])
     current_fields = _get_fields(context, data_dict)
@@ -496,28 +741,9 @@ def alter_table(context, data_dict):
                 })
             ## no need to check type as field already defined.
             continue
-
-        if 'type' not in field:
-            if not records or field['id'] not in records[0]:
-                raise ValidationError({
-                    'fields': ['"{0}" type not guessable'.format(field['id'])]
-                })
-            field['type'] = _guess_type(records[0][field['id']])
         new_fields.append(field)
 
-    if records:
-        # check record for sanity
-        if not isinstance(records[0], dict):
-            raise ValidationError({
-                'records': ['The first row is not a json object']
-            })
-        supplied_field_ids = records[0].keys()
-        for field_id in supplied_field_ids:
-            if not field_id in field_ids:
-                new_fields.append({
-                    'id': field_id,
-                    'type': _guess_type(records[0][field_id])
-                })
+    new_fields.extend(_guess_fields(context, records, new_fields, field_ids))
 
     for field in new_fields:
         sql = 'ALTER TABLE "{0}" ADD "{1}" {2}'.format(
@@ -525,6 +751,8 @@ def alter_table(context, data_dict):
             field['id'].replace('%', '%%'),
             field['type'])
         context['connection'].execute(sql)
+    if new_fields:
+        _invalidate_table_metadata(context, [data_dict['resource_id']])
 
 
 def insert_data(context, data_dict):
@@ -533,7 +761,10 @@ def insert_data(context, data_dict):
 
 
 def upsert_data(context, data_dict):
-    '''insert all data from records'''
+    '''insert all data from records
+
+    When inserting, records can be any iterable of dicts (e.g. a generator
+    reading a file), as they are sent to the database in chunks.'''
     if not data_dict.get('records'):
         return
 
@@ -547,31 +778,9 @@ def upsert_data(context, data_dict):
     fields = _get_fields(context, data_dict)
     field_names = _pluck('id', fields)
     records = data_dict['records']
-    sql_columns = ", ".join(['"%s"' % name.replace('%', '%%') for name in field_names]
-                            + ['"_full_text"'])
 
     if method == _INSERT:
-        rows = []
-        for num, record in enumerate(records):
-            _validate_record(record, num, field_names)
-
-            row = []
-            for field in fields:
-                value = record.get(field['id'])
-                if value and field['type'].lower() == 'nested':
-                    ## a tuple with an empty second value
-                    value = (json.dumps(value), '')
-                row.append(value)
-            row.append(_to_full_text(fields, record))
-            rows.append(row)
-
-        sql_string = u'INSERT INTO "{res_id}" ({columns}) VALUES ({values}, to_tsvector(%s));'.format(
-            res_id=data_dict['resource_id'],
-            columns=sql_columns,
-            values=', '.join(['%s' for field in field_names])
-        )
-
-        context['connection'].execute(sql_string, rows)
+        _copy_records(context, data_dict, fields, records)
 
     elif method in [_UPDATE, _UPSERT]:
         unique_keys = _get_unique_key(context, data_dict)
@@ -580,6 +789,10 @@ def upsert_data(context, data_dict):
                 'table': [u'table does not have a unique key defined']
             })
 
+        # records are applied in runs of consecutive records with the same
+        # fields, each run with a few set based statements
+        run = []
+        run_fields = None
         for num, record in enumerate(records):
             # all key columns have to be defined
             missing_fields = [field for field in unique_keys
@@ -590,73 +803,217 @@ def upsert_data(context, data_dict):
                         ', '.join(missing_fields))]
                 })
 
-            for field in fields:
-                value = record.get(field['id'])
-                if value and field['type'].lower() == 'nested':
-                    ## a tuple with an empty second value
-                    record[field['id']] = (json.dumps(value), '')
-
-            non_existing_filed_names = [field for field in record.keys()
+            non_existing_field_names = [field for field in record.keys()
                 if field not in field_names]
-            if non_existing_filed_names:
+            if non_existing_field_names:
                 raise ValidationError({
                     'fields': [u'fields "{0}" do not exist'.format(
-                        ', '.join(missing_fields))]
+                        ', '.join(non_existing_field_names))]
                 })
 
-            unique_values = [record[key] for key in unique_keys]
-
             used_fields = [field for field in fields
-                                    if field['id'] in record.keys()]
+                                    if field['id'] in record]
+            if used_fields != run_fields:
+                if run:
+                    _merge_records(context, data_dict, run_fields, run,
+                                   unique_keys, method)
+                run = []
+                run_fields = used_fields
+            run.append(record)
+
+        if run:
+            _merge_records(context, data_dict, run_fields, run,
+                           unique_keys, method)
+
+def _copy_escape(value):
+    '''Escape a value for the text format of COPY.'''
+    return (value.replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def _array_literal(values):
+    items = []
+    for item in values:
+        if item is None:
+            items.append(u'NULL')
+        elif isinstance(item, (list, tuple)):
+            items.append(_array_literal(item))
+        else:
+            if isinstance(item, bool):
+                item = u'true' if item else u'false'
+            elif isinstance(item, float):
+                item = repr(item)
+            items.append(u'"{0}"'.format(unicode(item).replace('\\', '\\\\')
+                                                     .replace('"', '\\"')))
+    return u'{' + u','.join(items) + u'}'
+
+
+def _copy_value(value, type_name):
+    '''Format a record value as a field of the text format of COPY.'''
+    if value is None:
+        return u'\\N'
+    if type_name == 'nested':
+        # composite literal with an empty second value
+        value = u'("{0}","")'.format(
+            json.dumps(value).replace('\\', '\\\\').replace('"', '""'))
+    elif isinstance(value, (list, tuple)):
+        value = _array_literal(value)
+    elif isinstance(value, bool):
+        value = u'true' if value else u'false'
+    elif isinstance(value, float):
+        value = repr(value)
+    elif isinstance(value, (datetime.datetime, datetime.date)):
+        value = value.isoformat()
+    elif not isinstance(value, basestring):
+        value = unicode(value)
+    return _copy_escape(value)
+
+
+def _copy_to_temp_table(context, data_dict, fields, records):
+    '''Copy records to the "_copy_records" temporary table with COPY.
+
+    The table has the given fields of the resource table, the position of
+    each record in "_row" and the text to index in "_full_text_source". The
+    records are sent in chunks of _COPY_CHUNK_SIZE rows.'''
+    connection = context['connection']
+    field_names = _pluck('id', fields)
+    type_names = [field['type'].lower() for field in fields]
+
+    connection.execute(u'''
+        CREATE TEMP TABLE "_copy_records" ON COMMIT DROP AS
+        SELECT {columns}, NULL::integer AS "_row",
+               NULL::text AS "_full_text_source"
+        FROM "{res_id}" LIMIT 0'''.format(
+            columns=_sql_columns(field_names),
+            res_id=data_dict['resource_id']))
+
+    cursor = connection.connection.cursor()
+    encoding = psycopg2.extensions.encodings[cursor.connection.encoding]
+    copy_sql = u'COPY "_copy_records" ({columns}, "_row", "_full_text_source") FROM STDIN'.format(
+        columns=u', '.join([u'"{0}"'.format(name) for name in field_names]))
+
+    def copy(lines):
+        data = StringIO.StringIO(u''.join(lines).encode(encoding))
+        try:
+            cursor.copy_expert(copy_sql, data)
+        except psycopg2.DataError, e:
+            raise ValidationError({
+                'records': [str(e).decode(encoding).strip()]
+            })
 
-            used_field_names = _pluck('id', used_fields)
+    lines = []
+    for num, record in enumerate(records):
+        row = [_copy_value(record.get(name), type_name)
+               for name, type_name in zip(field_names, type_names)]
+        row.append(unicode(num))
+        row.append(_copy_escape(_to_full_text(fields, record)))
+        lines.append(u'\t'.join(row) + u'\n')
+        if len(lines) >= _COPY_CHUNK_SIZE:
+            copy(lines)
+            lines = []
+    if lines:
+        copy(lines)
+    cursor.close()
 
-            used_values = [record[field] for field in used_field_names]
 
-            full_text = _to_full_text(fields, record)
+def _sql_columns(field_names, prefix=u''):
+    return u', '.join([u'{0}"{1}"'.format(prefix, name.replace('%', '%%'))
+                       for name in field_names])
+
+
+def _copy_records(context, data_dict, fields, records):
+    '''Insert records with COPY.
+
+    The records are copied to a temporary table and then moved to the
+    resource table with a single statement that computes the full text
+    index.'''
+    field_names = _pluck('id', fields)
+
+    def validated_records():
+        for num, record in enumerate(records):
+            _validate_record(record, num, field_names)
+            yield record
+
+    _copy_to_temp_table(context, data_dict, fields, validated_records())
+
+    columns = _sql_columns(field_names)
+    context['connection'].execute(u'''
+        INSERT INTO "{res_id}" ({columns}, "_full_text")
+        SELECT {columns}, to_tsvector("_full_text_source")
+        FROM "_copy_records" ORDER BY "_row";
+        DROP TABLE "_copy_records"'''.format(
+            columns=columns, res_id=data_dict['resource_id']))
 
-            if method == _UPDATE:
-                sql_string = u'''
-                    UPDATE "{res_id}"
-                    SET ({columns}, "_full_text") = ({values}, to_tsvector(%s))
-                    WHERE ({primary_key}) = ({primary_value});
-                '''.format(
-                    res_id=data_dict['resource_id'],
-                    columns=u', '.join([u'"{0}"'.format(field) for field in used_field_names]),
-                    values=u', '.join(['%s' for _ in used_field_names]),
-                    primary_key=u','.join([u'"{0}"'.format(part) for part in unique_keys]),
-                    primary_value=u','.join(["%s"] * len(unique_keys))
-                )
-                results = context['connection'].execute(
-                        sql_string, used_values + [full_text] + unique_values)
-
-                # validate that exactly one row has been updated
-                if results.rowcount != 1:
-                    raise ValidationError({
-                        'key': [u'key "{0}" not found'.format(unique_values)]
-                    })
-
-            elif method == _UPSERT:
-                sql_string = u'''
-                    UPDATE "{res_id}"
-                    SET ({columns}, "_full_text") = ({values}, to_tsvector(%s))
-                    WHERE ({primary_key}) = ({primary_value});
-                    INSERT INTO "{res_id}" ({columns}, "_full_text")
-                           SELECT {values}, to_tsvector(%s)
-                           WHERE NOT EXISTS (SELECT 1 FROM "{res_id}"
-                                    WHERE ({primary_key}) = ({primary_value}));
-                '''.format(
-                    res_id=data_dict['resource_id'],
-                    columns=u', '.join([u'"{0}"'.format(field) for field in used_field_names]),
-                    values=u', '.join(['%s::nested' if field['type'] == 'nested' else '%s' for field in used_fields]),
-                    primary_key=u','.join([u'"{0}"'.format(part) for part in unique_keys]),
-                    primary_value=u','.join(["%s"] * len(unique_keys))
-                )
-                context['connection'].execute(
-                        sql_string, (used_values + [full_text] + unique_values) * 2)
+
+def _merge_records(context, data_dict, fields, records, unique_keys, method):
+    '''Update (and for upserts insert) records sharing the same fields.
+
+    The records are copied to a temporary table and applied to the resource
+    table with set based statements. If a key appears more than once the
+    last record wins, as if the records had been applied one by one.'''
+    connection = context['connection']
+    res_id = data_dict['resource_id']
+    field_names = _pluck('id', fields)
+
+    _copy_to_temp_table(context, data_dict, fields, records)
+
+    key_columns = _sql_columns(unique_keys)
+    match = u'({0}) = ({1})'.format(_sql_columns(unique_keys, u't.'),
+                                    _sql_columns(unique_keys, u's.'))
+    connection.execute(u'''
+        DELETE FROM "_copy_records" s USING "_copy_records" t
+        WHERE {match} AND s."_row" < t."_row"'''.format(match=match))
+
+    if method == _UPDATE:
+        missing = connection.execute(u'''
+            SELECT s."_row" FROM "_copy_records" s
+            WHERE NOT EXISTS (SELECT 1 FROM "{res_id}" t WHERE {match})
+            ORDER BY s."_row" LIMIT 1'''.format(
+                res_id=res_id, match=match)).fetchone()
+        if missing:
+            record = records[missing[0]]
+            raise ValidationError({
+                'key': [u'key "{0}" not found'.format(
+                    [record[key] for key in unique_keys])]
+            })
+
+    columns = _sql_columns(field_names)
+    values = _sql_columns(field_names, u's.')
+    update_sql = u'''
+        UPDATE "{res_id}" t
+        SET ({columns}, "_full_text") =
+            ({values}, to_tsvector(s."_full_text_source"))
+        FROM "_copy_records" s
+        WHERE {match};'''
+    insert_sql = u'''
+        INSERT INTO "{res_id}" ({columns}, "_full_text")
+        SELECT {values}, to_tsvector(s."_full_text_source")
+        FROM "_copy_records" s'''
+
+    if method == _UPDATE:
+        sql_string = update_sql
+    elif _pg_version_is_at_least(connection, '9.5'):
+        sql_string = insert_sql + u'''
+        ORDER BY s."_row"
+        ON CONFLICT ({key_columns}) DO UPDATE
+        SET ({columns}, "_full_text") =
+            ({excluded}, EXCLUDED."_full_text");'''
+    else:
+        sql_string = update_sql + insert_sql + u'''
+        WHERE NOT EXISTS (SELECT 1 FROM "{res_id}" t WHERE {match})
+        ORDER BY s."_row";'''
+
+    connection.execute((sql_string + u'''
+        DROP TABLE "_copy_records"''').format(
+            res_id=res_id, columns=columns, values=values, match=match,
+            key_columns=key_columns,
+            excluded=_sql_columns(field_names, u'EXCLUDED.')))
 
 
 def _get_unique_key(context, data_dict):
+    metadata = _table_metadata(context, data_dict['resource_id'])
+    if 'unique_key' in metadata:
+        return list(metadata['unique_key'])
     sql_get_unique_key = '''
     SELECT
         a.attname AS column_names
@@ -674,7 +1031,8 @@ def _get_unique_key(context, data_dict):
         AND t.relname = %s
     '''
     key_parts = context['connection'].execute(sql_get_unique_key, data_dict['resource_id'])
-    return [x[0] for x in key_parts]
+    metadata['unique_key'] = [x[0] for x in key_parts]
+    return list(metadata['unique_key'])
 
 
 def _validate_record(record, num, field_names):
@@ -750,13 +1108,11 @@ def _textsearch_query(data_dict):
     return '', ''
 
 
-def _sort(context, data_dict, field_ids):
+def _parse_sort(data_dict, field_ids):
+    '''Return the sort clauses as a list of (field, direction) pairs.'''
     sort = data_dict.get('sort')
     if not sort:
-        if data_dict.get('q'):
-            return u'ORDER BY rank'
-        else:
-            return u''
+        return []
 
     clauses = _get_list(sort, False)
 
@@ -777,29 +1133,110 @@ def _sort(context, data_dict, field_ids):
 
         if field not in field_ids:
             raise ValidationError({
-                'sort': [u'field "{0}" not it table'.format(
-                    unicode(field, 'utf-8'))]
+                'sort': [u'field "{0}" not it table'.format(field)]
             })
         if sort.lower() not in ('asc', 'desc'):
             raise ValidationError({
                 'sort': ['sorting can only be asc or desc']
             })
-        clause_parsed.append(u'"{0}" {1}'.format(
-            field, sort)
-        )
+        clause_parsed.append((field, sort.lower()))
+    return clause_parsed
+
+
+def _sort(context, data_dict, field_ids):
+    clause_parsed = _parse_sort(data_dict, field_ids)
+    if not clause_parsed:
+        if data_dict.get('q'):
+            return u'ORDER BY rank'
+        else:
+            return u''
+
+    return "order by " + ", ".join([u'"{0}" {1}'.format(field, sort)
+                                    for field, sort in clause_parsed])
+
+
+def _keyset_sort(data_dict, all_field_ids):
+    '''Return the sort clauses for cursor pagination, which always end with
+    _id to make the order of the records total.'''
+    sort = _parse_sort(data_dict, all_field_ids)
+    if '_id' not in [field for field, direction in sort]:
+        sort.append(('_id', 'asc'))
+    return sort
 
-    if clause_parsed:
-        return "order by " + ", ".join(clause_parsed)
 
+def _encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values))
 
-def _insert_links(data_dict, limit, offset):
+
+def _decode_cursor(cursor, sort):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError):
+        values = None
+    if not isinstance(values, list) or len(values) != len(sort):
+        raise ValidationError({
+            'cursor': [u'"{0}" is not a valid cursor'.format(cursor)]
+        })
+    return values
+
+
+def _keyset_where(sort, values):
+    '''Return the condition (and its values) matching the records that come
+    after the given values of the sort fields.
+
+    NULLs come last in ascending and first in descending order, as they do
+    in PostgreSQL.'''
+    alternatives = []
+    alternatives_values = []
+    equal = []
+    equal_values = []
+    for (field, direction), value in zip(sort, values):
+        column = u'"{0}"'.format(field)
+        if value is None:
+            after = u'false' if direction == 'asc' else column + u' IS NOT NULL'
+            after_values = []
+        elif direction == 'asc':
+            after = u'({0} > %s OR {0} IS NULL)'.format(column)
+            after_values = [value]
+        else:
+            after = column + u' < %s'
+            after_values = [value]
+        alternatives.append(u' AND '.join(equal + [after]))
+        alternatives_values.extend(equal_values + after_values)
+        if value is None:
+            equal.append(column + u' IS NULL')
+        else:
+            equal.append(column + u' = %s')
+            equal_values.append(value)
+    return (u'(' + u' OR '.join([u'({0})'.format(a) for a in alternatives])
+            + u')', alternatives_values)
+
+
+def _estimate_total(context, sql_string, values):
+    '''Return the number of rows the planner expects the query to return.'''
+    result = context['connection'].execute(
+        u'EXPLAIN (FORMAT JSON) ' + sql_string, [values]).fetchone()[0]
+    if isinstance(result, basestring):
+        result = json.loads(result)
+    return int(result[0]['Plan']['Plan Rows'])
+
+
+def _current_url():
+    import ckan.plugins.toolkit as toolkit
+    return toolkit.request.environ['CKAN_CURRENT_URL']
+
+
+def _insert_links(data_dict, limit, offset, cursor=None, urlstring=None):
     '''Adds link to the next/prev part (same limit, offset=offset+limit)
-    and the resource page.'''
+    and the resource page.
+
+    When paginating with cursors, the next link has the cursor after the
+    last record instead, and there is no link to the previous part.'''
     data_dict['_links'] = {}
 
     # get the url from the request
-    import ckan.plugins.toolkit as toolkit
-    urlstring = toolkit.request.environ['CKAN_CURRENT_URL']
+    if urlstring is None:
+        urlstring = _current_url()
 
     # change the offset in the url
     parsed = list(urlparse.urlparse(urlstring))
@@ -814,6 +1251,11 @@ def _insert_links(data_dict, limit, offset):
     arguments_next['offset'] = int(offset) + int(limit)
     arguments_prev['offset'] = int(offset) - int(limit)
 
+    if 'cursor' in data_dict:
+        arguments_next.pop('offset')
+        arguments_start['cursor'] = ''
+        arguments_next['cursor'] = cursor
+
     parsed_start = parsed[:]
     parsed_prev = parsed[:]
     parsed_next = parsed[:]
@@ -823,9 +1265,13 @@ def _insert_links(data_dict, limit, offset):
 
     # add the links to the data dict
     data_dict['_links']['start'] = urlparse.urlunparse(parsed_start)
-    data_dict['_links']['next'] = urlparse.urlunparse(parsed_next)
-    if int(offset) - int(limit) > 0:
-        data_dict['_links']['prev'] = urlparse.urlunparse(parsed_prev)
+    if 'cursor' not in data_dict:
+        data_dict['_links']['next'] = urlparse.urlunparse(parsed_next)
+        if int(offset) - int(limit) > 0:
+            data_dict['_links']['prev'] = urlparse.urlunparse(parsed_prev)
+    elif cursor:
+        data_dict['_links']['next'] = urlparse.urlunparse(parsed_next)
+    return data_dict['_links']
 
 
 def delete_data(context, data_dict):
@@ -875,57 +1321,301 @@ def search_data(context, data_dict):
     if 'offset' in data_dict:
         data_dict['offset'] = int(offset)
 
-    sort = _sort(context, data_dict, field_ids)
+    data_dict.pop('total', None)
+    include_total = _get_bool(data_dict.get('include_total'), True)
+    estimate_total = _get_bool(data_dict.get('estimate_total'), False)
+    count_sql = u'SELECT 1 FROM "{resource}" {ts_query} {where}'.format(
+        resource=data_dict['resource_id'],
+        ts_query=ts_query,
+        where=where_clause)
+
+    full_count_column = u''
+    cursor_columns = u''
+    if 'cursor' in data_dict:
+        # keyset pagination, the records after the ones in the cursor
+        keyset_sort = _keyset_sort(data_dict, all_field_ids)
+        sort = u'ORDER BY ' + u', '.join([u'"{0}" {1}'.format(field, direction)
+                                          for field, direction in keyset_sort])
+        cursor_columns = u''.join([
+            u', "{0}" AS "_cursor_{1}"'.format(field, num)
+            for num, (field, direction) in enumerate(keyset_sort)])
+        offset = 0
+        data_dict.pop('offset', None)
+        values = where_values
+        if data_dict['cursor']:
+            keyset_clause, keyset_values = _keyset_where(
+                keyset_sort, _decode_cursor(data_dict['cursor'], keyset_sort))
+            values = where_values + keyset_values
+            where_clause = (where_clause + u' AND ' if where_clause
+                            else u'WHERE ') + keyset_clause
+    else:
+        sort = _sort(context, data_dict, field_ids)
+        values = where_values
+        if include_total and not estimate_total:
+            full_count_column = u', count(*) over() AS "_full_count"'
 
-    sql_string = u'''SELECT {select}, count(*) over() AS "_full_count" {rank}
+    sql_string = u'''SELECT {select} {full_count} {rank} {cursor}
                     FROM "{resource}" {ts_query}
                     {where} {sort} LIMIT {limit} OFFSET {offset}'''.format(
             select=select_columns,
+            full_count=full_count_column,
             rank=rank_column,
+            cursor=cursor_columns,
             resource=data_dict['resource_id'],
             ts_query=ts_query,
             where=where_clause,
             sort=sort, limit=limit, offset=offset)
-    results = context['connection'].execute(sql_string, [where_values])
-
-    _insert_links(data_dict, limit, offset)
-    return format_results(context, results, data_dict)
+    if context.get('stream_results'):
+        results = context['connection'].execution_options(
+            stream_results=True).execute(sql_string, [values])
+        data_dict = stream_results(context, results, data_dict)
+    else:
+        results = context['connection'].execute(sql_string, [values])
+        data_dict = format_results(context, results, data_dict)
+
+    if include_total and 'total' not in data_dict:
+        if estimate_total:
+            data_dict['total'] = _estimate_total(context, count_sql,
+                                                 where_values)
+            data_dict['total_was_estimated'] = True
+        elif 'cursor' in data_dict or not data_dict['records']:
+            data_dict['total'] = context['connection'].execute(
+                u'SELECT count(*) FROM ({0}) AS "_count"'.format(count_sql),
+                [where_values]).scalar()
+
+    next_cursor = data_dict.pop('_next_cursor', None)
+    if callable(next_cursor):
+        # the last record is only known once they have been streamed
+        urlstring = _current_url()
+        data_dict['_links'] = jsonstream.Deferred(
+            lambda: _insert_links(data_dict, limit, offset, next_cursor(),
+                                  urlstring))
+    else:
+        _insert_links(data_dict, limit, offset, next_cursor)
+    return data_dict
 
 
-def format_results(context, results, data_dict):
+def _result_fields(context, results):
+    '''Return the fields of the results, the hidden fields used to build the
+    cursor of the next page, and the position of each of them in a row.'''
     result_fields = []
-    for field in results.cursor.description:
-        result_fields.append({
-            'id': field[0].decode('utf-8'),
-            'type': _get_type(context, field[1])
-        })
-    if len(result_fields) and result_fields[-1]['id'] == '_full_count':
-        result_fields.pop()  # remove _full_count
+    cursor_fields = []
+    for num, field in enumerate(results.cursor.description):
+        field_id = field[0].decode('utf-8')
+        field_type = _get_type(context, field[1])
+        if field_id.startswith('_cursor_'):
+            cursor_fields.append({'id': field_id, 'type': field_type,
+                                  'position': num})
+        elif field_id != '_full_count':
+            result_fields.append({'id': field_id, 'type': field_type,
+                                  'position': num})
+    return result_fields, cursor_fields
+
+
+def _row_converter(fields):
+    '''Return a function converting a row to the list of the values of the
+    given fields, with the converters of their types resolved only once.'''
+    converters = [(field['position'], _get_converter(field['type']))
+                  for field in fields]
+
+    def convert_row(row):
+        values = []
+        for position, converter in converters:
+            value = row[position]
+            values.append(None if value is None else converter(value))
+        return values
+    return convert_row
+
+
+def _cursor_after(cursor_fields, row):
+    return _encode_cursor(_row_converter(cursor_fields)(row))
+
+
+def _public_fields(fields):
+    return [{'id': field['id'], 'type': field['type']} for field in fields]
+
+
+def format_results(context, results, data_dict, rows=None):
+    '''Set the fields and records of data_dict from the results, or from the
+    rows already fetched from them if given.'''
+    result_fields, cursor_fields = _result_fields(context, results)
+    convert_row = _row_converter(result_fields)
+    field_ids = _pluck('id', result_fields)
 
     records = []
-    for row in results:
-        converted_row = {}
+    row = None
+    for row in (results if rows is None else rows):
         if '_full_count' in row:
             data_dict['total'] = row['_full_count']
-        for field in result_fields:
-            converted_row[field['id']] = convert(row[field['id']],
-                                                 field['type'])
-        records.append(converted_row)
+        records.append(dict(zip(field_ids, convert_row(row))))
     data_dict['records'] = records
-    data_dict['fields'] = result_fields
+    data_dict['fields'] = _public_fields(result_fields)
+
+    if cursor_fields and row is not None:
+        # cursor to get the records after the last one
+        data_dict['_next_cursor'] = _cursor_after(cursor_fields, row)
 
     return _unrename_json_field(data_dict)
 
 
+def stream_results(context, results, data_dict):
+    '''Like format_results, but the records are fetched from a server side
+    cursor in batches of _STREAM_BATCH_SIZE rows and encoded to JSON one by
+    one while the response is sent.
+
+    The results must have been executed with the stream_results option.
+    Unless there are no records, records is a JsonStream which closes the
+    connection once consumed, and _next_cursor is a function returning the
+    cursor after the last record streamed.'''
+    result_fields, cursor_fields = _result_fields(context, results)
+    data_dict['fields'] = _public_fields(result_fields)
+
+    rows = results.fetchmany(_STREAM_BATCH_SIZE)
+    if not rows:
+        results.close()
+        data_dict['records'] = []
+        return _unrename_json_field(data_dict)
+    if '_full_count' in rows[0]:
+        data_dict['total'] = rows[0]['_full_count']
+
+    convert_row = _row_converter(result_fields)
+    keys = [json.dumps(field['id']) + ': ' for field in result_fields]
+    last_row = []
+
+    def records():
+        batch = rows
+        while batch:
+            for row in batch:
+                # json.dumps escapes the non ASCII characters, so the
+                # records are byte strings
+                yield '{' + ', '.join([key + json.dumps(value)
+                    for key, value in zip(keys, convert_row(row))]) + '}'
+            last_row[:] = [batch[-1]]
+            batch = results.fetchmany(_STREAM_BATCH_SIZE)
+
+    if cursor_fields:
+        data_dict['_next_cursor'] = lambda: _cursor_after(cursor_fields,
+                                                          last_row[0])
+    data_dict['records'] = jsonstream.JsonStream(
+        records(), close=context['connection'].close)
+    return _unrename_json_field(data_dict)
+
+
+class _DumpRows(object):
+    '''The values of the rows of a dump, fetched in batches from a server
+    side cursor when iterated. Closing it (which happens once all the rows
+    have been read) closes the connection.'''
+    def __init__(self, connection, results, fields):
+        self._connection = connection
+        self._results = results
+        self._convert_row = _row_converter(fields)
+
+    def __iter__(self):
+        try:
+            while True:
+                batch = self._results.fetchmany(_STREAM_BATCH_SIZE)
+                if not batch:
+                    break
+                for row in batch:
+                    yield self._convert_row(row)
+        finally:
+            self.close()
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+def dump_data(context, data_dict):
+    all_fields = _get_fields(context, data_dict)
+    all_field_ids = _pluck('id', all_fields)
+    all_field_ids.insert(0, '_id')
+
+    fields = data_dict.get('fields')
+    if fields:
+        field_ids = _get_list(fields)
+        for field in field_ids:
+            if not field in all_field_ids:
+                raise ValidationError({
+                    'fields': [u'field "{0}" not in table'.format(field)]}
+                )
+    else:
+        field_ids = all_field_ids
+
+    select_columns = ', '.join([u'"{0}"'.format(field_id)
+                                for field_id in field_ids])
+    ts_query, rank_column = _textsearch_query(data_dict)
+    where_clause, where_values = _where(all_field_ids, data_dict)
+    sort = _sort(context, data_dict, field_ids)
+
+    sql_string = u'''SELECT {select} {rank}
+                    FROM "{resource}" {ts_query}
+                    {where} {sort}'''.format(
+            select=select_columns,
+            rank=rank_column,
+            resource=data_dict['resource_id'],
+            ts_query=ts_query,
+            where=where_clause,
+            sort=sort)
+    results = context['connection'].execution_options(
+        stream_results=True).execute(sql_string, [where_values])
+
+    # leave out the rank column
+    result_fields = _result_fields(context, results)[0][:len(field_ids)]
+    data_dict['fields'] = _public_fields(result_fields)
+    data_dict['records'] = _DumpRows(context['connection'], results,
+                                     result_fields)
+    return _unrename_json_field(data_dict)
+
+
+def _fetch_rows(results, max_rows):
+    '''Fetch at most max_rows rows of the results, in batches. Returns the
+    rows and whether there were more.'''
+    rows = []
+    while len(rows) <= max_rows:
+        batch = results.fetchmany(min(_STREAM_BATCH_SIZE,
+                                      max_rows + 1 - len(rows)))
+        if not batch:
+            break
+        rows.extend(batch)
+    return rows[:max_rows], len(rows) > max_rows
+
+
+def _check_query_cost(context, sql, max_cost=None, max_rows=None):
+    '''Reject the query if the planner expects it to cost more than
+    max_cost or to return more than max_rows rows.'''
+    result = context['connection'].execute(
+        u'EXPLAIN (FORMAT JSON) ' + sql).fetchone()[0]
+    if isinstance(result, basestring):
+        result = json.loads(result)
+    plan = result[0]['Plan']
+    if max_cost is not None and plan['Total Cost'] > max_cost:
+        raise ValidationError({
+            'query': [u'Query is too expensive (estimated cost {0}, maximum '
+                      u'{1})'.format(plan['Total Cost'], max_cost)]
+        })
+    if max_rows is not None and plan['Plan Rows'] > max_rows:
+        raise ValidationError({
+            'query': [u'Query returns too many rows (estimated {0}, maximum '
+                      u'{1})'.format(plan['Plan Rows'], max_rows)]
+        })
+
+
+def _is_select(sql):
+    '''Whether the statement can be run with a server side cursor.'''
+    return bool(_select_re.match(sql))
+
+
 def _is_single_statement(sql):
     return not ';' in sql.strip(';')
 
 
 def create(context, data_dict):
     '''
-    The first row will be used to guess types not in the fields and the
-    guessed types will be added to the headers permanently.
-    Consecutive rows have to conform to the field definitions.
+    A sample of the rows will be used to guess types not in the fields and
+    the guessed types will be added to the headers permanently.
+    All the rows have to conform to the field definitions.
 
     rows can be empty so that you can just set the fields.
 
@@ -944,6 +1634,7 @@ def create(context, data_dict):
     '''
     engine = _get_engine(context, data_dict)
     context['connection'] = engine.connect()
+    context['table_metadata_versions'] = {}
     timeout = context.get('query_timeout', 60000)
     _cache_types(context)
 
@@ -955,11 +1646,7 @@ def create(context, data_dict):
         trans = context['connection'].begin()
         context['connection'].execute(
             u'SET LOCAL statement_timeout TO {0}'.format(timeout))
-        result = context['connection'].execute(
-            u'SELECT * FROM pg_tables WHERE tablename = %s',
-             data_dict['resource_id']
-        ).fetchone()
-        if not result:
+        if _get_table_kind(context, data_dict['resource_id']) != 'table':
             create_table(context, data_dict)
         else:
             alter_table(context, data_dict)
@@ -1001,6 +1688,7 @@ def upsert(context, data_dict):
     '''
     engine = _get_engine(context, data_dict)
     context['connection'] = engine.connect()
+    context['table_metadata_versions'] = {}
     timeout = context.get('query_timeout', 60000)
 
     try:
@@ -1037,21 +1725,20 @@ def upsert(context, data_dict):
 def delete(context, data_dict):
     engine = _get_engine(context, data_dict)
     context['connection'] = engine.connect()
+    context['table_metadata_versions'] = {}
     _cache_types(context)
 
     try:
         # check if table exists
         trans = context['connection'].begin()
-        result = context['connection'].execute(
-            u'SELECT 1 FROM pg_tables WHERE tablename = %s',
-             data_dict['resource_id']
-        ).fetchone()
-        if not result:
+        if _get_table_kind(context, data_dict['resource_id']) != 'table':
             raise ValidationError({
                 'resource_id': [u'table for resource "{0}" does not exist'.format(
                     data_dict['resource_id'])]
             })
         if not 'filters' in data_dict:
+            _invalidate_table_metadata(context, [data_dict['resource_id']] +
+                                       _get_aliases(context, data_dict))
             context['connection'].execute(
                 u'DROP TABLE "{0}" CASCADE'.format(data_dict['resource_id'])
             )
@@ -1070,24 +1757,24 @@ def delete(context, data_dict):
 def search(context, data_dict):
     engine = _get_engine(context, data_dict)
     context['connection'] = engine.connect()
+    context['table_metadata_versions'] = {}
     timeout = context.get('query_timeout', 60000)
     _cache_types(context)
 
+    streaming = False
     try:
         # check if table exists
         context['connection'].execute(
             u'SET LOCAL statement_timeout TO {0}'.format(timeout))
-        id = data_dict['resource_id']
-        result = context['connection'].execute(
-            u"(SELECT 1 FROM pg_tables where tablename = '{0}') union"
-             u"(SELECT 1 FROM pg_views where viewname = '{0}')".format(id)
-        ).fetchone()
-        if not result:
+        if not _get_table_kind(context, data_dict['resource_id']):
             raise ValidationError({
                 'resource_id': [u'table for resource "{0}" does not exist'.format(
                     data_dict['resource_id'])]
             })
-        return search_data(context, data_dict)
+        result = search_data(context, data_dict)
+        # the records stream closes the connection once consumed
+        streaming = not isinstance(result['records'], list)
+        return result
     except DBAPIError, e:
         if e.orig.pgcode == _PG_ERR_CODE['query_canceled']:
             raise ValidationError({
@@ -1095,22 +1782,77 @@ def search(context, data_dict):
             })
         raise
     finally:
-        context['connection'].close()
+        if not streaming:
+            context['connection'].close()
+
+
+def dump(context, data_dict):
+    '''
+    Returns the fields and the values of all the (matching) rows of a table
+    as an iterable of lists, in the order of the fields.
+
+    The rows are read from a server side cursor with a single query, without
+    counting them, so the memory used doesn't depend on the size of the
+    table. The connection is only closed once the records have been read or
+    closed.
+    '''
+    engine = _get_engine(context, data_dict)
+    context['connection'] = engine.connect()
+    context['table_metadata_versions'] = {}
+    timeout = context.get('query_timeout', 60000)
+    _cache_types(context)
+
+    streaming = False
+    try:
+        context['connection'].execute(
+            u'SET LOCAL statement_timeout TO {0}'.format(timeout))
+        if not _get_table_kind(context, data_dict['resource_id']):
+            raise ValidationError({
+                'resource_id': [u'table for resource "{0}" does not exist'.format(
+                    data_dict['resource_id'])]
+            })
+        result = dump_data(context, data_dict)
+        streaming = True
+        return result
+    except DBAPIError, e:
+        if e.orig.pgcode == _PG_ERR_CODE['query_canceled']:
+            raise ValidationError({
+                'query': ['Query took too long']
+            })
+        raise
+    finally:
+        if not streaming:
+            context['connection'].close()
 
 
 def search_sql(context, data_dict):
     engine = _get_engine(context, data_dict)
     context['connection'] = engine.connect()
+    context['table_metadata_versions'] = {}
     timeout = context.get('query_timeout', 60000)
     _cache_types(context)
 
     try:
         context['connection'].execute(
             u'SET LOCAL statement_timeout TO {0}'.format(timeout))
-        results = context['connection'].execute(
-            data_dict['sql'].replace('%', '%%')
-        )
-        return format_results(context, results, data_dict)
+        sql = data_dict['sql'].replace('%', '%%')
+        max_cost = context.get('max_query_cost')
+        max_estimated_rows = context.get('max_query_rows')
+        if max_cost is not None or max_estimated_rows is not None:
+            _check_query_cost(context, sql, max_cost, max_estimated_rows)
+
+        connection = context['connection']
+        if _is_select(sql):
+            # read the rows in batches rather than all at once
+            connection = connection.execution_options(stream_results=True)
+        results = connection.execute(sql)
+        max_rows = context.get('max_rows', _SEARCH_SQL_MAX_ROWS)
+        rows, truncated = _fetch_rows(results, max_rows)
+        data_dict = format_results(context, results, data_dict, rows)
+        results.close()
+        if truncated:
+            data_dict['records_truncated'] = True
+        return data_dict
 
     except ProgrammingError, e:
         raise ValidationError({
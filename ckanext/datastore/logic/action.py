@@ -3,6 +3,7 @@ import pylons
 import json
 import ckan.logic as logic
 import ckan.plugins as p
+import ckan.lib.jsonstream as jsonstream
 import ckanext.datastore.db as db
 import sqlalchemy
 
@@ -67,6 +68,9 @@ def datastore_create(context, data_dict):
                 'alias': ['{0} is not a valid alias name'.format(alias)]
             })
 
+    context['type_guess_sample_size'] = int(pylons.config.get(
+        'ckan.datastore.type_guess_sample_size', db._TYPE_GUESS_SAMPLE_SIZE))
+
     result = db.create(context, data_dict)
     result.pop('id', None)
     result.pop('connection_url')
@@ -171,6 +175,7 @@ def datastore_delete(context, data_dict):
 
 
 @logic.side_effect_free
+@logic.streams_results
 def datastore_search(context, data_dict):
     '''Search a datastore table.
 
@@ -195,9 +200,25 @@ def datastore_search(context, data_dict):
     :param sort: comma separated field names with ordering
                  e.g.: "fieldname1, fieldname2 desc"
     :type sort: string
+    :param cursor: paginate with cursors instead of offsets, use an empty
+                   string to get the first page and the cursor in the
+                   ``next`` link for the following ones
+    :type cursor: string
+    :param include_total: return the total number of matching records
+                          (default: true)
+    :type include_total: bool
+    :param estimate_total: return the number of matching records estimated
+                           by the query planner instead of counting them
+                           (default: false)
+    :type estimate_total: bool
 
     Setting the ``plain`` flag to false enables the entire PostgreSQL `full text search query language`_.
 
+    With cursor pagination the records are sorted by the ``sort`` fields and
+    then by ``_id`` (not by rank when searching with ``q``), and each page
+    is fetched with an index friendly condition on these fields, so deep
+    pages are as fast as the first one.
+
     A listing of all available resources can be found at the alias ``_table_metadata``.
 
     .. _full text search query language: http://www.postgresql.org/docs/9.1/static/datatype-textsearch.html#DATATYPE-TSQUERY
@@ -217,8 +238,12 @@ def datastore_search(context, data_dict):
     :type filters: list of dictionaries
     :param total: number of total matching records
     :type total: int
+    :param total_was_estimated: whether the total is an estimate
+    :type total_was_estimated: bool
     :param records: list of matching results
     :type records: list of dictionaries
+    :param _links: links to the first and next pages of results
+    :type _links: dictionary
 
     '''
     if 'id' in data_dict:
@@ -251,6 +276,90 @@ def datastore_search(context, data_dict):
     return result
 
 
+@logic.side_effect_free
+@logic.streams_results
+def datastore_dump(context, data_dict):
+    '''Dump all the records of a datastore table.
+
+    The datastore_dump action returns all the records of a resource (or the
+    ones matching the filters and query) in a single response, without
+    paging through them with ``datastore_search``. The records are read
+    from the database and sent while the response is written, so tables of
+    any size can be dumped.
+
+    The records can also be downloaded as a CSV, TSV or JSON lines file at
+    ``/datastore/dump/{resource_id}?format=csv``, which accepts the same
+    parameters (with ``filters`` as a JSON object).
+
+    :param resource_id: id or alias of the resource to be dumped.
+    :type resource_id: string
+    :param filters: matching conditions to select, e.g {"key1": "a", "key2": "b"}
+    :type filters: dictionary
+    :param q: full text query
+    :type q: string
+    :param plain: treat as plain text query (default: true)
+    :type plain: bool
+    :param language: language of the full text query (default: english)
+    :type language: string
+    :param fields: fields to return (default: all fields in original order)
+    :type fields: list or comma separated string
+    :param sort: comma separated field names with ordering
+                 e.g.: "fieldname1, fieldname2 desc"
+    :type sort: string
+
+    **Results:**
+
+    The result of this action is a dict with the following keys:
+
+    :rtype: A dictionary with the following keys
+    :param fields: fields/columns and their extra metadata
+    :type fields: list of dictionaries
+    :param records: the values of each record, in the order of the fields
+    :type records: list of lists
+
+    When called with ``lazy_records`` in the context, the records are
+    instead an iterable which reads them from the database as it is
+    iterated, and which must be closed if it isn't read to the end: the
+    database connection stays open until then.
+
+    '''
+    if 'id' in data_dict:
+        data_dict['resource_id'] = data_dict['id']
+    res_id = _get_or_bust(data_dict, 'resource_id')
+
+    if 'filters' in data_dict and isinstance(data_dict['filters'], basestring):
+        try:
+            data_dict['filters'] = json.loads(data_dict['filters'])
+        except ValueError:
+            pass
+
+    data_dict['connection_url'] = pylons.config.get('ckan.datastore.read_url',
+            pylons.config['ckan.datastore.write_url'])
+
+    resources_sql = sqlalchemy.text(u'SELECT 1 FROM "_table_metadata" WHERE name = :id')
+    results = db._get_engine(None, data_dict).execute(resources_sql, id=res_id)
+    res_exists = results.rowcount > 0
+
+    if not res_exists:
+        raise p.toolkit.ObjectNotFound(p.toolkit._(
+            'Resource "{0}" was not found.'.format(res_id)
+        ))
+
+    p.toolkit.check_access('datastore_dump', context, data_dict)
+
+    result = db.dump(context, data_dict)
+    result.pop('id', None)
+    result.pop('connection_url')
+    records = result['records']
+    if context.get('stream_results'):
+        result['records'] = jsonstream.JsonStream(
+            (json.dumps(values) for values in records), close=records.close)
+    elif not context.get('lazy_records'):
+        # reading all the records closes the connection
+        result['records'] = list(records)
+    return result
+
+
 @logic.side_effect_free
 def datastore_search_sql(context, data_dict):
     '''Execute SQL queries on the datastore.
@@ -260,6 +369,10 @@ def datastore_search_sql(context, data_dict):
     engine is the
     `PostgreSQL engine <http://www.postgresql.org/docs/9.1/interactive/sql/.html>`_.
     There is an enforced timeout on SQL queries to avoid an unintended DOS.
+    The number of records returned is limited by
+    :ref:`ckan.datastore.search_sql.max_rows`, and queries the planner
+    expects to be too expensive can be rejected before running them (see
+    :ref:`ckan.datastore.search_sql.max_cost`).
 
     .. note:: This action is only available when using PostgreSQL 9.X and using a read-only user on the database.
         It is not available in :ref:`legacy mode<legacy_mode>`.
@@ -276,6 +389,10 @@ def datastore_search_sql(context, data_dict):
     :type fields: list of dictionaries
     :param records: list of matching results
     :type records: list of dictionaries
+    :param records_truncated: present (and true) if the query returned more
+        than the maximum number of records allowed, in which case only the
+        first ones are included
+    :type records_truncated: bool
 
     '''
     sql = _get_or_bust(data_dict, 'sql')
@@ -291,6 +408,14 @@ def datastore_search_sql(context, data_dict):
 
     data_dict['connection_url'] = pylons.config['ckan.datastore.read_url']
 
+    context['max_rows'] = int(pylons.config.get(
+        'ckan.datastore.search_sql.max_rows', db._SEARCH_SQL_MAX_ROWS))
+    for key, option in [('max_query_cost', 'max_cost'),
+                        ('max_query_rows', 'max_estimated_rows')]:
+        value = pylons.config.get('ckan.datastore.search_sql.' + option)
+        if value:
+            context[key] = float(value)
+
     result = db.search_sql(context, data_dict)
     result.pop('id', None)
     result.pop('connection_url')
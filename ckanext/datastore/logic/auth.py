@@ -32,3 +32,7 @@ def datastore_delete(context, data_dict):
 
 def datastore_search(context, data_dict):
     return {'success': True}
+
+
+def datastore_dump(context, data_dict):
+    return datastore_search(context, data_dict)
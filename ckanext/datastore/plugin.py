@@ -20,6 +20,7 @@ class DatastorePlugin(p.SingletonPlugin):
     p.implements(p.IConfigurable, inherit=True)
     p.implements(p.IActions)
     p.implements(p.IAuthFunctions)
+    p.implements(p.IRoutes, inherit=True)
 
     legacy_mode = False
 
@@ -66,6 +67,7 @@ class DatastorePlugin(p.SingletonPlugin):
             self._check_urls_and_permissions()
 
             self._create_alias_table()
+            self._create_metadata_version_table()
 
         ## Do light wrapping around action function to add datastore_active
         ## to resource dict.  Not using IAction extension as this prevents
@@ -197,11 +199,28 @@ class DatastorePlugin(p.SingletonPlugin):
             {'connection_url': pylons.config['ckan.datastore.write_url']}).connect()
         connection.execute(create_alias_table_sql)
 
+    def _create_metadata_version_table(self):
+        connection = db._get_engine(None,
+            {'connection_url': pylons.config['ckan.datastore.write_url']}).connect()
+        try:
+            exists = connection.execute(
+                u'SELECT 1 FROM pg_tables WHERE tablename = %s',
+                db._METADATA_VERSION_TABLE).fetchone()
+            if not exists:
+                connection.execute(u'''CREATE TABLE "{0}" (
+                    name text PRIMARY KEY,
+                    version integer NOT NULL)'''.format(
+                        db._METADATA_VERSION_TABLE))
+        finally:
+            connection.close()
+        db._clear_table_metadata_cache()
+
     def get_actions(self):
         actions = {'datastore_create': action.datastore_create,
                    'datastore_upsert': action.datastore_upsert,
                    'datastore_delete': action.datastore_delete,
-                   'datastore_search': action.datastore_search}
+                   'datastore_search': action.datastore_search,
+                   'datastore_dump': action.datastore_dump}
         if not self.legacy_mode:
             actions['datastore_search_sql'] = action.datastore_search_sql
         return actions
@@ -210,4 +229,11 @@ class DatastorePlugin(p.SingletonPlugin):
         return {'datastore_create': auth.datastore_create,
                 'datastore_upsert': auth.datastore_upsert,
                 'datastore_delete': auth.datastore_delete,
-                'datastore_search': auth.datastore_search}
+                'datastore_search': auth.datastore_search,
+                'datastore_dump': auth.datastore_dump}
+
+    def before_map(self, m):
+        m.connect('datastore_dump', '/datastore/dump/{resource_id}',
+                  controller='ckanext.datastore.controller:DatastoreController',
+                  action='dump')
+        return m
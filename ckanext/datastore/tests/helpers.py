@@ -1,5 +1,6 @@
 import ckan.model as model
 import ckan.lib.cli as cli
+import ckanext.datastore.db as db
 
 
 def extract(d, keys):
@@ -15,6 +16,7 @@ def clear_db(Session):
         c.execute(result[0])
     Session.commit()
     Session.remove()
+    db._clear_table_metadata_cache()
 
 
 def rebuild_all_dbs(Session):
@@ -0,0 +1,156 @@
+import json
+import nose
+import paste.fixture
+
+import pylons
+import pylons.config as config
+import sqlalchemy.orm as orm
+
+import ckan.plugins as p
+import ckan.lib.create_test_data as ctd
+import ckan.model as model
+import ckan.tests as tests
+import ckan.lib.jsonstream as jsonstream
+from ckan.config.middleware import make_app
+
+import ckanext.datastore.db as db
+from ckanext.datastore.tests.helpers import rebuild_all_dbs
+
+assert_equal = nose.tools.assert_equal
+
+
+class TestDatastoreDump(tests.WsgiAppCase):
+    sysadmin_user = None
+
+    @classmethod
+    def setup_class(cls):
+        if not tests.is_datastore_supported():
+            raise nose.SkipTest("Datastore not supported")
+        cls._original_config = config.copy()
+        config['ckan.plugins'] = 'datastore'
+        wsgiapp = make_app(config['global_conf'], **config)
+        cls.app = paste.fixture.TestApp(wsgiapp)
+
+        ctd.CreateTestData.create()
+        cls.sysadmin_user = model.User.get('testsysadmin')
+        resource = model.Package.get('annakarenina').resources[0]
+        cls.data = {
+            'resource_id': resource.id,
+            'fields': [{'id': u'b\xfck', 'type': 'text'},
+                       {'id': 'author', 'type': 'text'},
+                       {'id': 'rating', 'type': 'int'},
+                       {'id': 'nested', 'type': 'json'}],
+            'records': [{u'b\xfck': u'annakarenina', 'author': 'tolstoy',
+                         'rating': 5, 'nested': ['b', {'moo': 'moo'}]},
+                        {u'b\xfck': u'warandpeace', 'author': 'tolstoy'},
+                        {u'b\xfck': u'the "idiot"', 'author': 'dostoevsky',
+                         'rating': 4}]
+        }
+        postparams = '%s=1' % json.dumps(cls.data)
+        auth = {'Authorization': str(cls.sysadmin_user.apikey)}
+        res = cls.app.post('/api/action/datastore_create', params=postparams,
+                           extra_environ=auth)
+        res_dict = json.loads(res.body)
+        assert res_dict['success'] is True
+
+        engine = db._get_engine(
+            None,
+            {'connection_url': pylons.config['ckan.datastore.write_url']}
+        )
+        cls.Session = orm.scoped_session(orm.sessionmaker(bind=engine))
+
+    @classmethod
+    def teardown_class(cls):
+        rebuild_all_dbs(cls.Session)
+        config.clear()
+        config.update(cls._original_config)
+        p.reset()
+
+    def test_dump_action(self):
+        data = {'resource_id': self.data['resource_id'],
+                'fields': [u'b\xfck', 'nested'],
+                'sort': 'rating desc'}
+        postparams = '%s=1' % json.dumps(data)
+        res = self.app.post('/api/action/datastore_dump', params=postparams)
+        res_dict = json.loads(res.body)
+        assert res_dict['success'] is True
+        result = res_dict['result']
+        assert_equal(result['fields'], [{u'id': u'b\xfck', u'type': u'text'},
+                                        {u'id': u'nested', u'type': u'json'}])
+        assert_equal(result['records'], [[u'warandpeace', None],
+                                         [u'annakarenina',
+                                          [u'b', {u'moo': u'moo'}]],
+                                         [u'the "idiot"', None]])
+
+    def test_dump_action_is_streamed(self):
+        streamed = []
+        iterencode = jsonstream.iterencode
+
+        def recording_iterencode(obj):
+            streamed.append(obj)
+            return iterencode(obj)
+        jsonstream.iterencode = recording_iterencode
+        try:
+            postparams = '%s=1' % json.dumps({
+                'resource_id': self.data['resource_id'], 'fields': u'author',
+                'sort': '_id'})
+            res = self.app.post('/api/action/datastore_dump',
+                                params=postparams)
+        finally:
+            jsonstream.iterencode = iterencode
+        assert_equal(len(streamed), 1)
+        assert isinstance(streamed[0]['result']['records'],
+                          jsonstream.JsonStream), streamed[0]
+        assert_equal(json.loads(res.body)['result']['records'],
+                     [[u'tolstoy'], [u'tolstoy'], [u'dostoevsky']])
+
+    def test_dump_action_from_python(self):
+        context = {'user': self.sysadmin_user.name}
+        result = p.toolkit.get_action('datastore_dump')(context, {
+            'resource_id': self.data['resource_id'], 'fields': u'author',
+            'sort': '_id'})
+        assert_equal(result['records'],
+                     [[u'tolstoy'], [u'tolstoy'], [u'dostoevsky']])
+
+    def test_dump_action_not_found(self):
+        postparams = '%s=1' % json.dumps({'resource_id': 'not-a-resource'})
+        res = self.app.post('/api/action/datastore_dump', params=postparams,
+                            status=404)
+        assert json.loads(res.body)['success'] is False
+
+    def test_dump_csv(self):
+        res = self.app.get('/datastore/dump/{0}'.format(
+            self.data['resource_id']))
+        assert res.header('Content-Type').startswith('text/csv')
+        assert_equal(res.body.decode('utf-8').splitlines(), [
+            u'_id,b\xfck,author,rating,nested',
+            u'1,annakarenina,tolstoy,5,"[""b"", {""moo"": ""moo""}]"',
+            u'2,warandpeace,tolstoy,,',
+            u'3,"the ""idiot""",dostoevsky,4,'])
+
+    def test_dump_tsv_filtered(self):
+        res = self.app.get('/datastore/dump/{0}'.format(
+            self.data['resource_id']), params={
+                'format': 'tsv',
+                'fields': 'author,rating',
+                'filters': json.dumps({'author': 'tolstoy'}),
+                'sort': '_id desc'})
+        assert_equal(res.body.splitlines(), ['author\trating',
+                                             'tolstoy\t',
+                                             'tolstoy\t5'])
+
+    def test_dump_jsonl(self):
+        res = self.app.get('/datastore/dump/{0}'.format(
+            self.data['resource_id']), params={'format': 'jsonl',
+                                               'q': 'idiot'})
+        assert_equal([json.loads(line) for line in res.body.splitlines()],
+                     [{u'_id': 3, u'b\xfck': u'the "idiot"',
+                       u'author': u'dostoevsky', u'rating': 4,
+                       u'nested': None}])
+
+    def test_dump_errors(self):
+        self.app.get('/datastore/dump/not-a-resource', status=404)
+        self.app.get('/datastore/dump/{0}'.format(self.data['resource_id']),
+                     params={'format': 'xls'}, status=400)
+        self.app.get('/datastore/dump/{0}'.format(self.data['resource_id']),
+                     params={'fields': 'missing'}, status=409)
@@ -1,6 +1,7 @@
 import json
 import nose
 import pprint
+import urlparse
 
 import sqlalchemy.orm as orm
 
@@ -8,6 +9,7 @@ import ckan.plugins as p
 import ckan.lib.create_test_data as ctd
 import ckan.model as model
 import ckan.tests as tests
+import ckan.lib.jsonstream as jsonstream
 
 import ckanext.datastore.db as db
 from ckanext.datastore.tests.helpers import extract, rebuild_all_dbs
@@ -96,6 +98,37 @@ class TestDatastoreSearch(tests.WsgiAppCase):
         assert result['total'] == len(self.data['records'])
         assert result['records'] == self.expected_records, result['records']
 
+    def test_search_from_python_is_not_streamed(self):
+        context = {'model': model, 'session': model.Session,
+                   'user': self.sysadmin_user.name}
+        result = p.toolkit.get_action('datastore_search')(
+            context, {'resource_id': self.data['resource_id']})
+        assert 'stream_results' not in context
+        assert isinstance(result['records'], list), result['records']
+        assert len(result['records']) == len(self.data['records'])
+
+    def test_search_is_streamed_by_the_api(self):
+        streamed = []
+        iterencode = jsonstream.iterencode
+
+        def recording_iterencode(obj):
+            streamed.append(obj)
+            return iterencode(obj)
+        jsonstream.iterencode = recording_iterencode
+        try:
+            data = {'resource_id': self.data['resource_id']}
+            postparams = '%s=1' % json.dumps(data)
+            auth = {'Authorization': str(self.sysadmin_user.apikey)}
+            res = self.app.post('/api/action/datastore_search',
+                                params=postparams, extra_environ=auth)
+        finally:
+            jsonstream.iterencode = iterencode
+        assert len(streamed) == 1, streamed
+        assert isinstance(streamed[0]['result']['records'],
+                          jsonstream.JsonStream), streamed[0]
+        result = json.loads(res.body)['result']
+        assert result['records'] == self.expected_records, result['records']
+
     def test_search_alias(self):
         data = {'resource_id': self.data['aliases']}
         postparams = '%s=1' % json.dumps(data)
@@ -252,6 +285,67 @@ class TestDatastoreSearch(tests.WsgiAppCase):
         assert result['total'] == 2
         assert result['records'] == [self.expected_records[1]]
 
+    def test_search_cursor(self):
+        auth = {'Authorization': str(self.sysadmin_user.apikey)}
+        data = {'resource_id': self.data['resource_id'],
+                'limit': 1,
+                'sort': u'b\xfck desc',
+                'cursor': ''}
+        postparams = '%s=1' % json.dumps(data)
+        res = self.app.post('/api/action/datastore_search', params=postparams,
+                            extra_environ=auth)
+        res_dict = json.loads(res.body)
+        assert res_dict['success'] is True
+        result = res_dict['result']
+        assert result['total'] == 2
+        assert result['records'] == [self.expected_records[1]]
+
+        next_link = urlparse.urlparse(result['_links']['next'])
+        cursor = urlparse.parse_qs(next_link.query)['cursor'][0]
+        data['cursor'] = cursor
+        postparams = '%s=1' % json.dumps(data)
+        res = self.app.post('/api/action/datastore_search', params=postparams,
+                            extra_environ=auth)
+        result = json.loads(res.body)['result']
+        assert result['total'] == 2
+        assert result['records'] == [self.expected_records[0]]
+
+        next_link = urlparse.urlparse(result['_links']['next'])
+        data['cursor'] = urlparse.parse_qs(next_link.query)['cursor'][0]
+        postparams = '%s=1' % json.dumps(data)
+        res = self.app.post('/api/action/datastore_search', params=postparams,
+                            extra_environ=auth)
+        result = json.loads(res.body)['result']
+        assert result['records'] == []
+        assert 'next' not in result['_links']
+
+        data['cursor'] = 'bad'
+        postparams = '%s=1' % json.dumps(data)
+        res = self.app.post('/api/action/datastore_search', params=postparams,
+                            extra_environ=auth, status=409)
+        res_dict = json.loads(res.body)
+        assert res_dict['success'] is False
+
+    def test_search_total(self):
+        auth = {'Authorization': str(self.sysadmin_user.apikey)}
+        data = {'resource_id': self.data['resource_id'],
+                'include_total': False}
+        postparams = '%s=1' % json.dumps(data)
+        res = self.app.post('/api/action/datastore_search', params=postparams,
+                            extra_environ=auth)
+        result = json.loads(res.body)['result']
+        assert 'total' not in result
+        assert result['records'] == self.expected_records
+
+        data = {'resource_id': self.data['resource_id'],
+                'estimate_total': True}
+        postparams = '%s=1' % json.dumps(data)
+        res = self.app.post('/api/action/datastore_search', params=postparams,
+                            extra_environ=auth)
+        result = json.loads(res.body)['result']
+        assert result['total_was_estimated'] is True
+        assert isinstance(result['total'], int)
+
     def test_search_invalid_offset(self):
         data = {'resource_id': self.data['resource_id'],
                 'offset': 'bad'}
@@ -408,6 +502,72 @@ class TestDatastoreFullTextSearch(tests.WsgiAppCase):
         assert res_dict['result']['total'] == 5, pprint.pformat(res_dict)
 
 
+class TestDatastoreSearchMetadataCache(tests.WsgiAppCase):
+    sysadmin_user = None
+
+    @classmethod
+    def setup_class(cls):
+        if not tests.is_datastore_supported():
+            raise nose.SkipTest("Datastore not supported")
+        p.load('datastore')
+        ctd.CreateTestData.create()
+        cls.sysadmin_user = model.User.get('testsysadmin')
+        cls.resource_id = model.Package.get('annakarenina').resources[0].id
+        import pylons
+        engine = db._get_engine(
+                None,
+                {'connection_url': pylons.config['ckan.datastore.write_url']}
+            )
+        cls.Session = orm.scoped_session(orm.sessionmaker(bind=engine))
+
+    @classmethod
+    def teardown_class(cls):
+        rebuild_all_dbs(cls.Session)
+        p.unload('datastore')
+
+    def _action(self, action, data, status=200):
+        postparams = '%s=1' % json.dumps(data)
+        auth = {'Authorization': str(self.sysadmin_user.apikey)}
+        res = self.app.post('/api/action/' + action, params=postparams,
+                            extra_environ=auth, status=status)
+        return json.loads(res.body)
+
+    def test_cache_is_invalidated(self):
+        self._action('datastore_create', {
+            'resource_id': self.resource_id,
+            'records': [{'book': 'annakarenina'}]})
+        res_dict = self._action('datastore_search',
+                                {'resource_id': self.resource_id})
+        assert [f['id'] for f in res_dict['result']['fields']] == \
+            ['_id', 'book']
+        assert self.resource_id in db._table_metadata_cache
+
+        # adding a field
+        self._action('datastore_create', {
+            'resource_id': self.resource_id,
+            'records': [{'book': 'warandpeace', 'author': 'tolstoy'}]})
+        res_dict = self._action('datastore_search',
+                                {'resource_id': self.resource_id})
+        assert [f['id'] for f in res_dict['result']['fields']] == \
+            ['_id', 'book', 'author']
+
+        # changes made by other processes are noticed through the version
+        db._table_metadata_cache[self.resource_id]['fields'] = []
+        c = self.Session.connection()
+        c.execute(u'UPDATE "{0}" SET version = version + 1 WHERE name = %s'
+                  .format(db._METADATA_VERSION_TABLE), self.resource_id)
+        self.Session.commit()
+        res_dict = self._action('datastore_search',
+                                {'resource_id': self.resource_id})
+        assert [f['id'] for f in res_dict['result']['fields']] == \
+            ['_id', 'book', 'author']
+
+        # deleting the table
+        self._action('datastore_delete', {'resource_id': self.resource_id})
+        self._action('datastore_search', {'resource_id': self.resource_id},
+                     status=404)
+
+
 class TestDatastoreSQL(tests.WsgiAppCase):
     sysadmin_user = None
     normal_user = None
@@ -541,3 +701,53 @@ class TestDatastoreSQL(tests.WsgiAppCase):
         assert res_dict['success'] is True
         result = res_dict['result']
         assert result['records'] == self.expected_join_results
+
+    def test_is_select(self):
+        for sql in ['SELECT * FROM footable', ' select 1',
+                    'WITH a AS (SELECT 1) SELECT * FROM a', 'VALUES (1)']:
+            assert db._is_select(sql) is True
+        for sql in ['EXPLAIN SELECT 1', 'SHOW statement_timeout',
+                    'SELECTED']:
+            assert db._is_select(sql) is False
+
+    def test_select_max_rows(self):
+        import pylons
+        query = 'SELECT "_id" FROM "{0}" ORDER BY "_id"'.format(
+            self.data['resource_id'])
+        postparams = json.dumps({'sql': query})
+        auth = {'Authorization': str(self.sysadmin_user.apikey)}
+        pylons.config['ckan.datastore.search_sql.max_rows'] = '1'
+        try:
+            res = self.app.post('/api/action/datastore_search_sql',
+                                params=postparams, extra_environ=auth)
+        finally:
+            del pylons.config['ckan.datastore.search_sql.max_rows']
+        result = json.loads(res.body)['result']
+        assert result['records'] == [{u'_id': 1}], result['records']
+        assert result['records_truncated'] is True
+
+        res = self.app.post('/api/action/datastore_search_sql',
+                            params=postparams, extra_environ=auth)
+        result = json.loads(res.body)['result']
+        assert len(result['records']) == 2
+        assert 'records_truncated' not in result
+
+    def test_select_max_cost(self):
+        import pylons
+        query = '''SELECT a._id FROM "{0}" AS a, "{0}" AS b,
+                   generate_series(1, 1000000)'''.format(
+            self.data['resource_id'])
+        postparams = json.dumps({'sql': query})
+        auth = {'Authorization': str(self.sysadmin_user.apikey)}
+        for option in ['max_cost', 'max_estimated_rows']:
+            key = 'ckan.datastore.search_sql.' + option
+            pylons.config[key] = '1000'
+            try:
+                res = self.app.post('/api/action/datastore_search_sql',
+                                    params=postparams, extra_environ=auth,
+                                    status=409)
+            finally:
+                del pylons.config[key]
+            res_dict = json.loads(res.body)
+            assert res_dict['success'] is False
+            assert 'query' in res_dict['error'], res_dict['error']
@@ -61,3 +61,86 @@ class TestTypeGetters(unittest.TestCase):
         connection = engine.connect()
         assert db._pg_version_is_at_least(connection, '8.0')
         assert not db._pg_version_is_at_least(connection, '10.0')
+
+    def test_pg_version_cached(self):
+        class Engine(object):
+            url = 'postgresql://localhost/cached_version'
+
+        class Results(object):
+            def fetchone(self):
+                return ('PostgreSQL 9.5.3 on x86_64-pc-linux-gnu',)
+
+        class Connection(object):
+            engine = Engine()
+            queries = 0
+
+            def execute(self, sql):
+                self.queries += 1
+                return Results()
+
+        connection = Connection()
+        try:
+            assert db._pg_version_is_at_least(connection, '9.5')
+            assert not db._pg_version_is_at_least(connection, '9.6')
+            assert connection.queries == 1, connection.queries
+        finally:
+            db._pg_versions.pop('postgresql://localhost/cached_version')
+
+    def test_copy_value(self):
+        assert db._copy_value(None, 'text') == '\\N'
+        assert db._copy_value(u'foo', 'text') == u'foo'
+        assert db._copy_value(u'a\tb\nc\\d', 'text') == u'a\\tb\\nc\\\\d'
+        assert db._copy_value(42, 'int4') == u'42'
+        assert db._copy_value(0.1, 'float8') == u'0.1'
+        assert db._copy_value(True, 'bool') == u'true'
+        assert db._copy_value([u'a', None, u'b"c'], '_text') == \
+            u'{"a",NULL,"b\\\\"c"}'
+        assert db._copy_value({u'a': 1}, 'nested') == u'("{""a"": 1}","")'
+
+    def test_converters(self):
+        import datetime
+        import decimal
+        values = [
+            (None, 'text'),
+            (u'foo', 'text'),
+            (1, 'int4'),
+            (2L, 'int8'),
+            (1.5, 'float8'),
+            (True, 'bool'),
+            (decimal.Decimal('1.50'), 'numeric'),
+            (datetime.datetime(2013, 1, 2, 3, 4, 5), 'timestamp'),
+            (datetime.date(2013, 1, 2), 'date'),
+            (('{"a": [1, 2]}', ''), 'nested'),
+            ([u'a', None], '_text'),
+            ([('[1]', '')], '_nested'),
+        ]
+        for value, type_name in values:
+            converted = db.convert(value, type_name)
+            if value is not None:
+                assert db._get_converter(type_name)(value) == converted
+        assert db.convert(decimal.Decimal('1.50'), 'numeric') == u'1.50'
+        assert db.convert(2L, 'int8') == u'2'
+        assert db.convert([('[1]', '')], '_nested') == [[1]]
+        assert db.convert(datetime.datetime(2013, 1, 2, 3, 4, 5),
+                          'timestamp') == u'2013-01-02T03:04:05'
+
+    def test_guess_types(self):
+        records = [{'int': 1, 'float': 1, 'integer': '1', 'numeric': '1',
+                    'date': '2013-01-02', 'text': '1', 'nested': 'a',
+                    'big': 1, 'null': None, 'bool': True},
+                   {'int': None, 'float': 1.5, 'integer': 2, 'numeric': '1.5',
+                    'date': '02/01/2013', 'text': 'a', 'nested': [1],
+                    'big': '9999999999', 'bool': False},
+                   {'int': -3, 'integer': ' 3 ', 'numeric': '1e3',
+                    'date': '2013-01-02T03:04:05', 'text': '2013-01-02',
+                    'nested': {'a': 1}, 'big': 2}]
+        field_ids = ['int', 'float', 'integer', 'numeric', 'date', 'text',
+                     'nested', 'big', 'null', 'bool', 'missing']
+        assert db._guess_types(records, field_ids) == {
+            'int': 'int', 'float': 'float', 'integer': 'integer',
+            'numeric': 'numeric', 'date': 'timestamp', 'text': 'text',
+            'nested': 'nested', 'big': 'bigint', 'null': 'text',
+            'bool': 'bool', 'missing': None}
+
+        assert db._guess_types([{'a': '2013-13-01'}], ['a']) == {'a': 'text'}
+        assert db._guess_types([{'a': 2 ** 70}], ['a']) == {'a': 'numeric'}
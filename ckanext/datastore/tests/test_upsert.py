@@ -208,6 +208,34 @@ class TestDatastoreUpsert(tests.WsgiAppCase):
 
         assert res_dict['success'] is True
 
+    def test_upsert_batch(self):
+        # records with repeated keys and different fields are applied in
+        # order, as if they were upserted one by one
+        data = {
+            'resource_id': self.data['resource_id'],
+            'method': 'upsert',
+            'records': [{u'b\xfck': 'dune', 'author': 'herbert'},
+                        {u'b\xfck': 'dune', 'author': 'frank herbert'},
+                        {u'b\xfck': 'dune', 'published': '1965-08-01'}]
+        }
+
+        postparams = '%s=1' % json.dumps(data)
+        auth = {'Authorization': str(self.sysadmin_user.apikey)}
+        res = self.app.post('/api/action/datastore_upsert', params=postparams,
+                            extra_environ=auth)
+        res_dict = json.loads(res.body)
+
+        assert res_dict['success'] is True
+
+        c = self.Session.connection()
+        results = c.execute(u'select * from "{0}" where "b\xfck" = \'dune\''
+                            .format(self.data['resource_id']))
+        assert results.rowcount == 1
+        record = results.fetchone()
+        assert record.author == 'frank herbert'
+        assert record.published == datetime.datetime(1965, 8, 1)
+        self.Session.remove()
+
     def test_upsert_missing_key(self):
         data = {
             'resource_id': self.data['resource_id'],
@@ -1,98 +1,125 @@
-import sets
 import ckan
 from ckan.plugins import SingletonPlugin, implements, IPackageController
 from ckan.plugins import IGroupController, ITagController
 import pylons
-import ckan.logic.action.get as action_get
+import ckan.lib.term_translation as term_translation
 from pylons import config
 
 LANGS = ['en', 'fr', 'de', 'es', 'it', 'nl', 'ro', 'pt', 'pl']
 
-def translate_data_dict(data_dict):
-    '''Return the given dict (e.g. a dataset dict) with as many of its fields
-    as possible translated into the desired or the fallback language.
+def _request_lang_code():
+    '''Return the language code of the current request, or None when not
+    handling a request (e.g. when the actions are called from paster).'''
+    try:
+        return pylons.request.environ.get('CKAN_LANG')
+    except TypeError:
+        # request not registered
+        return None
 
-    '''
-    desired_lang_code = pylons.request.environ['CKAN_LANG']
+
+def _lang_codes():
+    '''Return the codes of the desired and the fallback languages.'''
     fallback_lang_code = pylons.config.get('ckan.locale_default', 'en')
+    desired_lang_code = _request_lang_code() or fallback_lang_code
+    return desired_lang_code, fallback_lang_code
 
-    # Get a flattened copy of data_dict to do the translation on.
-    flattened = ckan.lib.navl.dictization_functions.flatten_dict(
-            data_dict)
 
-    # Get a simple flat list of all the terms to be translated, from the
-    # flattened data dict.
-    terms = sets.Set()
+def _translate(term, translations, desired_lang_code, fallback_lang_code):
+    '''Return the translation of term into the desired or the fallback
+    language, or term itself if it has no translation.'''
+    if (term, desired_lang_code) in translations:
+        return translations[(term, desired_lang_code)]
+    return translations.get((term, fallback_lang_code), term)
+
+
+def _flattened_terms(flattened):
+    '''Return the terms to be translated of a flattened data dict.'''
+    terms = set()
     for (key, value) in flattened.items():
         if value in (None, True, False):
             continue
         elif isinstance(value, basestring):
             terms.add(value)
-        elif isinstance(value, (int, long)):
+        elif isinstance(value, (int, long, dict)):
             continue
         else:
             for item in value:
                 terms.add(item)
+    return terms
 
-    # Get the translations of all the terms (as a list of dictionaries).
-    translations = ckan.logic.action.get.term_translation_show(
-            {'model': ckan.model},
-            {'terms': terms,
-                'lang_codes': (desired_lang_code, fallback_lang_code)})
-
-    # Transform the translations into a more convenient structure.
-    desired_translations = {}
-    fallback_translations = {}
-    for translation in translations:
-        if translation['lang_code'] == desired_lang_code:
-            desired_translations[translation['term']] = (
-                    translation['term_translation'])
-        else:
-            assert translation['lang_code'] == fallback_lang_code
-            fallback_translations[translation['term']] = (
-                    translation['term_translation'])
 
-    # Make a copy of the flattened data dict with all the terms replaced by
-    # their translations, where available.
-    translated_flattened = {}
-    for (key, value) in flattened.items():
+def _data_dicts_terms(data_dicts):
+    terms = set()
+    for data_dict in data_dicts:
+        terms.update(_flattened_terms(
+            ckan.lib.navl.dictization_functions.flatten_dict(data_dict)))
+    return terms
 
-        # Don't translate names that are used for form URLs.
-        if key == ('name',):
-            translated_flattened[key] = value
-        elif (key[0] in ('tags', 'groups') and len(key) == 3
-                and key[2] == 'name'):
-            translated_flattened[key] = value
 
-        elif value in (None, True, False):
-            # Don't try to translate values that aren't strings.
-            translated_flattened[key] = value
+def translate_data_dicts(data_dicts):
+    '''Return the given dicts (e.g. dataset dicts) with as many of their
+    fields as possible translated into the desired or the fallback language.
+
+    The translations of all the dicts are looked up at once.
+
+    '''
+    desired_lang_code, fallback_lang_code = _lang_codes()
+
+    # Get flattened copies of the data dicts to do the translation on.
+    flattened_dicts = [ckan.lib.navl.dictization_functions.flatten_dict(
+            data_dict) for data_dict in data_dicts]
+
+    # Get the translations of all the terms of all the dicts, by (term,
+    # lang_code).
+    terms = set()
+    for flattened in flattened_dicts:
+        terms.update(_flattened_terms(flattened))
+    translations = term_translation.get_translations(terms,
+            (desired_lang_code, fallback_lang_code))
+
+    translated_data_dicts = []
+    for flattened in flattened_dicts:
+
+        # Make a copy of the flattened data dict with all the terms replaced
+        # by their translations, where available.
+        translated_flattened = {}
+        for (key, value) in flattened.items():
+
+            # Don't translate names that are used for form URLs.
+            if key == ('name',):
+                translated_flattened[key] = value
+            elif (key[0] in ('tags', 'groups') and len(key) == 3
+                    and key[2] == 'name'):
+                translated_flattened[key] = value
+
+            elif value in (None, True, False):
+                # Don't try to translate values that aren't strings.
+                translated_flattened[key] = value
+
+            elif isinstance(value, basestring):
+                translated_flattened[key] = _translate(value, translations,
+                        desired_lang_code, fallback_lang_code)
+
+            elif isinstance(value, (int, long, dict)):
+                translated_flattened[key] = value
 
-        elif isinstance(value, basestring):
-            if value in desired_translations:
-                translated_flattened[key] = desired_translations[value]
             else:
-                translated_flattened[key] = fallback_translations.get(
-                        value, value)
+                translated_flattened[key] = [_translate(item, translations,
+                        desired_lang_code, fallback_lang_code)
+                        for item in value]
 
-        elif isinstance(value, (int, long, dict)):
-            translated_flattened[key] = value
+        # Finally unflatten the translated data dict.
+        translated_data_dicts.append(ckan.lib.navl.dictization_functions
+                .unflatten(translated_flattened))
+    return translated_data_dicts
 
-        else:
-            translated_value = []
-            for item in value:
-                if item in desired_translations:
-                    translated_value.append(desired_translations[item])
-                else:
-                    translated_value.append(
-                        fallback_translations.get(item, item)
-                    )
-            translated_flattened[key] = translated_value
-
-    # Finally unflatten and return the translated data dict.
-    translated_data_dict = (ckan.lib.navl.dictization_functions
-            .unflatten(translated_flattened))
-    return translated_data_dict
+
+def translate_data_dict(data_dict):
+    '''Return the given dict (e.g. a dataset dict) with as many of its fields
+    as possible translated into the desired or the fallback language.
+
+    '''
+    return translate_data_dicts([data_dict])[0]
 
 KEYS_TO_IGNORE = ['state', 'revision_id', 'id', #title done seperately
                   'metadata_created', 'metadata_modified', 'site_id']
@@ -107,19 +134,9 @@ class MultilingualDataset(SingletonPlugin):
              pylons.config.get('ckan.locale_default', 'en')
         )
 
-        ## translate title
         title = search_data.get('title')
         search_data['title_' + default_lang] = title 
-        title_translations = action_get.term_translation_show(
-                          {'model': ckan.model},
-                          {'terms': [title],
-                              'lang_codes': LANGS})
-
-        for translation in title_translations:
-            title_field = 'title_' + translation['lang_code']
-            search_data[title_field] = translation['term_translation']
 
-        ## translate rest
         all_terms = []
         for key, value in search_data.iteritems():
             if key in KEYS_TO_IGNORE or key.startswith('title'):
@@ -130,18 +147,26 @@ class MultilingualDataset(SingletonPlugin):
                 if isinstance(item, basestring):
                     all_terms.append(item)
 
-        field_translations = action_get.term_translation_show(
-                          {'model': ckan.model},
-                          {'terms': all_terms,
-                              'lang_codes': LANGS})
+        # Look up the translations of the title and of the rest at once.
+        all_terms_set = set(all_terms)
+        terms = set(all_terms_set)
+        if title:
+            terms.add(title)
+        translations = term_translation.get_translations(terms, LANGS)
+
+        ## translate title
+        for lang in LANGS:
+            if (title, lang) in translations:
+                search_data['title_' + lang] = translations[(title, lang)]
 
+        ## translate rest
         text_field_items = dict(('text_' + lang, []) for lang in LANGS)
         
         text_field_items['text_' + default_lang].extend(all_terms)
 
-        for translation in sorted(field_translations):
-            lang_field = 'text_' + translation['lang_code']
-            text_field_items[lang_field].append(translation['term_translation'])
+        for (term, lang), translation in sorted(translations.items()):
+            if term in all_terms_set:
+                text_field_items['text_' + lang].append(translation)
 
         for key, value in text_field_items.iteritems():
             search_data[key] = ' '.join(value)
@@ -172,40 +197,31 @@ class MultilingualDataset(SingletonPlugin):
 
     def after_search(self, search_results, search_params):
 
-        # Translate the unselected search facets.
-        facets = search_results.get('search_facets')
-        if not facets:
+        # Nothing is displayed when searching outside of a request.
+        if not _request_lang_code():
             return search_results
+        desired_lang_code, fallback_lang_code = _lang_codes()
 
-        desired_lang_code = pylons.request.environ['CKAN_LANG']
-        fallback_lang_code = pylons.config.get('ckan.locale_default', 'en')
+        # The results are only translated by before_view if they are viewed,
+        # which looks up the translations of all of them at once.
+        pylons.c.multilingual_search_results = search_results.get(
+            'results', [])
 
-        # Look up translations for all of the facets in one db query.
-        terms = sets.Set()
+        # Translate the unselected search facets, looking up translations
+        # for all of them in one db query.
+        facets = search_results.get('search_facets')
+        if not facets:
+            return search_results
+        terms = set()
         for facet in facets.values():
             for item in facet['items']:
                 terms.add(item['display_name'])
-        translations = ckan.logic.action.get.term_translation_show(
-                {'model': ckan.model},
-                {'terms': terms,
-                    'lang_codes': (desired_lang_code, fallback_lang_code)})
-
-        # Replace facet display names with translated ones.
+        translations = term_translation.get_translations(terms,
+                (desired_lang_code, fallback_lang_code))
         for facet in facets.values():
             for item in facet['items']:
-                matching_translations = [translation for
-                        translation in translations
-                        if translation['term'] == item['display_name']
-                        and translation['lang_code'] == desired_lang_code]
-                if not matching_translations:
-                    matching_translations = [translation for
-                            translation in translations
-                            if translation['term'] == item['display_name']
-                            and translation['lang_code'] == fallback_lang_code]
-                if matching_translations:
-                    assert len(matching_translations) == 1
-                    item['display_name'] = (
-                        matching_translations[0]['term_translation'])
+                item['display_name'] = _translate(item['display_name'],
+                        translations, desired_lang_code, fallback_lang_code)
 
         return search_results
 
@@ -217,26 +233,27 @@ class MultilingualDataset(SingletonPlugin):
         # and save them in c.translated_fields where the templates can
         # retrieve them later.
         c = pylons.c
-        desired_lang_code = pylons.request.environ['CKAN_LANG']
-        fallback_lang_code = pylons.config.get('ckan.locale_default', 'en')
+        desired_lang_code, fallback_lang_code = _lang_codes()
+
+        # Cache the translations of all the search results being viewed
+        # when the first one is.
+        search_results = getattr(c, 'multilingual_search_results', None)
+        if search_results and any(result is dataset_dict
+                                  for result in search_results):
+            c.multilingual_search_results = None
+            term_translation.get_translations(
+                    _data_dicts_terms(search_results),
+                    (desired_lang_code, fallback_lang_code))
+
         terms = [value for param, value in c.fields]
-        translations = ckan.logic.action.get.term_translation_show(
-                {'model': ckan.model},
-                {'terms': terms,
-                 'lang_codes': (desired_lang_code, fallback_lang_code)})
+        translations = term_translation.get_translations(terms,
+                (desired_lang_code, fallback_lang_code))
         c.translated_fields = {}
         for param, value in c.fields:
-            matching_translations = [translation for translation in
-                    translations if translation['term'] == value and
-                    translation['lang_code'] == desired_lang_code]
-            if not matching_translations:
-                matching_translations = [translation for translation in
-                        translations if translation['term'] == value and
-                        translation['lang_code'] == fallback_lang_code]
-            if matching_translations:
-                assert len(matching_translations) == 1
-                translation = matching_translations[0]['term_translation']
-                c.translated_fields[(param, value)] = translation
+            if ((value, desired_lang_code) in translations
+                    or (value, fallback_lang_code) in translations):
+                c.translated_fields[(param, value)] = _translate(value,
+                        translations, desired_lang_code, fallback_lang_code)
 
         # Now translate the fields of the dataset itself.
         return translate_data_dict(dataset_dict)
@@ -1,6 +1,9 @@
+import json
+
 import ckan.plugins
 import ckanext.multilingual.plugin as mulilingual_plugin
 import ckan.lib.helpers
+import ckan.lib.term_translation as term_translation
 import ckan.lib.create_test_data
 import ckan.logic.action.update
 import ckan.tests
@@ -197,6 +200,25 @@ class TestDatasetTermTranslation(ckan.tests.html_check.HtmlCheckMethods):
                 assert '/%s/dataset?groups=%s' % (lang_code, group_name) in response
             assert 'this should not be rendered' not in response
 
+    def test_api_search_translates_facets_only(self):
+        looked_up = []
+        get_translations = term_translation.get_translations
+
+        def recording_get_translations(terms, lang_codes):
+            looked_up.extend(terms)
+            return get_translations(terms, lang_codes)
+        term_translation.get_translations = recording_get_translations
+        try:
+            response = self.app.post('/api/action/package_search',
+                    params='%s=1' % json.dumps({'q': 'name:annakarenina',
+                                                'facet.field': ['tags']}))
+        finally:
+            term_translation.get_translations = get_translations
+        result = json.loads(response.body)['result']
+        assert result['results'][0]['title'] == 'A Novel By Tolstoy', result
+        assert 'russian' in looked_up, looked_up
+        assert 'A Novel By Tolstoy' not in looked_up, looked_up
+
     def test_group_index_translation(self):
         for (lang_code, translations) in (
                 ('de', ckan.lib.create_test_data.german_translations),
@@ -326,3 +348,27 @@ class TestDatasetSearchIndex():
                           'text_pt': '',
                           'title_fr': u'french david',
                           'text_fr': u'french note french boon french_moo french moon'}, result
+
+    def test_after_search_outside_request(self):
+        # e.g. package_search called from paster, nothing to translate
+        search_results = {
+            'count': 1,
+            'results': [{'name': u'annakarenina', 'notes': u'moo'}],
+            'search_facets': {'tags': {'items': [
+                {'name': u'moon', 'display_name': u'moon', 'count': 1}]}},
+        }
+        result = mulilingual_plugin.MultilingualDataset().after_search(
+            search_results, {})
+        assert result['search_facets']['tags']['items'][0]['display_name'] \
+            == u'moon', result
+
+    def test_translate_data_dict_outside_request(self):
+        # translated into the default locale
+        default_locale = pylons.config.get('ckan.locale_default')
+        pylons.config['ckan.locale_default'] = 'fr'
+        try:
+            result = mulilingual_plugin.translate_data_dict(
+                {'name': u'moo', 'notes': u'moo'})
+        finally:
+            pylons.config['ckan.locale_default'] = default_locale
+        assert result == {'name': u'moo', 'notes': u'french_moo'}, result
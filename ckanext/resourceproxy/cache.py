@@ -0,0 +1,170 @@
+'''
+On-disk cache of the bodies of proxied resources.
+
+Each body is stored in a file named after its URL, after a first line with
+the URL, the response headers and the validators (ETag and Last-Modified)
+used to check with the remote server that it hasn't changed. When the total
+size of the files is over the limit, the least recently used ones are
+deleted.
+'''
+import os
+import json
+import errno
+import hashlib
+import logging
+import tempfile
+
+log = logging.getLogger(__name__)
+
+CACHE_SUFFIX = '.cache'
+
+
+class CachedResponse(object):
+    '''A cached body and the headers it was sent with.
+
+    The file of the body is kept open, so that the body can still be sent
+    if the file is evicted or replaced in the meantime.
+    '''
+
+    def __init__(self, path, body_file, meta):
+        self.path = path
+        self.url = meta['url']
+        self.headers = meta['headers']
+        self.etag = meta.get('etag')
+        self.last_modified = meta.get('last_modified')
+        self._file = body_file
+
+    def validators(self):
+        '''Return the headers of a conditional request for the same URL.'''
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def iter_body(self, chunk_size):
+        '''Yield the cached body, and close its file.'''
+        try:
+            # the modification time of the files is their last use
+            os.utime(self.path, None)
+        except OSError:
+            pass
+        try:
+            while True:
+                chunk = self._file.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        self._file.close()
+
+
+class CacheEntry(object):
+    '''A body being added to the cache, written to a temporary file which
+    only replaces the cached one once complete.'''
+
+    def __init__(self, cache, url, headers, etag=None, last_modified=None):
+        self.cache = cache
+        self.path = cache.path(url)
+        fd, self.tmp_path = tempfile.mkstemp(dir=cache.directory,
+                                             suffix='.tmp')
+        self._file = os.fdopen(fd, 'wb')
+        meta = {'url': url, 'headers': headers, 'etag': etag,
+                'last_modified': last_modified}
+        self._file.write(json.dumps(meta) + '\n')
+
+    def write(self, chunk):
+        self._file.write(chunk)
+
+    def commit(self):
+        self._file.close()
+        os.rename(self.tmp_path, self.path)
+        self.cache.evict()
+
+    def discard(self):
+        self._file.close()
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+
+class ProxyCache(object):
+    '''
+    Cache of proxied bodies in a directory, limited to max_size bytes.
+
+    Several processes can share the same directory: the files are replaced
+    atomically.
+    '''
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        try:
+            os.makedirs(directory)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def path(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    def get(self, url):
+        '''Return the CachedResponse of the given URL, or None if it isn't
+        cached.
+
+        The file of the body is opened, so the CachedResponse must be closed
+        if its body isn't read.
+        '''
+        path = self.path(url)
+        try:
+            body_file = open(path, 'rb')
+        except IOError:
+            return None
+        try:
+            meta = json.loads(body_file.readline())
+        except ValueError:
+            meta = None
+        if not meta or meta.get('url') != url:
+            body_file.close()
+            return None
+        return CachedResponse(path, body_file, meta)
+
+    def add(self, url, headers, etag=None, last_modified=None):
+        '''Return a CacheEntry to write the body of the given URL to, or None
+        if the cache directory is not writable.'''
+        try:
+            return CacheEntry(self, url, headers, etag, last_modified)
+        except (IOError, OSError), e:
+            log.warning('Could not cache {0}: {1}'.format(url, e))
+            return None
+
+    def evict(self):
+        '''Delete the least recently used files until the total size of the
+        cache is under the limit.'''
+        files = []
+        total_size = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(CACHE_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total_size += stat.st_size
+        files.sort()
+        for mtime, size, path in files:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= size
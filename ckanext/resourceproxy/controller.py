@@ -1,14 +1,93 @@
 from logging import getLogger
+import cookielib
 
 import requests
+from pylons import config
 
 import ckan.logic as logic
 import ckan.lib.base as base
+import ckanext.resourceproxy.cache as proxy_cache
 
 log = getLogger(__name__)
 
 MAX_FILE_SIZE = 1024 * 1024 * 2  # 2MB
-CHUNK_SIZE = 256
+CHUNK_SIZE = 16 * 1024
+# Default number of seconds to wait for the remote server to accept the
+# connection or to send data
+DEFAULT_TIMEOUT = 30
+# Default maximum total size of the cached bodies
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 100  # 100MB
+
+# Headers of the remote responses which are not passed on to the client:
+# the hop-by-hop ones, the cookies of the remote server, and the encoding
+# of the body, which is decoded while it is proxied
+EXCLUDED_HEADERS = set(['connection', 'keep-alive', 'proxy-authenticate',
+                        'proxy-authorization', 'te', 'trailers',
+                        'transfer-encoding', 'upgrade', 'set-cookie',
+                        'content-encoding'])
+
+
+def _make_session():
+    session = requests.Session()
+    # don't send the cookies set by a remote server when proxying for
+    # other users
+    session.cookies.set_policy(
+        cookielib.DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+# Kept between requests so that the connections to the remote servers are
+# reused
+_session = _make_session()
+
+_caches = {}
+
+
+def _get_cache():
+    '''Return the cache of proxied bodies, or None if it isn't enabled.'''
+    directory = config.get('ckan.resource_proxy.cache_dir')
+    if not directory:
+        return None
+    if directory not in _caches:
+        max_size = int(config.get('ckan.resource_proxy.cache_size',
+                                  DEFAULT_CACHE_SIZE))
+        _caches[directory] = proxy_cache.ProxyCache(directory, max_size)
+    return _caches[directory]
+
+
+def _proxied_headers(headers):
+    proxied = dict((name, value) for name, value in headers.items()
+                   if name.lower() not in EXCLUDED_HEADERS)
+    if 'content-encoding' in headers:
+        # the length of the decoded body is not known
+        proxied = dict((name, value) for name, value in proxied.items()
+                       if name.lower() != 'content-length')
+    return proxied
+
+
+def _stream(r, cache_entry=None):
+    '''Yield the body of the remote response as it is received, adding it
+    to the cache if cache_entry is given.'''
+    length = 0
+    try:
+        for chunk in r.iter_content(chunk_size=CHUNK_SIZE,
+                                    decode_unicode=False):
+            length += len(chunk)
+            if length > MAX_FILE_SIZE:
+                # the response has started, so it can only be cut short
+                log.warning('Stopped proxying {0} after {1} bytes'.format(
+                    r.url, MAX_FILE_SIZE))
+                return
+            if cache_entry:
+                cache_entry.write(chunk)
+            yield chunk
+        # the connection can be reused once the body has been read
+        r.raw.release_conn()
+        if cache_entry:
+            cache_entry.commit()
+            cache_entry = None
+    finally:
+        if cache_entry:
+            cache_entry.discard()
 
 
 def proxy_resource(context, data_dict):
@@ -17,12 +96,30 @@ def proxy_resource(context, data_dict):
         resource = logic.get_action('resource_show')(context, {'id': resource_id})
         url = resource['url']
 
+        cache = _get_cache()
+        cached = cache.get(url) if cache else None
+        timeout = float(config.get('ckan.resource_proxy.timeout',
+                                   DEFAULT_TIMEOUT))
+
         try:
-            r = requests.get(url)
+            try:
+                r = _session.get(url, stream=True, timeout=timeout,
+                                 headers=cached.validators() if cached
+                                 else None)
+            except Exception:
+                if cached:
+                    cached.close()
+                raise
+            if cached:
+                if r.status_code == 304:
+                    r.raw.release_conn()
+                    for name, value in cached.headers.items():
+                        base.response.headers[name] = value
+                    return cached.iter_body(CHUNK_SIZE)
+                cached.close()
             r.raise_for_status()
 
-            # write body
-            cl = r.headers['content-length']
+            cl = r.headers.get('content-length')
             if cl and int(cl) > MAX_FILE_SIZE:
                 base.abort(500, '''Content is too large to be proxied.
                     Allowed file size: {allowed}.
@@ -30,20 +127,17 @@ def proxy_resource(context, data_dict):
                         allowed=MAX_FILE_SIZE, actual=cl))
 
             # write headers
-            base.response.headers = r.headers
-
-            # we have to pretend that the response is not gzipped or deflated
-            # because we don't want request to unzip the content.
-            r.headers['content-encoding'] = ''
-
-            length = 0
-            for chunk in r.iter_content(chunk_size=CHUNK_SIZE, decode_unicode=False):
-                base.response.body_file.write(chunk)
-                length += len(chunk)
+            headers = _proxied_headers(r.headers)
+            for name, value in headers.items():
+                base.response.headers[name] = value
 
-                if length >= MAX_FILE_SIZE:
-                    base.abort(500, headers={'content-encoding': ''},
-                        detail='Content is too large to be proxied.')
+            # only the bodies which can be revalidated are cached
+            cache_entry = None
+            etag = r.headers.get('etag')
+            last_modified = r.headers.get('last-modified')
+            if cache and (etag or last_modified):
+                cache_entry = cache.add(url, headers, etag, last_modified)
+            return _stream(r, cache_entry)
 
         except requests.exceptions.HTTPError, error:
             details = 'Could not proxy resource. %s' % str(error.response.reason)
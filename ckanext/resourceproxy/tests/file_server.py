@@ -6,6 +6,9 @@ from threading import Thread
 
 PORT = 50001
 
+# Paths of the requests answered with 304 Not Modified
+not_modified = []
+
 
 class StaticHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
     def send_head(self):
@@ -16,9 +19,31 @@ class StaticHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
             self.send_header("Content-Length", '1000000000')
             self.end_headers()
             return f
+        elif 'cached' in self.path:
+            return self.send_head_with_etag()
         else:
             return SimpleHTTPServer.SimpleHTTPRequestHandler.send_head(self)
 
+    def send_head_with_etag(self):
+        '''Serve a file with an ETag made of its modification time and size,
+        answering the conditional requests with the same ETag with 304.'''
+        path = self.translate_path(self.path)
+        stat = os.stat(path)
+        etag = '"{0}-{1}"'.format(int(stat.st_mtime), stat.st_size)
+        if self.headers.get('If-None-Match') == etag:
+            not_modified.append(self.path)
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return None
+        f = open(path, 'rb')
+        self.send_response(200)
+        self.send_header("Content-type", 'text/plain')
+        self.send_header("Content-Length", str(stat.st_size))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        return f
+
     def log_message(self, *args):
         pass
 
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+
+from nose.tools import assert_equal
+
+import ckanext.resourceproxy.cache as proxy_cache
+
+
+class TestProxyCache(object):
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = proxy_cache.ProxyCache(self.directory, 1000)
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def _add(self, url, body, etag='"1"'):
+        entry = self.cache.add(url, {'Content-Type': 'text/plain'}, etag=etag)
+        entry.write(body)
+        entry.commit()
+
+    def test_get(self):
+        url = u'http://example.com/data.csv'
+        assert self.cache.get(url) is None
+        self._add(url, 'a,b\n1,2\n')
+        cached = self.cache.get(url)
+        assert_equal(cached.headers, {'Content-Type': 'text/plain'})
+        assert_equal(cached.validators(), {'If-None-Match': '"1"'})
+        assert_equal(''.join(cached.iter_body(3)), 'a,b\n1,2\n')
+
+    def test_evicted_after_get(self):
+        url = u'http://example.com/data.csv'
+        self._add(url, 'a,b\n1,2\n')
+        cached = self.cache.get(url)
+        os.remove(self.cache.path(url))
+        assert_equal(''.join(cached.iter_body(3)), 'a,b\n1,2\n')
+
+    def test_discard(self):
+        url = u'http://example.com/data.csv'
+        self._add(url, 'old')
+        entry = self.cache.add(url, {}, etag='"2"')
+        entry.write('new but incomplete')
+        entry.discard()
+        assert_equal(''.join(self.cache.get(url).iter_body(100)), 'old')
+        assert_equal(len(os.listdir(self.directory)), 1)
+
+    def test_evict_least_recently_used(self):
+        urls = [u'http://example.com/{0}'.format(num) for num in range(3)]
+        for num, url in enumerate(urls):
+            self._add(url, 'x' * 200)
+            # use the files in a different order than they were added
+            os.utime(self.cache.path(url), (0, [2, 1, 3][num]))
+        self._add(u'http://example.com/new', 'x' * 200)
+        assert self.cache.get(urls[1]) is None
+        for url in (urls[0], urls[2], u'http://example.com/new'):
+            cached = self.cache.get(url)
+            assert cached is not None, url
+            cached.close()
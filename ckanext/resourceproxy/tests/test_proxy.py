@@ -1,3 +1,6 @@
+import os
+import shutil
+import tempfile
 import requests
 import unittest
 
@@ -106,3 +109,39 @@ class TestProxyBasic(tests.WsgiAppCase, unittest.TestCase):
         result = self.app.get(proxied_url, status='*')
         assert result.status == 500, result.status
         assert 'connection error' in result.body, result.body
+
+    def _write_static(self, name, body, mtime):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'static', name)
+        with open(path, 'wb') as static_file:
+            static_file.write(body)
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_resource_proxy_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        config['ckan.resource_proxy.cache_dir'] = cache_dir
+        path = self._write_static('cached.txt', 'first', 1000)
+        try:
+            self.set_resource_url('http://0.0.0.0:50001/cached.txt')
+            proxied_url = proxy.get_proxified_resource_url(self.data_dict)
+            result = self.app.get(proxied_url)
+            assert result.body == 'first', result.body
+
+            # changed without changing its ETag, so the remote server
+            # answers 304 and the cached body is sent
+            self._write_static('cached.txt', 'fir5t', 1000)
+            del file_server.not_modified[:]
+            result = self.app.get(proxied_url)
+            assert result.body == 'first', result.body
+            assert file_server.not_modified == ['/cached.txt'], \
+                file_server.not_modified
+
+            # changed, so the remote server sends the new body
+            self._write_static('cached.txt', 'second', 2000)
+            result = self.app.get(proxied_url)
+            assert result.body == 'second', result.body
+        finally:
+            del config['ckan.resource_proxy.cache_dir']
+            os.remove(path)
+            shutil.rmtree(cache_dir)
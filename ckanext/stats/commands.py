@@ -0,0 +1,37 @@
+import logging
+
+import ckan.lib.cli as cli
+
+log = logging.getLogger(__name__)
+
+
+class StatsCommand(cli.CkanCommand):
+    '''Update the weekly dataset statistics shown by the stats extension
+
+    Usage:
+      stats update   - add the revisions made since the last update to the
+                       weekly statistics
+      stats rebuild  - recompute the weekly statistics from the whole
+                       revision history
+    '''
+
+    summary = __doc__.split('\n')[0]
+    usage = __doc__
+    max_args = 1
+    min_args = 1
+
+    def command(self):
+        self._load_config()
+        import ckan.model as model
+        import ckanext.stats.stats as stats_lib
+
+        cmd = self.args[0]
+        if cmd == 'update':
+            num_revisions = stats_lib.WeeklyStats.update()
+        elif cmd == 'rebuild':
+            num_revisions = stats_lib.WeeklyStats.rebuild()
+        else:
+            print 'Command %s not recognized' % cmd
+            return
+        model.repo.commit_and_remove()
+        print 'Counted %i dataset revisions' % num_revisions
@@ -8,37 +8,34 @@ class StatsController(BaseController):
     def index(self):
         c = p.toolkit.c
         stats = stats_lib.Stats()
-        rev_stats = stats_lib.RevisionStats()
         c.top_rated_packages = stats.top_rated_packages()
         c.most_edited_packages = stats.most_edited_packages()
         c.largest_groups = stats.largest_groups()
         c.top_tags = stats.top_tags()
         c.top_package_owners = stats.top_package_owners()
-        c.new_packages_by_week = rev_stats.get_by_week('new_packages')
-        c.deleted_packages_by_week = rev_stats.get_by_week('deleted_packages')
-        c.num_packages_by_week = rev_stats.get_num_packages_by_week()
-        c.package_revisions_by_week = rev_stats.get_by_week('package_revisions')
+        # Kept up to date by the `paster stats update` command, and counted
+        # here the first time
+        c.weekly_stats = stats_lib.WeeklyStats.by_week()
 
         # Used in the legacy CKAN templates.
         c.packages_by_week = []
+        c.all_package_revisions = []
+        c.new_datasets = []
 
         # Used in new CKAN templates gives more control to the templates for formatting.
         c.raw_packages_by_week = []
-        for week_date, num_packages, cumulative_num_packages in c.num_packages_by_week:
-            c.packages_by_week.append('[new Date(%s), %s]' % (week_date.replace('-', ','), cumulative_num_packages))
-            c.raw_packages_by_week.append({'date': h.date_str_to_datetime(week_date), 'total_packages': cumulative_num_packages})
-
-        c.all_package_revisions = []
         c.raw_all_package_revisions = []
-        for week_date, revs, num_revisions, cumulative_num_revisions in c.package_revisions_by_week:
-            c.all_package_revisions.append('[new Date(%s), %s]' % (week_date.replace('-', ','), num_revisions))
-            c.raw_all_package_revisions.append({'date': h.date_str_to_datetime(week_date), 'total_revisions': num_revisions})
-
-        c.new_datasets = []
         c.raw_new_datasets = []
-        for week_date, pkgs, num_packages, cumulative_num_packages in c.new_packages_by_week:
-            c.new_datasets.append('[new Date(%s), %s]' % (week_date.replace('-', ','), num_packages))
-            c.raw_new_datasets.append({'date': h.date_str_to_datetime(week_date), 'new_packages': num_packages})
+
+        for week_date, num_new, num_deleted, num_revisions, num_packages in c.weekly_stats:
+            js_date = week_date.replace('-', ',')
+            date = h.date_str_to_datetime(week_date)
+            c.packages_by_week.append('[new Date(%s), %s]' % (js_date, num_packages))
+            c.raw_packages_by_week.append({'date': date, 'total_packages': num_packages})
+            c.all_package_revisions.append('[new Date(%s), %s]' % (js_date, num_revisions))
+            c.raw_all_package_revisions.append({'date': date, 'total_revisions': num_revisions})
+            c.new_datasets.append('[new Date(%s), %s]' % (js_date, num_new))
+            c.raw_new_datasets.append({'date': date, 'new_packages': num_new})
 
         return p.toolkit.render('ckanext/stats/index.html')
 
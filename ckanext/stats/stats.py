@@ -14,12 +14,45 @@ if cache_enabled:
 
 DATE_FORMAT = '%Y-%m-%d'
 
+# system_info key of the timestamp of the last revision counted in the
+# weekly stats
+LAST_REVISION_KEY = 'ckanext.stats.last_revision_timestamp'
+LAST_REVISION_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+# The timestamps of the revisions are set when they are created, not when
+# they are committed, so revisions a bit older than the last one counted
+# can still turn up: the weeks from this long before it are recounted
+LATE_REVISIONS_MARGIN = datetime.timedelta(hours=1)
+
+# The stats tables are not in the CKAN model's metadata, so that they are
+# left alone when the model's tables are created and dropped
+stats_metadata = MetaData()
+
+# Number of new datasets, deleted datasets and dataset revisions of each
+# week, kept up to date by WeeklyStats.update()
+stats_week_table = Table('stats_week', stats_metadata,
+    Column('week_commences', Date, primary_key=True),
+    Column('new_packages', Integer, nullable=False, default=0),
+    Column('deleted_packages', Integer, nullable=False, default=0),
+    Column('package_revisions', Integer, nullable=False, default=0),
+)
+
+WEEKLY_COUNTS = ('new_packages', 'deleted_packages', 'package_revisions')
+
 def table(name):
     return Table(name, model.meta.metadata, autoload=True)
 
 def datetime2date(datetime_):
     return datetime.date(datetime_.year, datetime_.month, datetime_.day)
 
+def get_objects(model_class, ids):
+    '''Return a dict of the objects of model_class with the given ids,
+    loaded with a single query.'''
+    ids = [unicode(id_) for id_ in ids]
+    if not ids:
+        return {}
+    query = model.Session.query(model_class).filter(model_class.id.in_(ids))
+    return dict((obj.id, obj) for obj in query)
+
 
 class Stats(object):
     @classmethod
@@ -33,7 +66,8 @@ class Stats(object):
               order_by(func.avg(rating.c.rating).desc(), func.count(rating.c.rating).desc()).\
               limit(limit)
         res_ids = model.Session.execute(sql).fetchall()
-        res_pkgs = [(model.Session.query(model.Package).get(unicode(pkg_id)), avg, num) for pkg_id, avg, num in res_ids]
+        pkgs = get_objects(model.Package, [pkg_id for pkg_id, avg, num in res_ids])
+        res_pkgs = [(pkgs.get(pkg_id), avg, num) for pkg_id, avg, num in res_ids]
         return res_pkgs
 
     @classmethod
@@ -44,7 +78,8 @@ class Stats(object):
             order_by(func.count(package_revision.c.revision_id).desc()).\
             limit(limit)
         res_ids = model.Session.execute(s).fetchall()
-        res_pkgs = [(model.Session.query(model.Package).get(unicode(pkg_id)), val) for pkg_id, val in res_ids]
+        pkgs = get_objects(model.Package, [pkg_id for pkg_id, val in res_ids])
+        res_pkgs = [(pkgs.get(pkg_id), val) for pkg_id, val in res_ids]
         return res_pkgs
 
     @classmethod
@@ -57,7 +92,8 @@ class Stats(object):
             limit(limit)
 
         res_ids = model.Session.execute(s).fetchall()
-        res_groups = [(model.Session.query(model.Group).get(unicode(group_id)), val) for group_id, val in res_ids]
+        groups = get_objects(model.Group, [group_id for group_id, val in res_ids])
+        res_groups = [(groups.get(group_id), val) for group_id, val in res_ids]
         return res_groups
 
     @classmethod
@@ -81,7 +117,8 @@ class Stats(object):
         if returned_tag_info in ('id', 'name'):
             return res_col
         elif returned_tag_info == 'object':
-            res_tags = [(model.Session.query(model.Tag).get(unicode(tag_id)), val) for tag_id, val in res_col]
+            tags = get_objects(model.Tag, [tag_id for tag_id, val in res_col])
+            res_tags = [(tags.get(tag_id), val) for tag_id, val in res_col]
             return res_tags
 
     @classmethod
@@ -95,7 +132,8 @@ class Stats(object):
             order_by(func.count(user_object_role.c.role).desc()).\
             limit(limit)
         res_ids = model.Session.execute(s).fetchall()
-        res_users = [(model.Session.query(model.User).get(unicode(user_id)), val) for user_id, val in res_ids]
+        users = get_objects(model.User, [user_id for user_id, val in res_ids])
+        res_users = [(users.get(user_id), val) for user_id, val in res_ids]
         return res_users
 
 class RevisionStats(object):
@@ -218,12 +256,8 @@ class RevisionStats(object):
             first_date = (min(datetime.datetime.strptime(new_packages_by_week[0][0], DATE_FORMAT),
                               datetime.datetime.strptime(deleted_packages_by_week[0][0], DATE_FORMAT))).date()
             cls._cumulative_num_pkgs = 0
-            new_pkgs = []
-            deleted_pkgs = []
             def build_weekly_stats(week_commences, new_pkg_ids, deleted_pkg_ids):
                 num_pkgs = len(new_pkg_ids) - len(deleted_pkg_ids)
-                new_pkgs.extend([model.Session.query(model.Package).get(id).name for id in new_pkg_ids])
-                deleted_pkgs.extend([model.Session.query(model.Package).get(id).name for id in deleted_pkg_ids])
                 cls._cumulative_num_pkgs += num_pkgs
                 return (week_commences.strftime(DATE_FORMAT),
                         num_pkgs, cls._cumulative_num_pkgs)
@@ -349,5 +383,153 @@ class RevisionStats(object):
         if type_ in ('package_revision_rate', 'package_addition_rate'):
             return len(object_ids)
         elif type_ in ('new_packages', 'deleted_packages'):
-            return [ model.Session.query(model.Package).get(pkg_id) \
-                     for pkg_id in object_ids ]
+            pkgs = get_objects(model.Package, object_ids)
+            return [pkgs.get(pkg_id) for pkg_id in object_ids]
+
+
+class WeeklyStats(object):
+    '''Weekly dataset stats read from the stats_week table, so that they
+    don't need the whole revision history to be scanned.
+
+    The table is brought up to date with the revisions made since the last
+    update by update(), which is run by the ``paster stats update`` command.
+    '''
+    @classmethod
+    def update(cls):
+        '''Add the revisions made since the last update to the weekly stats.
+
+        The weeks of the revisions made since the last update (and of the
+        ones made up to LATE_REVISIONS_MARGIN before it, which may have been
+        committed after it) are counted again.
+
+        @return: the number of dataset revisions added
+        '''
+        stats_week_table.create(bind=model.meta.engine, checkfirst=True)
+        package_revision = table('package_revision')
+        revision = table('revision')
+        until = model.Session.execute(
+            select([func.max(revision.c.timestamp)])).scalar()
+        if until is None:
+            return 0
+        last = model.get_system_info(LAST_REVISION_KEY)
+        if last:
+            last = datetime.datetime.strptime(last, LAST_REVISION_FORMAT)
+            from_week = cls.get_date_week_started(last - LATE_REVISIONS_MARGIN)
+            from_ = datetime.datetime.combine(from_week, datetime.time())
+        else:
+            from_week = from_ = None
+
+        def in_range(column):
+            condition = column <= until
+            if from_:
+                condition = and_(column >= from_, condition)
+            return condition
+
+        weeks = {}
+        def add(count_name, date_, count):
+            week = cls.get_date_week_started(date_)
+            counts = weeks.setdefault(week, dict.fromkeys(WEEKLY_COUNTS, 0))
+            counts[count_name] += count
+
+        from_obj = [package_revision.join(revision)]
+        day = func.date(revision.c.timestamp)
+        s = select([day, func.count(package_revision.c.id)],
+                   from_obj=from_obj).\
+            where(in_range(revision.c.timestamp)).\
+            group_by(day)
+        num_revisions = 0
+        for date_, count in model.Session.execute(s):
+            add('package_revisions', date_, count)
+            num_revisions += count
+
+        # A dataset is new (or deleted) in the week of its first (deleted)
+        # revision, so only the datasets revised in the weeks recounted need
+        # to be looked at.
+        for count_name, state in (('new_packages', None),
+                                  ('deleted_packages', model.State.DELETED)):
+            revised = select([package_revision.c.id], from_obj=from_obj).\
+                where(in_range(revision.c.timestamp))
+            s = select([package_revision.c.id,
+                        func.min(revision.c.timestamp)], from_obj=from_obj)
+            if state:
+                revised = revised.where(package_revision.c.state == state)
+                s = s.where(package_revision.c.state == state)
+            s = s.where(package_revision.c.id.in_(revised)).\
+                group_by(package_revision.c.id)
+            for pkg_id, first in model.Session.execute(s):
+                if first <= until and not (from_ and first < from_):
+                    add(count_name, first, 1)
+
+        # replace the counts of the weeks recounted
+        week_column = stats_week_table.c.week_commences
+        counted = select([func.sum(stats_week_table.c.package_revisions)])
+        delete = stats_week_table.delete()
+        if from_week:
+            counted = counted.where(week_column >= from_week)
+            delete = delete.where(week_column >= from_week)
+        num_revisions -= model.Session.execute(counted).scalar() or 0
+        model.Session.execute(delete)
+        for week, counts in weeks.iteritems():
+            model.Session.execute(stats_week_table.insert().\
+                values(week_commences=week, **counts))
+        model.set_system_info(LAST_REVISION_KEY,
+                              until.strftime(LAST_REVISION_FORMAT))
+        # set_system_info doesn't commit when the value is unchanged
+        model.Session.commit()
+        return num_revisions
+
+    @classmethod
+    def rebuild(cls):
+        '''Recompute the weekly stats from the whole revision history.
+
+        @return: the number of dataset revisions counted
+        '''
+        stats_week_table.create(bind=model.meta.engine, checkfirst=True)
+        model.Session.execute(stats_week_table.delete())
+        model.delete_system_info(LAST_REVISION_KEY)
+        return cls.update()
+
+    @classmethod
+    def get_date_week_started(cls, date_):
+        if isinstance(date_, basestring):
+            # sqlite returns dates as strings
+            date_ = datetime.datetime.strptime(date_[:10], DATE_FORMAT)
+        return RevisionStats.get_date_week_started(date_)
+
+    @classmethod
+    def by_week(cls):
+        '''
+        @return: the stats of each week from the first one with a dataset
+                 revision to the current one, in format:
+                 [(week_commences, num_new_packages, num_deleted_packages,
+                   num_package_revisions, num_packages), ...]
+                 where num_packages is the number of datasets at the end
+                 of the week.
+        '''
+        s = select([stats_week_table]).\
+            order_by(stats_week_table.c.week_commences)
+        rows = None
+        if stats_week_table.exists(bind=model.meta.engine):
+            rows = dict((row['week_commences'], row)
+                        for row in model.Session.execute(s))
+        if not rows:
+            # not counted yet, e.g. on sites upgraded from a version which
+            # scanned the revisions each time
+            cls.update()
+            rows = dict((row['week_commences'], row)
+                        for row in model.Session.execute(s))
+        if not rows:
+            return []
+        week_commences = cls.get_date_week_started(min(rows))
+        this_week = cls.get_date_week_started(datetime.date.today())
+        num_packages = 0
+        weekly_stats = []
+        while week_commences <= this_week:
+            row = rows.get(week_commences)
+            counts = [row[name] if row else 0 for name in WEEKLY_COUNTS]
+            num_packages += counts[0] - counts[1]
+            weekly_stats.append(
+                tuple([week_commences.strftime(DATE_FORMAT)] + counts +
+                      [num_packages]))
+            week_commences += datetime.timedelta(days=7)
+        return weekly_stats
@@ -4,7 +4,8 @@ from nose.tools import assert_equal
 from ckan.lib.create_test_data import CreateTestData
 from ckan import model
 
-from ckanext.stats.stats import Stats, RevisionStats
+from ckanext.stats.stats import Stats, RevisionStats, WeeklyStats
+import ckanext.stats.stats as stats_lib
 from ckanext.stats.tests import StatsFixture
 
 class TestStatsPlugin(StatsFixture):
@@ -52,8 +53,14 @@ class TestStatsPlugin(StatsFixture):
         model.Package.by_name(u'test3').notes = 'Test 3 notes'
         model.repo.commit_and_remove()
 
+        WeeklyStats.rebuild()
+        model.repo.commit_and_remove()
+
     @classmethod
     def teardown_class(cls):
+        model.Session.execute(stats_lib.stats_week_table.delete())
+        model.delete_system_info(stats_lib.LAST_REVISION_KEY)
+        model.repo.commit_and_remove()
         CreateTestData.delete()
         
     def test_top_rated_packages(self):
@@ -136,3 +143,64 @@ class TestStatsPlugin(StatsFixture):
         assert_equal(num_packages_by_week[1], ('2011-01-10', -1, 3))
         assert_equal(num_packages_by_week[2], ('2011-01-17', 0, 3))
         assert_equal(num_packages_by_week[3], ('2011-01-24', 0, 3))
+
+    def test_weekly_stats(self):
+        weekly_stats = WeeklyStats.by_week()
+        num_setup_revs = weekly_stats[0][3]
+        assert 6 > num_setup_revs > 2, num_setup_revs
+        assert_equal(weekly_stats[0], ('2011-01-03', 4, 0, num_setup_revs, 4))
+        assert_equal(weekly_stats[1], ('2011-01-10', 0, 1, 1, 3))
+        assert_equal(weekly_stats[2], ('2011-01-17', 0, 0, 2, 3))
+        assert_equal(weekly_stats[3], ('2011-01-24', 0, 0, 1, 3))
+        this_week = RevisionStats.get_date_week_started(datetime.date.today())
+        assert_equal(weekly_stats[-1],
+                     (this_week.strftime('%Y-%m-%d'), 0, 0, 0, 3))
+
+    def test_weekly_stats_update(self):
+        weekly_stats = WeeklyStats.by_week()
+        # the revisions are only counted once
+        assert_equal(WeeklyStats.update(), 0)
+        assert_equal(WeeklyStats.by_week(), weekly_stats)
+
+
+class TestWeeklyStatsUpdate(StatsFixture):
+    def setup(self):
+        CreateTestData.create_arbitrary([{'name': 'test1'}])
+        rev = model.repo.new_revision()
+        rev.timestamp = datetime.datetime(2011, 1, 5)
+        model.Package.by_name(u'test1').title = 'Test 1'
+        model.repo.commit_and_remove()
+
+    def teardown(self):
+        model.Session.execute(stats_lib.stats_week_table.delete())
+        model.delete_system_info(stats_lib.LAST_REVISION_KEY)
+        model.repo.rebuild_db()
+
+    def _revisions(self, week):
+        return dict((row[0], row[3]) for row in WeeklyStats.by_week())[week]
+
+    def test_counted_when_viewed(self):
+        # the stats are counted if they haven't been yet
+        assert model.get_system_info(stats_lib.LAST_REVISION_KEY) is None
+        assert_equal(self._revisions('2011-01-03'), 1)
+
+    def test_late_revision(self):
+        rev = model.repo.new_revision()
+        rev.timestamp = datetime.datetime(2011, 1, 6)
+        model.Package.by_name(u'test1').notes = 'Test 1 notes'
+        model.repo.commit_and_remove()
+        WeeklyStats.update()
+        this_week = RevisionStats.get_date_week_started(datetime.date.today())
+        this_week = this_week.strftime('%Y-%m-%d')
+        revisions = self._revisions(this_week)
+
+        # created before the last update, but committed after it
+        rev = model.repo.new_revision()
+        rev.timestamp = datetime.datetime.strptime(
+            model.get_system_info(stats_lib.LAST_REVISION_KEY),
+            stats_lib.LAST_REVISION_FORMAT) - datetime.timedelta(seconds=1)
+        model.Package.by_name(u'test1').notes = 'Test 1 late notes'
+        model.repo.commit_and_remove()
+        assert_equal(WeeklyStats.update(), 1)
+        assert_equal(self._revisions(this_week), revisions + 1)
+        assert_equal(self._revisions('2011-01-03'), 2)
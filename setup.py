@@ -77,6 +77,7 @@ setup(
     dataset = ckan.lib.cli:DatasetCmd
     search-index = ckan.lib.cli:SearchIndexCommand
     ratings = ckan.lib.cli:Ratings
+    dashboard = ckan.lib.cli:DashboardCommand
     notify = ckan.lib.cli:Notification
     celeryd = ckan.lib.cli:Celery
     rdf-export = ckan.lib.cli:RDFExport
@@ -89,6 +90,7 @@ setup(
     minify = ckan.lib.cli:MinifyCommand
     less = ckan.lib.cli:LessCommand
     datastore = ckanext.datastore.commands:SetupDatastoreCommand
+    stats = ckanext.stats.commands:StatsCommand
     front-end-build = ckan.lib.cli:FrontEndBuildCommand
 
 
@@ -129,6 +131,7 @@ setup(
 
     [ckan.system_plugins]
     domain_object_mods = ckan.model.modification:DomainObjectModificationExtension
+    facet_display_names = ckan.lib.search.facets:FacetDisplayNamesPlugin
 
     [babel.extractors]
 	    ckan = ckan.lib.extract:extract_ckan